@@ -0,0 +1,274 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: ann_index.py
+# Cont:
+#   Class:
+#       1) IVFIndex
+#   Func:
+#       1) train_kmeans                     2) build_ivf_index
+#       3) save_ivf_index                   4) load_ivf_index
+#       5) iter_ann_exp_word
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from tqdm import tqdm
+from embd_store import is_embd_store, load_embd_store, embd_fingerprint, normalize_rows
+
+class IVFIndex():
+    """ Inverted file index over unit-normalized word embeddings with optional
+    product quantization (IVF-PQ) of the residuals.
+    """
+
+    def __init__(self, centroids, list_ptr, list_ids, codebooks=None, codes=None, nprobe=8, rerank=100):
+        """ Constructor for IVFIndex.
+        Param:
+            param1 [self] reference to this object.
+            param2 [np.ndarray] float32 of shape (n_list, dim) unit-normalized
+                coarse centroids.
+            param3 [np.ndarray] int64 of shape (n_list+1,) where the row numbers
+                of list l are param4[param3[l]:param3[l+1]].
+            param4 [np.ndarray] int32 row numbers of words grouped by list.
+            param5 [np.ndarray] float32 of shape (n_sub, n_code, dim/n_sub) PQ
+                codebooks of residuals, or None for exact scoring.
+            param6 [np.ndarray] uint8 of shape (n_words, n_sub) PQ codes.
+            param7 [int] number of nearest lists to search per query.
+            param8 [int] number of PQ candidates to rescore exactly per query.
+        """
+        self.centroids = centroids
+        self.list_ptr = list_ptr
+        self.list_ids = list_ids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+    def search(self, query_index, exp_matrix, k):
+        """ Find approximate nearest words of a batch of words.
+        Param:
+            param1 [self] reference to this object.
+            param2 [np.ndarray] of row numbers of query words in param3.
+            param3 [np.ndarray] float32 unit-normalized embeddings of every word.
+            param4 [int] number of nearest words to pick per query.
+        Return:
+            return1 [list] of np.ndarray row numbers of nearest words ordered
+                ascendingly by cosine distance, at most param4 each.
+            return2 [list] of np.ndarray float32 cosine distances.
+        Note:
+            1) A query word is never its own nearest word.
+            2) Fewer than param4 words are returned if the probed lists hold
+                fewer candidates.
+        """
+        query_matrix = np.asarray(exp_matrix[query_index], dtype=np.float32)
+        cent_sim = np.dot(query_matrix, self.centroids.T)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe_tile = np.argpartition(-cent_sim, nprobe-1, axis=1)[:, :nprobe]
+        cand_list = []
+
+        for query_row, (query, probe_list) in enumerate(zip(query_index, probe_tile)):
+            # Step 1: Gather candidates from the probed lists.
+            sizes = self.list_ptr[probe_list+1] - self.list_ptr[probe_list]
+            cand = np.concatenate([self.list_ids[self.list_ptr[l]:self.list_ptr[l+1]] for l in probe_list]).astype(np.int64)
+            keep = cand != query # exclude query word
+            cand = cand[keep]
+
+            # Step 2: Shortlist candidates by PQ scores if available.
+            if self.codebooks is not None and len(cand) > self.rerank:
+                n_sub, _, sub_dim = self.codebooks.shape
+                table = np.einsum("mcd,md->mc", self.codebooks, query_matrix[query_row].reshape(n_sub, sub_dim))
+                approx = np.repeat(cent_sim[query_row, probe_list], sizes)[keep]
+                approx += table[np.arange(n_sub), self.codes[cand]].sum(axis=1)
+                cand = cand[np.argpartition(-approx, self.rerank-1)[:self.rerank]]
+            cand_list.append(np.sort(cand))
+
+        # Step 3: Score candidates of the batch exactly in one product, the same
+        #   way as gen_tt.iter_exp_word() does.
+        union = np.unique(np.concatenate(cand_list)) if cand_list else np.empty(0, dtype=np.int64)
+        cos_tile = np.dot(query_matrix, np.asarray(exp_matrix[union], dtype=np.float32).T)
+        cos_tile *= -1
+        cos_tile += 1
+        np.clip(cos_tile, 0, 2, out=cos_tile)
+        exp_idx_list = []
+        exp_dist_list = []
+
+        for query_row, cand in enumerate(cand_list):
+            cos_list = cos_tile[query_row, np.searchsorted(union, cand)]
+            order = np.lexsort((cand, cos_list))[:k]
+            exp_idx_list.append(cand[order])
+            exp_dist_list.append(cos_list[order])
+
+        return exp_idx_list, exp_dist_list
+
+def train_kmeans(sample_matrix, n_cluster, seed):
+    """ Train k-means centroids.
+    Param:
+        param1 [np.ndarray] float32 of training vectors.
+        param2 [int] number of clusters.
+        param3 [int] random seed.
+    Return:
+        return1 [np.ndarray] float32 of shape (param2, dim) centroids.
+    """
+    kmeans = MiniBatchKMeans(n_clusters=min(n_cluster, len(sample_matrix)), random_state=seed, n_init=1)
+    kmeans.fit(sample_matrix)
+
+    return kmeans.cluster_centers_.astype(np.float32)
+
+def build_ivf_index(embd_matrix, n_list, n_sub, n_train=100000, seed=0, block_size=65536):
+    """ Build an IVF or IVF-PQ index.
+    Param:
+        param1 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param2 [int] number of inverted lists.
+        param3 [int] number of PQ subspaces, 0 to skip product quantization.
+        param4 [int] max number of words sampled to train centroids.
+        param5 [int] random seed.
+        param6 [int] number of words to assign at a time.
+    Return:
+        return1 [IVFIndex] object.
+    """
+    n_words, dim = embd_matrix.shape
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n_words, size=min(n_train, n_words), replace=False))
+    sample_matrix = np.asarray(embd_matrix[sample], dtype=np.float32)
+
+    # Step 1: Train coarse centroids on the unit sphere.
+    print('Training', n_list, 'coarse centroids on', len(sample), 'words...')
+    centroids = train_kmeans(sample_matrix, n_list, seed)
+    centroids = normalize_rows(centroids, centroids)
+
+    # Step 2: Assign every word to its most similar centroid.
+    assign = np.empty(n_words, dtype=np.int64)
+    for start in tqdm(range(0, n_words, block_size)):
+        assign[start:start+block_size] = np.dot(embd_matrix[start:start+block_size], centroids.T).argmax(axis=1)
+    list_ids = np.argsort(assign, kind="stable").astype(np.int32)
+    list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]).astype(np.int64)
+
+    # Step 3: Quantize residuals to centroids by subspace.
+    codebooks = codes = None
+    if n_sub:
+        if dim % n_sub:
+            raise ValueError("Embedding dimension %d is not divisible by %d PQ subspaces." % (dim, n_sub))
+        sub_dim = dim // n_sub
+        sample_resid = sample_matrix - centroids[assign[sample]]
+        print('Training', n_sub, 'PQ codebooks...')
+        codebooks = np.stack([train_kmeans(sample_resid[:, m*sub_dim:(m+1)*sub_dim], 256, seed) for m in range(n_sub)])
+        codes = np.empty((n_words, n_sub), dtype=np.uint8)
+        for start in tqdm(range(0, n_words, block_size)):
+            resid = np.asarray(embd_matrix[start:start+block_size], dtype=np.float32) - centroids[assign[start:start+block_size]]
+            for m in range(n_sub):
+                sub_resid = resid[:, m*sub_dim:(m+1)*sub_dim]
+                sq_dist = -2*np.dot(sub_resid, codebooks[m].T) + (codebooks[m]**2).sum(axis=1)
+                codes[start:start+block_size, m] = sq_dist.argmin(axis=1)
+
+    return IVFIndex(centroids, list_ptr, list_ids, codebooks, codes)
+
+def save_ivf_index(ivf_index, index_path, fingerprint):
+    """ Save an IVF index.
+    Param:
+        param1 [IVFIndex] object.
+        param2 [string] path to the index directory to create.
+        param3 [string] fingerprint of the embeddings the index is built on.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    np.save(os.path.join(index_path, "centroids.npy"), ivf_index.centroids)
+    np.save(os.path.join(index_path, "list_ptr.npy"), ivf_index.list_ptr)
+    np.save(os.path.join(index_path, "list_ids.npy"), ivf_index.list_ids)
+    if ivf_index.codebooks is not None:
+        np.save(os.path.join(index_path, "codebooks.npy"), ivf_index.codebooks)
+        np.save(os.path.join(index_path, "codes.npy"), ivf_index.codes)
+
+    meta = {
+        "n_list": len(ivf_index.centroids),
+        "n_sub": 0 if ivf_index.codebooks is None else len(ivf_index.codebooks),
+        "n_words": len(ivf_index.list_ids),
+        "fingerprint": fingerprint,
+    }
+    with open(os.path.join(index_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+def load_ivf_index(index_path, fingerprint, nprobe, rerank):
+    """ Load an IVF index saved by save_ivf_index().
+    Param:
+        param1 [string] path to the index directory.
+        param2 [string] fingerprint of the embeddings to search.
+        param3 [int] number of nearest lists to search per query.
+        param4 [int] number of PQ candidates to rescore exactly per query.
+    Return:
+        return1 [IVFIndex] object with memory-mapped arrays.
+    """
+    with open(os.path.join(index_path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["fingerprint"] != fingerprint:
+        raise ValueError("Index " + index_path + " was built on different word embeddings.")
+
+    load = lambda name: np.load(os.path.join(index_path, name), mmap_mode="r")
+    codebooks = np.asarray(load("codebooks.npy")) if meta["n_sub"] else None
+    codes = load("codes.npy") if meta["n_sub"] else None
+
+    return IVFIndex(np.asarray(load("centroids.npy")), np.asarray(load("list_ptr.npy")), load("list_ids.npy"), codebooks, codes, nprobe, rerank)
+
+def iter_ann_exp_word(rep_index, exp_matrix, expk, tile_size, ivf_index):
+    """ Find approximate expansion words of representative words one tile at a
+    time. A drop-in for gen_tt.iter_exp_word().
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] number of representative words per tile.
+        param5 [IVFIndex] object built on param2.
+    Yield:
+        yield1 [int] position of the first representative word of the tile.
+        yield2 [list] of np.ndarray row numbers of expanded words ordered
+            ascendingly by cosine distance.
+        yield3 [list] of np.ndarray float32 cosine distances.
+    """
+    for start in range(0, len(rep_index), tile_size):
+        exp_idx_tile, exp_dist_tile = ivf_index.search(rep_index[start:start+tile_size], exp_matrix, expk)
+
+        yield start, exp_idx_tile, exp_dist_tile
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Build an approximate nearest neighbor index over word embeddings.")
+    parser.add_argument("-embd", help="Path to load word embeddings binary store.")
+    parser.add_argument("-index", help="Path to save the index.")
+    parser.add_argument("-nlist", type=int, default=1024, help="(Default 1024) Number of inverted lists.")
+    parser.add_argument("-pq", type=int, default=0, help="(Default 0) Number of PQ subspaces, 0 for exact scoring within lists.")
+    parser.add_argument("-ntrain", type=int, default=100000, help="(Default 100000) Max number of words to train centroids.")
+    parser.add_argument("-seed", type=int, default=0, help="(Default 0) Random seed.")
+    args = parser.parse_args()
+
+    if args.embd == None or not is_embd_store(args.embd):
+        print('Please specify a path to load word embeddings binary store, see embd_store.py.')
+        sys.exit()
+    elif args.index == None:
+        print('Please specify a path to save the index.')
+        sys.exit()
+
+    print('Start building ANN index...')
+
+    # Step 2: Build and save the index.
+    _, embd_matrix = load_embd_store(args.embd, norm=True)
+    ivf_index = build_ivf_index(embd_matrix, args.nlist, args.pq, args.ntrain, args.seed)
+    save_ivf_index(ivf_index, args.index, embd_fingerprint(args.embd))
+
+    print('Finished building ANN index!\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: bench_service.py
+# Cont:
+#   Func:
+#       1) sample_keys                      2) make_query
+#       3) run_load                         4) summarize_latency
+
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+import numpy as np
+from ice_service import ICEService, UnixHTTPConnection, make_server
+
+def sample_keys(index, kind, n_query, batch_size, seed=0):
+    """ Sample entities or words to look up.
+    Param:
+        param1 [ICEIndex] object of the network to query.
+        param2 [string] "expand" for entities or "neighbors" for words.
+        param3 [int] number of queries.
+        param4 [int] number of keys per query.
+        param5 [int] random seed.
+    Return:
+        return1 [list] of lists of keys, one per query.
+    """
+    item_list = index.entity_list if kind == "expand" else index.word_list
+    rng = np.random.default_rng(seed)
+    pos = rng.integers(0, len(item_list), size=(n_query, batch_size))
+
+    return [[item_list[p] for p in row] for row in pos.tolist()]
+
+def make_query(mode, kind, topn, service=None, address=None):
+    """ Make a function which runs one query.
+    Param:
+        param1 [string] "api", "http" or "unix".
+        param2 [string] "expand" or "neighbors".
+        param3 [int] number of words to return per key, 0 for all.
+        param4 [ICEService] object to query in "api" mode.
+        param5 [tuple] (host, port) in "http" mode or socket path in "unix"
+            mode.
+    Return:
+        return1 [function] of a list of keys which returns the results.
+    Note:
+        1) Every thread calls make_query() for its own keep-alive connection.
+    """
+    if mode == "api":
+        query_func = service.expand_batch if kind == "expand" else service.neighbors_batch
+        return lambda key_list: query_func(key_list, topn)
+
+    conn = UnixHTTPConnection(address) if mode == "unix" else http.client.HTTPConnection(*address)
+    key_name = "entity" if kind == "expand" else "word"
+
+    def query(key_list):
+        conn.request("GET", "/" + kind + "?" + urlencode([(key_name, key) for key in key_list] + [("topn", topn)]))
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError("Query failed with HTTP " + str(response.status) + ": " + body.decode())
+        return json.loads(body)
+
+    return query
+
+def run_load(query_maker, query_list, n_thread):
+    """ Run queries from several threads and time each of them.
+    Param:
+        param1 [function] without arguments which returns a query function,
+            see make_query().
+        param2 [list] of lists of keys, one per query.
+        param3 [int] number of client threads.
+    Return:
+        return1 [np.ndarray] latency of every query in seconds.
+        return2 [float] wall time in seconds.
+    """
+    latency = np.zeros(len(query_list))
+    error_list = []
+
+    def worker(thread_id):
+        try:
+            query = query_maker()
+            for pos in range(thread_id, len(query_list), n_thread):
+                begin = time.perf_counter()
+                query(query_list[pos])
+                latency[pos] = time.perf_counter() - begin
+        except Exception as error:
+            error_list.append(error)
+
+    thread_list = [threading.Thread(target=worker, args=(thread_id,)) for thread_id in range(n_thread)]
+    begin = time.perf_counter()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    wall_s = time.perf_counter() - begin
+    if error_list:
+        raise error_list[0]
+
+    return latency, wall_s
+
+def summarize_latency(latency, wall_s, batch_size):
+    """ Summarize the latency of a load test.
+    Param:
+        param1 [np.ndarray] latency of every query in seconds.
+        param2 [float] wall time in seconds.
+        param3 [int] number of keys per query.
+    Return:
+        return1 [dict] with p50, p99 and max latency in microseconds, and
+            queries and keys per second.
+    """
+    return {
+        "queries": len(latency),
+        "p50_us": round(float(np.percentile(latency, 50)) * 1e6, 1),
+        "p99_us": round(float(np.percentile(latency, 99)) * 1e6, 1),
+        "max_us": round(float(latency.max()) * 1e6, 1),
+        "qps": round(len(latency) / max(wall_s, 1e-9), 1),
+        "keys_per_s": round(len(latency) * batch_size / max(wall_s, 1e-9), 1),
+    }
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Load test the ICE query service.")
+    parser.add_argument("-ice_bin", help="Path to load binary ICE network to sample keys from and to serve.")
+    parser.add_argument("-mode", choices=["api", "http", "unix"], default="api", help="(Default api) Query the Python API, HTTP over TCP or HTTP over a Unix socket.")
+    parser.add_argument("-kind", choices=["expand", "neighbors"], default="expand", help="(Default expand) Expanded concepts of entities or TT neighbors of words.")
+    parser.add_argument("-url", help="(Optional) host:port of a running service in http mode, else one is started in this process.")
+    parser.add_argument("-socket", help="(Optional) Socket path of a running service in unix mode, else one is started in this process.")
+    parser.add_argument("-n", type=int, default=10000, help="(Default 10000) Number of queries.")
+    parser.add_argument("-batch", type=int, default=1, help="(Default 1) Number of keys per query.")
+    parser.add_argument("-topn", type=int, default=10, help="(Default 10) Number of words to return per key, 0 for all. Must be 0 to expand on unweighted networks.")
+    parser.add_argument("-threads", type=int, default=1, help="(Default 1) Number of client threads.")
+    parser.add_argument("-seed", type=int, default=0, help="(Default 0) Random seed.")
+    parser.add_argument("-out", help="(Optional) Path to save results JSON file.")
+    args = parser.parse_args()
+
+    if args.ice_bin == None:
+        print('Please specify a path to load binary ICE network.')
+        sys.exit()
+
+    # Step 2: Open the service to query.
+    service = ICEService(args.ice_bin)
+    if args.kind == "expand" and args.topn > 0 and not service.index.weighted:
+        print('Please specify -topn 0 to expand on an unweighted ICE network.')
+        sys.exit()
+    server = None
+    address = None
+    if args.mode == "http":
+        address = tuple(args.url.rsplit(":", 1)) if args.url != None else None
+    elif args.mode == "unix":
+        address = args.socket
+    if args.mode != "api" and address == None:
+        socket_path = "/tmp/ice_service_bench.sock" if args.mode == "unix" else None
+        server = make_server(service, socket_path=socket_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = socket_path if args.mode == "unix" else server.server_address[:2]
+
+    # Step 3: Warm up then time the queries.
+    query_list = sample_keys(service.index, args.kind, args.n, args.batch, args.seed)
+    query_maker = lambda: make_query(args.mode, args.kind, args.topn, service, address)
+    run_load(query_maker, query_list[:min(1000, args.n)], 1)
+    latency, wall_s = run_load(query_maker, query_list, args.threads)
+
+    result = dict(summarize_latency(latency, wall_s, args.batch), mode=args.mode, kind=args.kind, batch=args.batch, topn=args.topn, threads=args.threads)
+    print(result)
+    if args.out != None:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print("Saved results to", args.out)
+    if server != None:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
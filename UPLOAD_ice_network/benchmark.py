@@ -0,0 +1,236 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: benchmark.py
+# Cont:
+#   Func:
+#       1) gen_synthetic_data               2) count_lines
+#       3) run_stage                        4) run_benchmark
+#       5) compare_results
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+STAGE_LIST = ["gen_et", "gen_tt", "gen_ice", "pipeline"]
+
+def gen_synthetic_data(data_path, n_entity, n_keyword, n_vocab, dim, seed=0):
+    """ Generate ET information and word embeddings in the formats gen_et.py
+    and gen_tt.py consume.
+    Param:
+        param1 [string] path to a directory to save "info.json" and "embd.txt"
+            in.
+        param2 [int] number of entities.
+        param3 [int] number of keywords per entity.
+        param4 [int] number of words with embeddings.
+        param5 [int] dimension of embeddings.
+        param6 [int] random seed.
+    Return:
+        return1 [string] path to the ET information JSON file.
+        return2 [string] path to the word embedding text file.
+    Note:
+        1) Keywords follow a Zipf-like frequency so entities share words as in
+            real catalogs, and about 2% of keywords have no embedding.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    info_path = os.path.join(data_path, "info.json")
+    embd_path = os.path.join(data_path, "embd.txt")
+    rng = np.random.default_rng(seed)
+
+    # Step 1: Save ET information of every entity.
+    n_word = int(n_vocab * 1.02) + 1
+    word_p = 1.0 / (np.arange(n_word) + 10.0)
+    word_p /= word_p.sum()
+    word_id_matrix = rng.choice(n_word, size=(n_entity, 2*n_keyword), p=word_p)
+    with open(info_path, "w") as f:
+        f.write("[")
+        for entity, word_id_list in enumerate(word_id_matrix.tolist()):
+            keyword_list = ["w"+str(word_id) for word_id in dict.fromkeys(word_id_list)][:n_keyword]
+            score_list = sorted(rng.random(len(keyword_list)).tolist(), reverse=True)
+            f.write(("," if entity else "") + json.dumps({"id":"e"+str(entity), "keywords":keyword_list, "scores":score_list}))
+        f.write("]")
+
+    # Step 2: Save word embeddings with a header line.
+    embd_word_id = rng.permutation(n_word)[:n_vocab]
+    with open(embd_path, "w") as f:
+        f.write(str(n_vocab) + " " + str(dim) + "\n")
+        for start in range(0, n_vocab, 10000):
+            block = rng.standard_normal((len(embd_word_id[start:start+10000]), dim)).astype(np.float32)
+            f.write("".join("w" + str(word_id) + " " + " ".join("%.5f" % x for x in row) + "\n" for word_id, row in zip(embd_word_id[start:start+10000].tolist(), block.tolist())))
+
+    return info_path, embd_path
+
+def count_lines(path):
+    """ Count lines of a file.
+    Param:
+        param1 [string] path to the file.
+    Return:
+        return1 [int] number of lines.
+    """
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1<<24), b""))
+
+def run_stage(arg_list, out_path):
+    """ Run one stage as a child process and measure it.
+    Param:
+        param1 [list] of arguments after the python executable.
+        param2 [string] path to the edge list the stage saves.
+    Return:
+        return1 [dict] where key="wall_s", "peak_rss_mb", "edges" and
+            "edges_per_s" & val=measurement.
+    Note:
+        1) Peak RSS comes from wait4() of the child, so stages are measured
+            independently of this process and of each other.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable] + arg_list, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError("Stage " + " ".join(arg_list[:1]) + " failed:\n" + stderr.decode()[-2000:])
+
+    edges = count_lines(out_path)
+
+    return {
+        "wall_s": round(wall, 4),
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1), # KB on Linux
+        "edges": edges,
+        "edges_per_s": round(edges / max(wall, 1e-9), 1),
+    }
+
+def run_benchmark(config, work_path, stage_list=STAGE_LIST, n_repeat=1):
+    """ Generate a synthetic workload and benchmark every stage on it.
+    Param:
+        param1 [dict] where key="entities", "keywords", "vocab", "dim",
+            "repk", "expk", "workers" and "seed" & val=setting.
+        param2 [string] path to a directory for inputs and outputs.
+        param3 [list] of stages to run, amongst STAGE_LIST.
+        param4 [int] number of runs per stage, the fastest one is kept.
+    Return:
+        return1 [dict] of "config", "env" and "stages" results.
+    Note:
+        1) gen_tt and gen_ice run on the outputs of gen_et and gen_tt, so
+            they need the stages before them.
+    """
+    print("Generating synthetic data...")
+    info_path, embd_path = gen_synthetic_data(os.path.join(work_path, "data"), config["entities"], config["keywords"], config["vocab"], config["dim"], config["seed"])
+    out = lambda name: os.path.join(work_path, name)
+    repk, expk, workers = str(config["repk"]), str(config["expk"]), str(config["workers"])
+
+    stage_arg_dict = {
+        "gen_et": (["gen_et.py", "-info", info_path, "-embd", embd_path, "-repk", repk, "-max_repk", repk, "-et", out("et.edge"), "-w", "1", "-quiet", "1", "-force", "1"], out("et.edge")),
+        "gen_tt": (["gen_tt.py", "-embd", embd_path, "-et", out("et.edge"), "-expk", expk, "-tt", out("tt.edge"), "-w", "1", "-workers", workers, "-quiet", "1", "-force", "1"], out("tt.edge")),
+        "gen_ice": (["gen_ice.py", "-et", out("et.edge"), "-tt", out("tt.edge"), "-ice_full", out("ice_full.edge"), "-w", "1", "-quiet", "1", "-force", "1"], out("ice_full.edge")),
+        "pipeline": (["pipeline.py", "-info", info_path, "-embd", embd_path, "-repk", repk, "-expk", expk, "-w", "1", "-workers", workers, "-ice_full", out("pipeline_full.edge"), "-quiet", "1"], out("pipeline_full.edge")),
+    }
+
+    stage_dict = {}
+    for stage in stage_list:
+        print("Running", stage, "...")
+        run_list = [run_stage(*stage_arg_dict[stage]) for _ in range(n_repeat)]
+        stage_dict[stage] = min(run_list, key=lambda run: run["wall_s"])
+        print(" ", stage_dict[stage])
+
+    env = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+    return {"config":config, "env":env, "stages":stage_dict}
+
+def compare_results(result, baseline, tolerance):
+    """ Compare benchmark results with a baseline and report regressions.
+    Param:
+        param1 [dict] results of run_benchmark().
+        param2 [dict] baseline results of run_benchmark().
+        param3 [float] relative slowdown or memory growth allowed, e.g. 0.1.
+    Return:
+        return1 [list] of 3-tuples of stage, metric and ratio of regressions.
+    Note:
+        1) Only stages and metrics in both results are compared, and results
+            of different configs are compared with a warning.
+    """
+    if result["config"] != baseline["config"]:
+        print("Warning: configs differ,", baseline["config"], "vs", result["config"])
+
+    regression_list = []
+    print("%-10s %-12s %12s %12s %8s" % ("stage", "metric", "baseline", "current", "ratio"))
+    for stage, base_stat in baseline["stages"].items():
+        if stage not in result["stages"]:
+            continue
+        for metric in ["wall_s", "peak_rss_mb"]:
+            ratio = result["stages"][stage][metric] / max(base_stat[metric], 1e-9)
+            flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+            print("%-10s %-12s %12s %12s %8.3f%s" % (stage, metric, base_stat[metric], result["stages"][stage][metric], ratio, flag))
+            if flag:
+                regression_list.append((stage, metric, ratio))
+
+    return regression_list
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Benchmark ICE stages on synthetic workloads.")
+    parser.add_argument("-entities", type=int, default=10000, help="(Default 10000) Number of entities.")
+    parser.add_argument("-keywords", type=int, default=20, help="(Default 20) Number of keywords per entity.")
+    parser.add_argument("-vocab", type=int, default=50000, help="(Default 50000) Number of words with embeddings.")
+    parser.add_argument("-dim", type=int, default=100, help="(Default 100) Dimension of embeddings.")
+    parser.add_argument("-repk", type=int, default=10, help="(Default 10) Number of representative words per entity.")
+    parser.add_argument("-expk", type=int, default=10, help="(Default 10) Number of expanded words per representative words.")
+    parser.add_argument("-workers", type=int, default=1, help="(Default 1) Number of worker processes of gen_tt.")
+    parser.add_argument("-seed", type=int, default=0, help="(Default 0) Random seed.")
+    parser.add_argument("-stages", nargs="+", choices=STAGE_LIST, default=STAGE_LIST, help="(Default all) Stages to run.")
+    parser.add_argument("-repeat", type=int, default=1, help="(Default 1) Number of runs per stage, the fastest is kept.")
+    parser.add_argument("-work", default="bench_work", help="(Default bench_work) Directory for synthetic inputs and outputs.")
+    parser.add_argument("-out", help="(Optional) Path to save results JSON file.")
+    parser.add_argument("-result", help="(Optional) Path to load results JSON file instead of running.")
+    parser.add_argument("-baseline", help="(Optional) Path to load baseline results JSON file to compare with.")
+    parser.add_argument("-tol", type=float, default=0.1, help="(Default 0.1) Allowed relative regression against baseline.")
+    args = parser.parse_args()
+
+    # Step 2: Run the benchmark or load results.
+    if args.result != None:
+        with open(args.result) as f:
+            result = json.load(f)
+    else:
+        config = {"entities":args.entities, "keywords":args.keywords, "vocab":args.vocab, "dim":args.dim, "repk":args.repk, "expk":args.expk, "workers":args.workers, "seed":args.seed}
+        result = run_benchmark(config, args.work, args.stages, args.repeat)
+        if args.out != None:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2)
+            print("Saved results to", args.out)
+
+    # Step 3: Compare with baseline.
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regression_list = compare_results(result, baseline, args.tol)
+        if regression_list:
+            print("Found", len(regression_list), "regressions beyond", args.tol)
+            sys.exit(1)
+        print("No regressions beyond", args.tol)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: checkpoint.py
+# Cont:
+#   Class:
+#       1) ShardCheckpoint
+#   Func:
+#       1) get_checkpoint_key
+
+import hashlib
+import json
+import os
+import numpy as np
+
+CHECKPOINT_META = "meta.json"
+SHARD_PREFIX = "shard-"
+
+def get_checkpoint_key(manifest, param_dict):
+    """ Get the key of a run to resume, see ShardCheckpoint.
+    Param:
+        param1 [dict] manifest of the run, see stage_cache.stage_manifest().
+        param2 [dict] of parameters which change the shards.
+    Return:
+        return1 [string] hex SHA-1 digest of the input hashes, code and
+            parameters.
+    """
+    key_dict = {
+        "stage": manifest["stage"],
+        "inputs": [known["sha1"] for known in manifest["inputs"]],
+        "code": manifest["code"],
+        "params": param_dict,
+    }
+
+    return hashlib.sha1(json.dumps(key_dict, sort_keys=True).encode()).hexdigest()
+
+class ShardCheckpoint():
+    """ Directory of the completed shards of a run, so that a restarted run
+    replays them instead of computing them again.
+    Each shard holds one text part per output and optionally arrays, and is
+    marked done only after all of them are saved.
+    """
+
+    def __init__(self, ckpt_dir, key):
+        """ Constructor for ShardCheckpoint.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the checkpoint directory.
+            param3 [string] key of the run, see get_checkpoint_key(). Shards
+                of a run with another key are removed.
+        Note:
+            1) Only files made by a checkpoint are ever removed, and a
+                non-empty directory without meta.json is refused.
+        """
+        self.ckpt_dir = ckpt_dir
+        meta_path = os.path.join(ckpt_dir, CHECKPOINT_META)
+        meta = None
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        elif os.path.isdir(ckpt_dir) and os.listdir(ckpt_dir):
+            raise ValueError("Checkpoint directory " + ckpt_dir + " is not empty and holds no checkpoint.")
+
+        if meta == None or meta["key"] != key:
+            os.makedirs(ckpt_dir, exist_ok=True)
+            self.remove_shards()
+            with open(meta_path, "w") as f:
+                json.dump({"key":key}, f)
+
+        self.n_done = sum(name.endswith(".done") for name in os.listdir(ckpt_dir))
+        if self.n_done:
+            print("Resuming from", self.n_done, "completed shards in", ckpt_dir)
+
+    def get_shard_path(self, shard_id, suffix):
+        """ Get the path of a file of a shard.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+            param3 [string] suffix of the file.
+        Return:
+            return1 [string] path in the checkpoint directory.
+        """
+        return os.path.join(self.ckpt_dir, SHARD_PREFIX + "{:08d}.{}".format(shard_id, suffix))
+
+    def is_done(self, shard_id):
+        """ Check whether a shard is completed.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+        Return:
+            return1 [bool] True if close_shard() finished for the shard.
+        """
+        return os.path.isfile(self.get_shard_path(shard_id, "done"))
+
+    def open_shard(self, shard_id, n_part):
+        """ Open the text parts of a shard to write.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+            param3 [int] number of text parts, one per output.
+        Return:
+            return1 [list] of files to write each part to.
+        """
+        return [open(self.get_shard_path(shard_id, "{}.tmp".format(part)), "w") for part in range(n_part)]
+
+    def close_shard(self, shard_id, part_f_list, array_dict=None):
+        """ Save a shard and mark it done.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+            param3 [list] of files returned by open_shard().
+            param4 [dict] where key=name & val=np.ndarray to keep with the
+                shard, or None.
+        """
+        for part, part_f in enumerate(part_f_list):
+            part_f.close()
+            os.replace(self.get_shard_path(shard_id, "{}.tmp".format(part)), self.get_shard_path(shard_id, str(part)))
+        if array_dict != None:
+            with open(self.get_shard_path(shard_id, "npz"), "wb") as f:
+                np.savez(f, **array_dict)
+
+        with open(self.get_shard_path(shard_id, "done"), "w") as f:
+            f.write("")
+
+    def iter_shard_text(self, shard_id, part, chunk_size=1<<24):
+        """ Read a text part of a completed shard.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+            param3 [int] part number.
+            param4 [int] number of characters to read at a time.
+        Yield:
+            yield1 [string] chunk of the part.
+        """
+        with open(self.get_shard_path(shard_id, str(part))) as f:
+            for chunk in iter(lambda: f.read(chunk_size), ""):
+                yield chunk
+
+    def load_shard_array(self, shard_id):
+        """ Load the arrays of a completed shard.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] shard number.
+        Return:
+            return1 [dict] where key=name & val=np.ndarray.
+        """
+        with np.load(self.get_shard_path(shard_id, "npz")) as npz:
+            return dict(npz)
+
+    def remove_shards(self):
+        """ Remove every shard file of the checkpoint.
+        Param:
+            param1 [self] reference to this object.
+        """
+        for name in os.listdir(self.ckpt_dir):
+            if name.startswith(SHARD_PREFIX):
+                os.remove(os.path.join(self.ckpt_dir, name))
+
+    def finish(self):
+        """ Remove the checkpoint once the run is completed.
+        Param:
+            param1 [self] reference to this object.
+        Note:
+            1) meta.json is removed last and the directory is left in place.
+        """
+        self.remove_shards()
+        os.remove(os.path.join(self.ckpt_dir, CHECKPOINT_META))
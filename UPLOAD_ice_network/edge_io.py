@@ -0,0 +1,555 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: edge_io.py
+# Cont:
+#   Class:
+#       1) BackgroundWriter                 2) CompressedEdgeWriter
+#       3) FanOutEdgeWriter                 4) SortedEdgeWriter
+#   Func:
+#       1) get_compression                  2) open_text_writer
+#       3) open_edge_reader                 4) get_sort_key
+#       5) open_edge_writer                 6) open_fanout_writer
+#       7) intern_token                     8) intern_index
+#       9) iter_edge_chunk                 10) load_edge_list
+#      11) save_edge_array
+
+import gzip
+import heapq
+import io
+import locale
+import os
+import queue
+import tempfile
+import threading
+import zlib
+import numpy as np
+from tqdm import tqdm
+from sparse_store import is_sparse_store, load_sparse_store
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def get_compression(path):
+    """ Get the compression of an edge list to save from its extension.
+    Param:
+        param1 [string] path to save edges.
+    Return:
+        return1 [string] "gzip" for ".gz", "zstd" for ".zst", or None.
+    """
+    if path.endswith(".gz"):
+        return "gzip"
+    elif path.endswith(".zst"):
+        return "zstd"
+
+    return None
+
+class BackgroundWriter():
+    """ Base of file-like writers which save batches on a background thread,
+    so formatting the next batch overlaps saving the last one.
+    """
+
+    def __init__(self, n_pending=8):
+        """ Constructor for BackgroundWriter.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] max number of batches waiting to be saved.
+        """
+        self.error = None
+        self.batch_queue = queue.Queue(n_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self):
+        """ Save batches with save_batch() until the end marker None.
+        Param:
+            param1 [self] reference to this object.
+        Note:
+            1) The first error is kept and raised on the next put_batch() or on
+                close(), and later batches are dropped.
+        """
+        while True:
+            batch = self.batch_queue.get()
+            if batch is None:
+                break
+            if self.error == None:
+                try:
+                    self.save_batch(batch)
+                except Exception as error:
+                    self.error = error
+
+    def put_batch(self, batch):
+        """ Hand a batch over to the background thread.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string or bytes] batch to save.
+        """
+        if self.error != None:
+            raise self.error
+        self.batch_queue.put(batch)
+
+    def join(self):
+        """ Wait until every batch is saved.
+        Param:
+            param1 [self] reference to this object.
+        Return:
+            return1 [bool] False if the thread was already joined.
+        """
+        if self.thread == None:
+            return False
+        self.batch_queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+        return True
+
+class CompressedEdgeWriter(BackgroundWriter):
+    """ File-like writer which compresses text on a background thread.
+    Lines are buffered and handed over in batches, so formatting edges and
+    compressing them overlap.
+    """
+
+    def __init__(self, path, mode, compression, batch_size=1<<20, n_pending=8):
+        """ Constructor for CompressedEdgeWriter.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to save compressed lines.
+            param3 [string] "w" to overwrite or "a" to append a new gzip member
+                or zstd frame.
+            param4 [string] "gzip" or "zstd".
+            param5 [int] number of characters to buffer before handing over.
+            param6 [int] max number of batches waiting to be compressed.
+        """
+        if compression == "gzip":
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # 31: gzip header and trailer
+        else:
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor().compressobj()
+        self.f = open(path, mode + "b")
+        self.batch_size = batch_size
+        self.text_list = []
+        self.n_char = 0
+        super().__init__(n_pending)
+
+    def save_batch(self, batch):
+        """ Compress and save a batch on the background thread.
+        Param:
+            param1 [self] reference to this object.
+            param2 [bytes] encoded text.
+        Note:
+            1) zlib and zstandard release the GIL, so compression runs in
+                parallel with the writing thread.
+        """
+        self.f.write(self.compressor.compress(batch))
+
+    def write(self, text):
+        """ Buffer text and hand it over for compression in batches.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] of one or more lines.
+        """
+        self.text_list.append(text)
+        self.n_char += len(text)
+
+        if self.n_char >= self.batch_size:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """ Hand the buffered text over to the background thread.
+        Param:
+            param1 [self] reference to this object.
+        """
+        self.put_batch("".join(self.text_list).encode())
+        self.text_list = []
+        self.n_char = 0
+
+    def close(self):
+        """ Compress the remaining text and close the file.
+        Param:
+            param1 [self] reference to this object.
+        """
+        if self.thread == None:
+            return
+        if self.error == None:
+            self.flush_batch()
+        self.join()
+        if self.error == None:
+            self.f.write(self.compressor.flush())
+        self.f.close()
+        if self.error != None:
+            raise self.error
+
+class FanOutEdgeWriter(BackgroundWriter):
+    """ File-like writer which saves every batch to several files on a
+    background thread.
+    """
+
+    def __init__(self, f_list, n_pending=4):
+        """ Constructor for FanOutEdgeWriter.
+        Param:
+            param1 [self] reference to this object.
+            param2 [list] of opened files, see open_edge_writer().
+            param3 [int] max number of batches waiting to be saved.
+        """
+        self.f_list = f_list
+        super().__init__(n_pending)
+
+    def save_batch(self, batch):
+        """ Save a batch to every file on the background thread.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] of one or more lines.
+        """
+        for f in self.f_list:
+            f.write(batch)
+
+    def write(self, text):
+        """ Hand a batch of lines over to be saved to every file.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] of one or more lines, formatted once for all files.
+        """
+        self.put_batch(text)
+
+    def close(self):
+        """ Save the remaining batches and close every file.
+        Param:
+            param1 [self] reference to this object.
+        """
+        if not self.join():
+            return
+        for f in self.f_list:
+            f.close()
+        if self.error != None:
+            raise self.error
+
+def open_text_writer(path, mode, compression=None):
+    """ Open a file to save text, compressed or not.
+    Param:
+        param1 [string] path to save text.
+        param2 [string] "w" to overwrite or "a" to append.
+        param3 [string] "gzip", "zstd" or None.
+    Return:
+        return1 [file or CompressedEdgeWriter] with write() and close().
+    """
+    if compression == None:
+        return open(path, mode)
+
+    return CompressedEdgeWriter(path, mode, compression)
+
+def open_edge_reader(path, mode="r"):
+    """ Open an edge list, which may be gzip or zstd compressed.
+    Param:
+        param1 [string] path to an edge list file.
+        param2 [string] "r" for text or "rb" for bytes.
+    Return:
+        return1 [file] of the decompressed content.
+    Note:
+        1) Compression is detected from the leading bytes of the file, not its
+            extension, and concatenated gzip members or zstd frames are read
+            as one stream.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(ZSTD_MAGIC))
+
+    if magic.startswith(GZIP_MAGIC):
+        f = gzip.open(path, "rb")
+    elif magic == ZSTD_MAGIC:
+        import zstandard
+        f = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+    elif mode == "rb":
+        return open(path, "rb")
+    else:
+        return open(path)
+
+    return f if mode == "rb" else io.TextIOWrapper(f)
+
+def get_sort_key():
+    """ Get the key to order lines the same way as the `sort` command.
+    Return:
+        return1 [function] of a line without newline, or None for plain string
+            order.
+    Note:
+        1) `sort` collates by LC_ALL, LC_COLLATE or LANG. Plain string order is
+            byte order of UTF-8 and matches the C and POSIX locales.
+        2) Lines equal under a locale fall back to byte order like GNU sort.
+        3) Sets the LC_COLLATE locale of the whole process from the
+            environment. If the named locale is not installed, lines are
+            ordered by bytes as `LC_ALL=C sort` does.
+    """
+    try:
+        locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error as error:
+        print("Sorting lines in byte order as the collation locale is unavailable:", error)
+        return None
+    if locale.getlocale(locale.LC_COLLATE)[0] in (None, "C", "POSIX"):
+        return None
+
+    return lambda line: (locale.strxfrm(line), line)
+
+class SortedEdgeWriter():
+    """ File-like writer which saves lines in sorted order with a bounded buffer.
+    Runs of sorted lines are spilled to temporary files and k-way merged on
+    close().
+    """
+
+    def __init__(self, path, mode, run_size=1<<22):
+        """ Constructor for SortedEdgeWriter.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to save sorted lines.
+            param3 [string] "w" to overwrite or "a" to merge with the sorted
+                lines already in param2.
+            param4 [int] max number of lines to hold in memory.
+        """
+        self.path = path
+        self.mode = mode
+        self.compression = get_compression(path)
+        self.run_size = run_size
+        self.key = get_sort_key()
+        self.line_list = []
+        self.run_path_list = []
+        self.tail = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        """ Buffer newline-terminated lines.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] of one or more lines.
+        """
+        line_list = (self.tail + text).split("\n")
+        self.tail = line_list.pop()
+        self.line_list.extend(line_list)
+
+        if len(self.line_list) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        """ Sort buffered lines and save them as a temporary run.
+        Param:
+            param1 [self] reference to this object.
+        """
+        self.line_list.sort(key=self.key)
+        fd, run_path = tempfile.mkstemp(prefix=os.path.basename(self.path)+".", suffix=".run", dir=os.path.dirname(os.path.abspath(self.path)))
+
+        with os.fdopen(fd, "w") as f:
+            f.write("".join(line + "\n" for line in self.line_list))
+        self.run_path_list.append(run_path)
+        self.line_list = []
+
+    def close(self):
+        """ Merge all runs and save the sorted lines.
+        Param:
+            param1 [self] reference to this object.
+        """
+        if self.tail:
+            self.line_list.append(self.tail)
+            self.tail = ""
+        self.line_list.sort(key=self.key)
+        merge_path_list = list(self.run_path_list)
+        if self.mode == "a" and os.path.isfile(self.path):
+            merge_path_list.append(self.path)
+
+        # Step 1: Save directly if everything fits in memory.
+        if not merge_path_list:
+            with open_text_writer(self.path, "w", self.compression) as f:
+                f.write("".join(line + "\n" for line in self.line_list))
+            return
+
+        # Step 2: Merge runs on disk with the lines in memory.
+        run_f_list = [open_edge_reader(path) for path in merge_path_list]
+        run_list = [(line.rstrip("\n") for line in f) for f in run_f_list]
+        fd, out_path = tempfile.mkstemp(prefix=os.path.basename(self.path)+".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+
+        with open_text_writer(out_path, "w", self.compression) as f:
+            buffer = []
+            for line in heapq.merge(self.line_list, *run_list, key=self.key):
+                buffer.append(line + "\n")
+                if len(buffer) >= 65536:
+                    f.write("".join(buffer))
+                    buffer = []
+            f.write("".join(buffer))
+
+        for run_f in run_f_list:
+            run_f.close()
+        for run_path in self.run_path_list:
+            os.remove(run_path)
+        os.replace(out_path, self.path)
+        self.line_list = []
+        self.run_path_list = []
+
+def open_edge_writer(path, mode, sort_lines=False):
+    """ Open a file to save edges.
+    Param:
+        param1 [string] path to save edges.
+        param2 [string] "w" to overwrite or "a" to append.
+        param3 [bool] whether to save lines in sorted order as `sort` does.
+    Return:
+        return1 [file, CompressedEdgeWriter or SortedEdgeWriter] with write()
+            and close().
+    Note:
+        1) Paths ending with ".gz" or ".zst" are saved compressed, see
+            get_compression().
+    """
+    if sort_lines:
+        return SortedEdgeWriter(path, mode)
+
+    return open_text_writer(path, mode, get_compression(path))
+
+def open_fanout_writer(save_list, sort_lines=False):
+    """ Open files to save the same edges to.
+    Param:
+        param1 [list] of 2-tuples of path and input mode, see open_edge_writer().
+        param2 [bool] whether to save lines in sorted order as `sort` does.
+    Return:
+        return1 [FanOutEdgeWriter] with write() and close().
+    """
+    return FanOutEdgeWriter([open_edge_writer(path, mode, sort_lines) for path, mode in save_list])
+
+def intern_token(token_list, vocab):
+    """ Map tokens to integer ids, adding unseen tokens to a vocabulary.
+    Param:
+        param1 [list] of string tokens.
+        param2 [dict] where key=token & val=id, updated in place with ids in
+            order of first appearance.
+    Return:
+        return1 [np.ndarray] int32 ids of param1.
+    """
+    for token in dict.fromkeys(token_list):
+        if token not in vocab:
+            vocab[token] = len(vocab)
+
+    return np.fromiter(map(vocab.__getitem__, token_list), dtype=np.int32, count=len(token_list))
+
+def intern_index(index_array, items, vocab):
+    """ Map item row or col numbers to integer ids, adding unseen items to a
+    vocabulary.
+    Param:
+        param1 [np.ndarray] int of positions in param2.
+        param2 [list] of string items.
+        param3 [dict] where key=item & val=id, updated in place with ids in
+            order of first appearance in param1.
+    Return:
+        return1 [np.ndarray] int32 ids of param1.
+    """
+    _, first_pos = np.unique(index_array, return_index=True)
+    used = index_array[np.sort(first_pos)]
+    index2id = np.zeros(len(items), dtype=np.int32)
+    index2id[used] = intern_token([items[index] for index in used.tolist()], vocab)
+
+    return index2id[index_array]
+
+def iter_edge_chunk(path, chunk_size=1<<24):
+    """ Read an edge list file in chunks of whole lines.
+    Param:
+        param1 [string] path to an edge list file, which may be compressed.
+        param2 [int] number of bytes to read at a time.
+    Yield:
+        yield1 [list] of whitespace-separated tokens of a chunk of lines.
+    """
+    tail = b""
+
+    with open_edge_reader(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            chunk = tail + chunk
+            cut = chunk.rfind(b"\n") + 1
+            tail = chunk[cut:]
+            if cut:
+                yield chunk[:cut].decode().split()
+
+    if tail:
+        yield tail.decode().split()
+
+def load_edge_list(path, src_vocab, dst_vocab, dtype=np.float64):
+    """ Load a relation as integer-coded edges.
+    Param:
+        param1 [string] path to an edge list file or binary sparse store.
+        param2 [dict] where key=from node & val=id, updated in place.
+        param3 [dict] where key=to node & val=id, updated in place. May be the
+            same dict as param2 to share one vocabulary.
+        param4 [np.dtype] of weights.
+    Return:
+        return1 [np.ndarray] int32 ids of from nodes.
+        return2 [np.ndarray] int32 ids of to nodes.
+        return3 [np.ndarray] weights.
+    Note:
+        1) Nodes get ids in order of first appearance, and only nodes with at
+            least one edge get an id.
+    """
+    if is_sparse_store(path):
+        matrix, row_items, col_items = load_sparse_store(path)
+        coo = matrix.tocoo()
+        src = intern_index(coo.row, row_items, src_vocab)
+        dst = intern_index(coo.col, col_items, dst_vocab)
+
+        return src, dst, coo.data.astype(dtype)
+
+    src_list, dst_list, weight_list = [], [], []
+    for token_list in iter_edge_chunk(path):
+        if len(token_list) % 3:
+            raise ValueError("Edge list " + path + " has lines without exactly 3 fields.")
+        src_list.append(intern_token(token_list[0::3], src_vocab))
+        dst_list.append(intern_token(token_list[1::3], dst_vocab))
+        weight_list.append(np.array(token_list[2::3], dtype=dtype))
+
+    if not src_list:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=dtype)
+
+    return np.concatenate(src_list), np.concatenate(dst_list), np.concatenate(weight_list)
+
+def save_edge_array(edges, src_items, dst_items, save_list, weighted, sort_lines=False, batch_size=1<<20):
+    """ Save integer-coded edges as edge lists.
+    Param:
+        param1 [tuple] of int ids of from nodes, int ids of to nodes and
+            weights, in the order to save.
+        param2 [list] where index=from node id & val=from node.
+        param3 [list] where index=to node id & val=to node.
+        param4 [list] of 2-tuples of path and input mode.
+        param5 [int] indicator of whether to use binary or real weights.
+        param6 [bool] whether to save lines sorted as `sort` does.
+        param7 [int] number of edges to format and write at a time.
+    """
+    f = open_fanout_writer(save_list, sort_lines)
+    src_items = np.array(src_items, dtype=object)
+    dst_items = np.array(dst_items, dtype=object)
+    src, dst, weight = edges
+
+    for start in tqdm(range(0, len(src), batch_size)):
+        # Step 1: Format the batch in bulk.
+        batch = slice(start, start+batch_size)
+        if weighted:
+            weights = weight[batch].astype(str).astype(object) # shortest repr of the weight dtype
+        else:
+            weights = "1.0"
+        entries = src_items[src[batch]] + " " + dst_items[dst[batch]] + " " + weights + "\n"
+
+        # Step 2: Write the batch to every file in the background.
+        f.write("".join(entries.tolist()))
+
+    f.close()
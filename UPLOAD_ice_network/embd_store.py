@@ -0,0 +1,203 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: embd_store.py
+# Cont:
+#   Func:
+#       1) file_fingerprint                 2) is_embd_store
+#       3) embd_fingerprint                 4) normalize_rows
+#       5) convert_word_embd                6) load_embd_vocab
+#       7) load_embd_store
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+from tqdm import tqdm
+
+STORE_META = "meta.json"
+STORE_VOCAB = "vocab.txt"
+STORE_EMBD = "embd.npy"
+STORE_NORM = "embd_norm.npy"
+
+def file_fingerprint(path, chunk_size=1<<24):
+    """ Compute a content fingerprint of a file.
+    Param:
+        param1 [string] path to the file.
+        param2 [int] number of bytes to hash at a time.
+    Return:
+        return1 [string] hex SHA-1 digest of the file content.
+    """
+    sha = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def is_embd_store(path):
+    """ Check whether a path points to a binary embedding store.
+    Param:
+        param1 [string] path to a word embedding file or store.
+    Return:
+        return1 [bool] True if the path is a store made by convert_word_embd().
+    """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, STORE_META))
+
+def embd_fingerprint(word_embd_path):
+    """ Get the content fingerprint of word embeddings.
+    Param:
+        param1 [string] path to the word embedding text file or binary store.
+    Return:
+        return1 [string] fingerprint of the text file the embeddings come from.
+    Note:
+        1) A store reuses the fingerprint saved at conversion so a text file and
+            the store made from it share one fingerprint.
+    """
+    if is_embd_store(word_embd_path):
+        with open(os.path.join(word_embd_path, STORE_META)) as f:
+            return json.load(f)["fingerprint"]
+
+    return file_fingerprint(word_embd_path)
+
+def normalize_rows(embd_matrix, out, block_size=65536):
+    """ Scale every row of an embedding matrix to unit L2 norm.
+    Param:
+        param1 [np.ndarray] of shape (n_words, dim).
+        param2 [np.ndarray] of the same shape to write normalized rows to.
+        param3 [int] number of rows to normalize at a time.
+    Return:
+        return1 [np.ndarray] param2 filled with normalized rows.
+    Note:
+        1) Zero rows are left as zero, the same as sklearn.preprocessing.normalize.
+    """
+    for start in range(0, len(embd_matrix), block_size):
+        block = np.asarray(embd_matrix[start:start+block_size], dtype=np.float32)
+        norm = np.sqrt(np.einsum("ij,ij->i", block, block))
+        norm[norm == 0.0] = 1.0
+        out[start:start+block_size] = block / norm[:, np.newaxis]
+
+    return out
+
+def convert_word_embd(word_embd_path, store_path, norm):
+    """ Convert a word2vec text file into a binary embedding store.
+    Param:
+        param1 [string] path to the word embedding text file.
+        param2 [string] path to the store directory to create.
+        param3 [int] indicator of whether to also save unit-normalized rows.
+    Note:
+        1) The first line of an embedding is assumed to be header and skipped.
+        2) A word listed more than once keeps its first position and its last
+            vector, the same as the dict built by gen_tt.load_word_embd().
+        3) The store holds embd.npy (float32, one row per word), vocab.txt (one
+            word per line in row order), optional embd_norm.npy, and meta.json.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    word2index = {}
+    dim = None
+
+    # Step 1: Collect the vocabulary and dimension to preallocate the matrix.
+    with open(word_embd_path) as f:
+        next(f) # assume the first line is header
+        for line in f:
+            entry = line.strip().split()
+            if not entry:
+                continue
+            word2index.setdefault(entry[0], len(word2index))
+            dim = len(entry) - 1 if dim is None else dim
+
+    # Step 2: Fill the matrix directly on disk.
+    embd_matrix = np.lib.format.open_memmap(os.path.join(store_path, STORE_EMBD), mode="w+", dtype=np.float32, shape=(len(word2index), dim or 0))
+    with open(word_embd_path) as f:
+        next(f) # assume the first line is header
+        for line in tqdm(f, total=len(word2index)):
+            entry = line.strip().split()
+            if not entry:
+                continue
+            embd_matrix[word2index[entry[0]]] = np.array(entry[1:]).astype(np.float32)
+
+    # Step 3: Save pre-normalized rows for cosine similarity.
+    if norm:
+        norm_matrix = np.lib.format.open_memmap(os.path.join(store_path, STORE_NORM), mode="w+", dtype=np.float32, shape=embd_matrix.shape)
+        normalize_rows(embd_matrix, norm_matrix)
+        norm_matrix.flush()
+    embd_matrix.flush()
+
+    # Step 4: Save vocabulary and meta data, meta last to mark completion.
+    with open(os.path.join(store_path, STORE_VOCAB), "w") as f:
+        f.write("".join(word + "\n" for word in word2index))
+
+    meta = {
+        "n_words": len(word2index),
+        "dim": dim or 0,
+        "normalized": bool(norm),
+        "source": os.path.abspath(word_embd_path),
+        "fingerprint": file_fingerprint(word_embd_path),
+    }
+    with open(os.path.join(store_path, STORE_META), "w") as f:
+        json.dump(meta, f, indent=2)
+
+def load_embd_vocab(store_path):
+    """ Load the vocabulary of a binary embedding store without its vectors.
+    Param:
+        param1 [string] path to the store directory.
+    Return:
+        return1 [list] of words ordered by row number.
+    """
+    with open(os.path.join(store_path, STORE_VOCAB)) as f:
+        return f.read().splitlines()
+
+def load_embd_store(store_path, norm=False):
+    """ Open a binary embedding store as a memory-mapped matrix.
+    Param:
+        param1 [string] path to the store directory.
+        param2 [bool] whether to open unit-normalized rows instead of raw rows.
+            Rows are normalized on load if the store has no normalized copy.
+    Return:
+        return1 [list] of words ordered by row number.
+        return2 [np.ndarray] float32 matrix of shape (n_words, dim).
+    """
+    vocab = load_embd_vocab(store_path)
+    norm_path = os.path.join(store_path, STORE_NORM)
+
+    if norm and os.path.isfile(norm_path):
+        return vocab, np.load(norm_path, mmap_mode="r")
+
+    embd_matrix = np.load(os.path.join(store_path, STORE_EMBD), mmap_mode="r")
+    if norm:
+        embd_matrix = normalize_rows(embd_matrix, np.empty(embd_matrix.shape, dtype=np.float32))
+
+    return vocab, embd_matrix
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Convert word embeddings into a binary store.")
+    parser.add_argument("-embd", help="Path to load word embeddings text file.")
+    parser.add_argument("-store", help="Path to save the binary embedding store.")
+    parser.add_argument("-norm", type=int, choices=[0,1], default=1, help="0:raw rows only / (Default) 1:also save normalized rows.")
+    args = parser.parse_args()
+
+    print('Start converting word embeddings...')
+
+    # Step 2: Convert embeddings.
+    convert_word_embd(args.embd, args.store, args.norm)
+
+    print('Finished converting word embeddings!\n')
+
+if __name__ == "__main__":
+    main()
@@ -17,32 +17,76 @@
 # File: gen_et.py
 # Cont:
 #   Func:
-#       1) load_et_info                     2) load_embd_word
-#       3) filter_word_by_embd              4) filter_entity_by_graph
-#       5) gen_et_relation
+#       1) iter_et_info                     2) load_et_info
+#       3) load_embd_word                   4) filter_word_by_embd
+#       5) filter_word_by_vocab             6) filter_entity_by_graph
+#       7) get_rep_word                     8) gen_et_relation
+#       9) filter_et_info                  10) stream_et_relation
 
 import json
 import argparse
 from tqdm import tqdm
+from embd_store import is_embd_store, load_embd_vocab
+from edge_io import open_edge_writer
+from metrics import start_run, step, add_count, finish_run
+from stage_cache import check_stage, save_stage_manifest
+
+def iter_et_info(et_info_path, chunk_size=1<<20):
+    """ Iterate over the entities of an ET information file one at a time.
+    Param:
+        param1 [string] path to a json file of a list of dict, or a JSON Lines
+            file of one dict per line, where the preset key="id", "keywords",
+            and "scores" and val=entity id, list of representative words, and
+            list of descendingly ordered TF-IDF scores.
+        param2 [int] number of characters to read at a time.
+    Yield:
+        yield1 [string] entity.
+        yield2 [list] of 2-tuple of word and its TF-IDF score ordered
+            descendingly by TF-IDF score.
+    Note:
+        1) The format is told by the first character, "[" for a json list and
+            "{" for JSON Lines, so only one entity is held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    with open(et_info_path) as f:
+        while True:
+            # Step 1: Skip separators between entities.
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+
+            # Step 2: Decode one entity, reading more if it is incomplete.
+            try:
+                entity_dict, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            pos = end
+
+            yield str(entity_dict["id"]), list(zip(entity_dict["keywords"], entity_dict["scores"]))
 
 def load_et_info(et_info_path):
     """ Load information required to generate an ET relation.
     Param:
-        parma1 [string] path to a json file of a list of dict where the preset
-            key="id", "keyword", and "scores" and val=entity id, list of
-            representative words, and list of descendingly ordered TF-IDF scores.
+        parma1 [string] path to a json file of a list of dict or a JSON Lines
+            file, see iter_et_info().
     Return:
         return1 [dict] where key=entity & val=list of 2-tuple of word and its
             TF-IDF score ordered descendingly by TF-IDF score.
     """
-    et_info_dict = {}
-
-    with open(et_info_path) as f:
-        entity_dict_list = json.load(f)
-        for entity_dict in entity_dict_list:
-            et_info_dict[str(entity_dict["id"])] = list(zip(entity_dict["keywords"], entity_dict["scores"]))
-
-    return et_info_dict
+    return dict(iter_et_info(et_info_path))
 
 def load_embd_word(word_embd_path):
     """ Load a list of words whose embeddings are available.
@@ -52,7 +96,11 @@ def load_embd_word(word_embd_path):
         return1 [set] of words whose embeddings are available.
     Note:
         1) The first line of an embedding is assumed to be header and skipped.
+        2) Only the vocabulary of a binary embedding store is read.
     """
+    if is_embd_store(word_embd_path):
+        return set(load_embd_vocab(word_embd_path))
+
     word_set = set ()
 
     with open(word_embd_path) as f:
@@ -78,9 +126,22 @@ def filter_word_by_embd(et_info_dict, word_embd_path):
             entity-filtering by the number of words is only valid given all
             considered words have embeddings.
     """
+    return filter_word_by_vocab(et_info_dict, load_embd_word(word_embd_path))
+
+def filter_word_by_vocab(et_info_dict, embd_word_set):
+    """ Filter out representative words not in a given vocabulary.
+    Param:
+        param1 [dict] where key=entity & val=list of 2-tuple of word and its
+            TF-IDF score ordered descendingly by TF-IDF score.
+        param2 [set] of words whose embeddings are available.
+    Return:
+        return1 [dict] where key=entity & val=list of 2-tuple of word in param2
+            and its TF-IDF score ordered descendingly by TF-IDF score.
+    Note:
+        1) See filter_word_by_embd(), which loads param2 from an embedding file.
+    """
     rep_word_set = set()
     filt_word_set = set()
-    embd_word_set = load_embd_word(word_embd_path)
 
     # Step 1: Identify words without embeddings for filtering.
     for entity, tup_list in tqdm(et_info_dict.items()):
@@ -136,7 +197,19 @@ def filter_entity_by_graph(et_info_dict, max_repk):
 
     return et_info_dict
 
-def gen_et_relation(et_rel_path, et_info_dict, repk, weighted):
+def get_rep_word(et_info_dict, repk):
+    """ Get the unique representative words of an ET relation.
+    Param:
+        param1 [dict] where key=entity & val=list of 2-tuple of word and its
+            TF-IDF score ordered descendingly by TF-IDF score.
+        param2 [int] number of representative words to pick per entity.
+    Return:
+        return1 [set] of unique representative words, the same as
+            gen_tt.load_rep_word() on the ET relation of param2.
+    """
+    return {rep_word for tup_list in et_info_dict.values() for rep_word, _ in tup_list[:repk]}
+
+def gen_et_relation(et_rel_path, et_info_dict, repk, weighted, sort_lines=False):
     """ Generate and save entity-text relation.
     Param:
         param1 [string] path to save the ET edge list.
@@ -144,8 +217,10 @@ def gen_et_relation(et_rel_path, et_info_dict, repk, weighted):
             TF-IDF score ordered descendingly by TF-IDF.
         param3 [int] number of representative words to pick per entity.
         param4 [int] indicator of whether to use binary or loaded weights.
+        param5 [bool] whether to save lines sorted as `sort` does rather than in
+            the order of param2.
     """
-    with open(et_rel_path, 'w') as f:
+    with open_edge_writer(et_rel_path, 'w', sort_lines) as f:
         if weighted == 1:
             for entity in tqdm(et_info_dict):
                 for rep_word, weight in et_info_dict[entity][:repk]:
@@ -155,26 +230,126 @@ def gen_et_relation(et_rel_path, et_info_dict, repk, weighted):
                 for rep_word, _ in et_info_dict[entity][:repk]:
                     f.write(entity + " " + rep_word + " 1.0\n")
 
+def filter_et_info(et_info_iter, embd_word_set, max_repk):
+    """ Filter words and entities of ET information on the fly.
+    Param:
+        param1 [iterator] of 2-tuple of entity and list of 2-tuple of word and
+            its TF-IDF score, see iter_et_info().
+        param2 [set] of words whose embeddings are available.
+        param3 [int] largest number of representative words to pick per entity
+            amongst all considered graphs.
+    Yield:
+        yield1 [string] entity with sufficient representative words.
+        yield2 [list] of 2-tuple of word in param2 and its TF-IDF score ordered
+            descendingly by TF-IDF score.
+    Note:
+        1) Equivalent to filter_word_by_vocab() then filter_entity_by_graph(),
+            and reports the same stats once param1 is exhausted.
+        2) Memory is bounded by the vocabulary rather than by the number of
+            entities. An entity listed more than once is yielded every time,
+            while load_et_info() keeps its last record.
+    """
+    rep_word_set = set()
+    filt_word_set = set()
+    unfilt_size = 0
+    kept_size = 0
+
+    for entity, tup_list in tqdm(et_info_iter):
+        # Step 1: Remove words without embeddings.
+        kept_tup_list = []
+        for tup in tup_list:
+            rep_word_set.add(tup[0])
+            if tup[0] in embd_word_set:
+                kept_tup_list.append(tup)
+            else:
+                filt_word_set.add(tup[0])
+
+        # Step 2: Remove entities with insufficient words.
+        unfilt_size += 1
+        if len(kept_tup_list) < max_repk:
+            continue
+        kept_size += 1
+
+        yield entity, kept_tup_list
+
+    # Step 3: Report filter stat.
+    print("Filtered", len(filt_word_set),"words without embeddings out of", len(rep_word_set),"words.")
+    print("Filtered", unfilt_size - kept_size, "entities with less than", max_repk, "representative words out of", unfilt_size, "entities. Leaving", kept_size, "entities.")
+    add_count("entities_in", unfilt_size)
+    add_count("entities_out", kept_size)
+    add_count("words_filtered", len(filt_word_set))
+
+def stream_et_relation(et_info_iter, et_save_list, sort_lines=False):
+    """ Generate and save entity-text relations of several settings in one pass.
+    Param:
+        param1 [iterator] of 2-tuple of entity and list of 2-tuple of word and
+            its TF-IDF score, see filter_et_info().
+        param2 [list] of 3-tuple of path to save the ET edge list, number of
+            representative words to pick per entity, and indicator of whether
+            to use binary or loaded weights.
+        param3 [bool] whether to save lines sorted as `sort` does rather than in
+            the order of param1.
+    Return:
+        return1 [dict] where key=number of representative words & val=set of
+            unique representative words, the same as get_rep_word().
+    Note:
+        1) Every file is the same as gen_et_relation() on the filtered dict.
+    """
+    et_f_list = [open_edge_writer(et_rel_path, 'w', sort_lines) for et_rel_path, _, _ in et_save_list]
+    rep_word_dict = {repk:set() for _, repk, _ in et_save_list}
+    n_edge = 0
+
+    for entity, tup_list in et_info_iter:
+        for repk, rep_word_set in rep_word_dict.items():
+            rep_word_set.update(rep_word for rep_word, _ in tup_list[:repk])
+        n_edge += sum(len(tup_list[:repk]) for _, repk, _ in et_save_list)
+        for f, (_, repk, weighted) in zip(et_f_list, et_save_list):
+            if weighted == 1:
+                f.write("".join(entity + " " + rep_word + " " + str(weight) + "\n" for rep_word, weight in tup_list[:repk]))
+            else:
+                f.write("".join(entity + " " + rep_word + " 1.0\n" for rep_word, _ in tup_list[:repk]))
+
+    for f in et_f_list:
+        f.close()
+    add_count("et_edges_out", n_edge)
+
+    return rep_word_dict
+
 def main():
 
     # Step 1: Get arguments from users.
     parser = argparse.ArgumentParser(description="Generate entity-text (ET) relation.")
-    parser.add_argument("-info", help="Path to load ET information JSON file.")
-    parser.add_argument("-embd", help="Path to load word embeddings.")
+    parser.add_argument("-info", help="Path to load ET information JSON or JSON Lines file.")
+    parser.add_argument("-embd", help="Path to load word embeddings text file or binary store.")
     parser.add_argument("-repk", type=int, help="Number of representative words per entity for current graph.")
     parser.add_argument("-max_repk", type=int, help="Max number of representative words per entity amongst all graphs.")
-    parser.add_argument("-et", help="Path to save ET relation.")
+    parser.add_argument("-et", help="Path to save ET relation, compressed if it ends with .gz or .zst.")
     parser.add_argument("-w", type=int, choices=[0,1], default=0, help="(Default) 0:unweighted / 1:weighted")
+    parser.add_argument("-sorted", type=int, choices=[0,1], default=0, help="(Default) 0:entity order / 1:sorted as `sort` does.")
+    parser.add_argument("-metrics", help="(Optional) Path to save metrics, .jsonl to append one line per run.")
+    parser.add_argument("-quiet", type=int, choices=[0,1], default=0, help="(Default) 0:show progress bars / 1:no progress bars.")
+    parser.add_argument("-dry_run", type=int, choices=[0,1], default=0, help="(Default 0) 1:only list which outputs are fresh or stale, see stage_cache.py.")
+    parser.add_argument("-force", type=int, choices=[0,1], default=0, help="(Default 0) 1:rebuild outputs even if they are up to date.")
     args = parser.parse_args()
 
+    output_dict = {args.et:{"repk":args.repk, "max_repk":args.max_repk, "w":args.w, "sorted":args.sorted}}
+    manifest, stale_list = check_stage("gen_et", [args.info, args.embd], output_dict, args.dry_run, args.force)
+    if not stale_list:
+        return
+
     print('Start generating ET relation...')
+    start_run("gen_et", args.metrics, args.quiet)
 
     # Step 2: Construct ET relation:
-    et_info_dict = load_et_info(args.info)
-    et_info_dict = filter_word_by_embd(et_info_dict, args.embd)
-    et_info_dict = filter_entity_by_graph(et_info_dict, args.max_repk)
-    gen_et_relation(args.et, et_info_dict, args.repk, args.w)
+    with step("Step 2-1: Load embedding vocabulary"):
+        embd_word_set = load_embd_word(args.embd)
+        add_count("embd_words", len(embd_word_set))
+    with step("Step 2-2: Filter and save ET relation"):
+        et_info_iter = filter_et_info(iter_et_info(args.info), embd_word_set, args.max_repk)
+        stream_et_relation(et_info_iter, [(args.et, args.repk, args.w)], args.sorted)
 
+    save_stage_manifest(manifest, output_dict)
+    finish_run()
     print('Finished generating ET relation!\n')
 
 if __name__ == "__main__":
@@ -17,16 +17,36 @@
 # File: gen_ice.py
 # Cont:
 #   Func:
-#       1) get_user_input                   2) gen_et_network
-#       3) gen_tt_network                   4) dict2sparse_mat
-#       5) save_ice_et_network              6) save_ice_tt_network
+#       1) get_user_input                   2) unique_edge
+#       3) gen_et_network                   4) gen_tt_network
+#       5) tt2network                       6) edge2sparse_mat
+#       7) et2sparse_mat                    8) prune_exp_block
+#       9) iter_exp_block                  10) tt_fingerprint
+#      11) gen_tt_power                    12) save_ice_et_blocks
+#      13) save_ice_et_network             14) save_ice_tt_network
+#      15) save_ice_bin_network            16) make_bin_version
+#      17) swap_bin_network
 
 import argparse
-from collections import defaultdict
+import fcntl
+import hashlib
+import json
 import numpy as np
+import os
+import shutil
 import sys
+import tempfile
+import time
 from scipy.sparse import csr_matrix
 from tqdm import tqdm
+from sparse_store import is_sparse_store, save_sparse_store, load_sparse_store, SparseStoreWriter
+from edge_io import open_fanout_writer, load_edge_list, save_edge_array
+from metrics import start_run, step, add_count, finish_run
+from stage_cache import check_stage, save_stage_manifest
+from checkpoint import ShardCheckpoint, get_checkpoint_key
+
+ICE_META = 'ice.json'
+version_lock_dict = {} # where key=version path & val=locked file, see make_bin_version()
 
 def get_user_input():
     """ Get inputs from user.
@@ -38,14 +58,41 @@ def get_user_input():
         return4 [list] of string paths to save the text-text subnetwork within
             an ICE network.
         return5 [int] indicator of whether to use binary or real weights.
+        return6 [string] path to save the binary ICE network, or None.
+        return7 [int] indicator of whether to save lines sorted as `sort` does.
+        return8 [np.dtype] of weights and of the expansion product.
+        return9 [string] path to save metrics, or None.
+        return10 [int] indicator of whether to turn progress bars off.
+        return11 [int] number of entities to expand at a time.
+        return12 [int] number of expanded words to keep per entity, 0 for all.
+        return13 [float] min weight of expanded words to keep, 0 for all.
+        return14 [int] number of hops of concept expansion.
+        return15 [string] directory to cache pruned TT powers in, or None.
+        return16 [int] indicator of whether to only list stale outputs.
+        return17 [int] indicator of whether to rebuild up-to-date outputs.
+        return18 [string] directory to save completed entity blocks in, or
+            None.
     """
     PARSER = argparse.ArgumentParser(description='Construct ICE network from ET and TT relations.')
-    PARSER.add_argument('-et', help='Path to load ET relation.')
-    PARSER.add_argument('-tt', help='Path to load TT relation.')
-    PARSER.add_argument('-ice_full', help='(Optoinal) Path to save full ICE network.')
+    PARSER.add_argument('-et', help='Path to load ET relation edge list (optionally gzip or zstd compressed) or binary store.')
+    PARSER.add_argument('-tt', help='Path to load TT relation edge list (optionally gzip or zstd compressed) or binary store.')
+    PARSER.add_argument('-ice_full', help='(Optoinal) Path to save full ICE network, compressed if it ends with .gz or .zst.')
     PARSER.add_argument('-ice_et', help='(Optional) Path to save ET part of ICE network.')
     PARSER.add_argument('-ice_tt', help='(Optional) Path to save TT part of ICE network.')
+    PARSER.add_argument('-ice_bin', help='(Optional) Path to save ICE network as binary sparse stores.')
     PARSER.add_argument('-w', type=int, default=0, choices=[0,1], help='(Default) 0:unweighted / 1:weighted.')
+    PARSER.add_argument('-sorted', type=int, default=0, choices=[0,1], help='(Default) 0:entity and word order / 1:sorted as `sort` does.')
+    PARSER.add_argument('-dtype', default='float64', choices=['float64','float32'], help='(Default float64) Precision of weights and of the expansion product.')
+    PARSER.add_argument('-block', type=int, default=65536, help='(Default 65536) Number of entities to expand and save at a time.')
+    PARSER.add_argument('-topn', type=int, default=0, help='(Default 0) Number of expanded words with the largest weights to keep per entity, 0 to keep all.')
+    PARSER.add_argument('-min_w', type=float, default=0, help='(Default 0) Min weight of expanded words to keep, 0 to keep all.')
+    PARSER.add_argument('-hops', type=int, default=1, help='(Default 1) Number of hops of concept expansion through the TT network.')
+    PARSER.add_argument('-power_cache', help='(Optional) Directory to cache pruned TT powers in for -hops over 1.')
+    PARSER.add_argument('-metrics', help='(Optional) Path to save metrics, .jsonl to append one line per run.')
+    PARSER.add_argument('-quiet', type=int, default=0, choices=[0,1], help='(Default) 0:show progress bars / 1:no progress bars.')
+    PARSER.add_argument('-ckpt', help='(Optional) Directory to save completed entity blocks in, so that a restarted run resumes from them.')
+    PARSER.add_argument('-dry_run', type=int, default=0, choices=[0,1], help='(Default 0) 1:only list which outputs are fresh or stale, see stage_cache.py.')
+    PARSER.add_argument('-force', type=int, default=0, choices=[0,1], help='(Default 0) 1:rebuild outputs even if they are up to date.')
     CONFIG = PARSER.parse_args()
 
     if CONFIG.et == None:
@@ -54,9 +101,12 @@ def get_user_input():
     elif CONFIG.tt == None:
         print('Please specify a path to load TT relation edge list.')
         sys.exit()
-    elif CONFIG.ice_full == CONFIG.ice_et == CONFIG.ice_tt == None:
+    elif CONFIG.ice_full == CONFIG.ice_et == CONFIG.ice_tt == CONFIG.ice_bin == None:
         print('Please specify at least one path to save the full or part of the ICE network.')
         sys.exit()
+    elif CONFIG.hops < 1:
+        print('Please specify at least 1 hop of concept expansion.')
+        sys.exit()
 
     et_save_list = []
     tt_save_list = []
@@ -69,150 +119,577 @@ def get_user_input():
     if CONFIG.ice_tt != None:
         tt_save_list.append((CONFIG.ice_tt, 'w'))
 
-    return CONFIG.et, CONFIG.tt, et_save_list, tt_save_list, CONFIG.w
+    return CONFIG.et, CONFIG.tt, et_save_list, tt_save_list, CONFIG.w, CONFIG.ice_bin, CONFIG.sorted, np.dtype(CONFIG.dtype), CONFIG.metrics, CONFIG.quiet, CONFIG.block, CONFIG.topn, CONFIG.min_w, CONFIG.hops, CONFIG.power_cache, CONFIG.dry_run, CONFIG.force, CONFIG.ckpt
+
+
+def unique_edge(src, dst, weight):
+    """ Remove repeated edges and order edges by from node, to node and weight.
+    Param:
+        param1 [np.ndarray] int ids of from nodes.
+        param2 [np.ndarray] int ids of to nodes.
+        param3 [np.ndarray] weights.
+    Return:
+        return1 [np.ndarray] int ids of from nodes of unique edges.
+        return2 [np.ndarray] int ids of to nodes of unique edges.
+        return3 [np.ndarray] weights of unique edges.
+    Note:
+        1) Edges are repeated only if node and weight are all equal, the same
+            as adding (to node, weight) tuples to a set per from node.
+    """
+    order = np.lexsort((weight, dst, src))
+    src, dst, weight = src[order], dst[order], weight[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1]) | (weight[1:] != weight[:-1])
+
+    return src[keep], dst[keep], weight[keep]
 
 
-def gen_et_network(et_path):
+def gen_et_network(et_path, dtype=np.float64):
     """ Construct an entity-text network from entity-text relations.
     Param:
-        param1 [string] path to an edge list file where entity-text relations
-            are defined.
+        param1 [string] path to an edge list file or binary sparse store where
+            entity-text relations are defined.
+        param2 [np.dtype] of weights.
     Return:
-        return1 [dict] where key=entity & val=list of 2-tuples of rep word and
-            respective weight.
+        return1 [tuple] of from node ids, to node ids and weights of unique
+            edges ordered by unique_edge().
+        return2 [list] where index=from node id & val=entity.
+        return3 [list] where index=to node id & val=rep word.
     Note:
         1) Assume word set in ET is a subset of word set in TT as a word only in
             TT will NOT benefit from ICE algorithm and is assumed to be removed.
+        2) Entities are ordered by first appearance in the relation.
     """
-    et_dict = defaultdict(set)
+    entity2index = {}
+    word2index = {}
+    src, dst, weight = load_edge_list(et_path, entity2index, word2index, dtype) # directed
+    add_count('et_edges_in', len(src))
 
-    with open(et_path) as f:
-        for line in f:
-            entry = line.split()
-            et_dict[entry[0]].add((entry[1], float(entry[2]))) # directed
+    return unique_edge(src, dst, weight), list(entity2index), list(word2index)
 
-    return et_dict
 
-
-def gen_tt_network(tt_path):
+def gen_tt_network(tt_path, dtype=np.float64):
     """ Construct a text-text network from text-text relations.
     Param:
-        param1 [string] path to an edge list file where text-text relations are
-            defined.
+        param1 [string] path to an edge list file or binary sparse store where
+            text-text relations are defined.
+        param2 [np.dtype] of weights.
     Return:
-        return1 [dict] where key=rep word & val=list of 2-tuples of exp word and
-            respective weight.
-        return2 [list] of unique words used in TT relation.
-    """
-    tt_dict = defaultdict(set)
-    word_set = set()
- 
-    with open(tt_path) as f:
-        for line in f:
-            entry = line.split()
-            tt_dict[entry[0]].add((entry[1], float(entry[2]))) # undirected
-            tt_dict[entry[1]].add((entry[0], float(entry[2])))
-            tt_dict[entry[0]].add((entry[0], 1.0)) # cos similarity to self
-            tt_dict[entry[1]].add((entry[1], 1.0))
-            word_set.update([entry[0], entry[1]])
-
-    return tt_dict, list(word_set)
-
-
-def dict2sparse_mat(edge_dict, node2row, node2col):
-    """ Convert dictionary-based to sparse-matrix-based network.
-    Param:
-        param1 [dict] where key=from node & val=list of 2-tuples of to node and
-            respective weight.
-        param2 [dict] where key=node & val=row number.
-        param3 [dict] where key=node & val=col number.
+        return1 [tuple] of from node ids, to node ids and weights of unique
+            edges ordered by unique_edge().
+        return2 [list] of unique words used in TT relation in sorted order,
+            where index=node id & val=word.
+    """
+    word2index = {}
+    src, dst, weight = load_edge_list(tt_path, word2index, word2index, dtype)
+    add_count('tt_edges_in', len(src))
+
+    return tt2network(src, dst, weight, list(word2index))
+
+
+def tt2network(src, dst, weight, items):
+    """ Construct a text-text network from text-text relation edge arrays.
+    Param:
+        param1 [np.ndarray] int ids of rep words.
+        param2 [np.ndarray] int ids of exp words.
+        param3 [np.ndarray] weights.
+        param4 [list] where index=id of param1 & param2 & val=word.
+    Return:
+        The same as gen_tt_network().
+    """
+    # Step 1: Renumber words used in an edge in sorted order.
+    used = np.unique(np.concatenate([src, dst]))
+    word_list = sorted(items[index] for index in used.tolist())
+    word2index = {word:index for index, word in enumerate(word_list)}
+    remap = np.zeros(len(items), dtype=np.int32)
+    remap[used] = [word2index[items[index]] for index in used.tolist()]
+    src, dst = remap[src], remap[dst]
+
+    # Step 2: Add reverse edges and self-loops of every word in an edge.
+    ones = np.ones(len(src), dtype=weight.dtype) # cos similarity to self
+    src_all = np.concatenate([src, dst, src, dst]) # undirected
+    dst_all = np.concatenate([dst, src, src, dst])
+    weight_all = np.concatenate([weight, weight, ones, ones])
+
+    return unique_edge(src_all, dst_all, weight_all), word_list
+
+
+def edge2sparse_mat(edges, n_rows, n_cols):
+    """ Convert edge-array-based to sparse-matrix-based network.
+    Param:
+        param1 [tuple] of from node ids, to node ids and weights ordered by
+            unique_edge().
+        param2 [int] number of rows.
+        param3 [int] number of cols.
     Return:
         return1 [csr_matrix] sparse matrix network.
+    Note:
+        1) Edges between the same nodes are summed in weight order so results do
+            not depend on the order of the relation file.
+        2) Weights keep their dtype, and indices are int32 unless the number of
+            edges needs int64 row pointers.
+    """
+    src, dst, weight = edges
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    start = np.flatnonzero(first)
+    data = np.add.reduceat(weight, start) if len(start) else np.empty(0, dtype=weight.dtype)
+    indptr = np.zeros(n_rows+1, dtype=np.int64)
+    np.cumsum(np.bincount(src[start], minlength=n_rows), out=indptr[1:])
+
+    return csr_matrix((data, dst[start], indptr), shape=(n_rows, n_cols))
+
+
+def et2sparse_mat(et_edges, et_word_list, word2index, n_rows):
+    """ Convert an entity-text network onto the word index of a TT network.
+    Param:
+        param1 [tuple] of from node ids, to node ids and weights, see
+            gen_et_network().
+        param2 [list] where index=to node id of param1 & val=rep word.
+        param3 [dict] where key=word & val=row and col number of TT network.
+        param4 [int] number of entities.
+    Return:
+        return1 [csr_matrix] sparse matrix of the entity-text network.
+    """
+    missing = [word for word in et_word_list if word not in word2index]
+    if missing:
+        raise ValueError(str(len(missing)) + ' words in ET relation are not in TT relation, e.g. ' + missing[0])
+
+    et_src, et_dst, et_weight = et_edges
+    remap = np.array([word2index[word] for word in et_word_list], dtype=np.int32)
+
+    return edge2sparse_mat(unique_edge(et_src, remap[et_dst], et_weight), n_rows, len(word2index))
+
+
+def prune_exp_block(exp_et_block, topn=0, min_weight=0):
+    """ Keep the expanded words with the largest weights of each entity.
+    Param:
+        param1 [csr_matrix] rows of the expanded entity-text network with
+            sorted indices.
+        param2 [int] number of expanded words to keep per entity, 0 for all.
+        param3 [float] min weight of expanded words to keep, 0 for all.
+    Return:
+        return1 [csr_matrix] pruned rows of param1 with sorted indices.
+        return2 [int] number of pruned entries.
+    Note:
+        1) Words tied in weight are kept in word order, so the result does not
+            depend on the block size.
     """
-    row_list = []
-    col_list = []
-    weight_list = []
-    for from_node, tup_list in tqdm(edge_dict.items()):
-        for to_node, weight in tup_list:
-            row_list.append(node2row[from_node])
-            col_list.append(node2col[to_node])
-            weight_list.append(weight)
+    indptr, indices, data = exp_et_block.indptr, exp_et_block.indices, exp_et_block.data
+    rows = np.repeat(np.arange(exp_et_block.shape[0]), np.diff(indptr))
+    keep = np.ones(exp_et_block.nnz, dtype=bool)
+
+    # Step 1: Drop weights below the threshold.
+    if min_weight > 0:
+        keep &= data >= min_weight
+
+    # Step 2: Rank words of each entity by weight and drop the tail.
+    if topn > 0:
+        order = np.lexsort((indices, -data, ~keep, rows))
+        rank = np.arange(exp_et_block.nnz) - indptr[rows[order]]
+        keep[order[rank >= topn]] = False
 
-    return csr_matrix((weight_list, (row_list, col_list)), shape=(len(node2row), len(node2col)), dtype=np.float64)
+    if keep.all():
+        return exp_et_block, 0
+    new_indptr = np.zeros_like(indptr)
+    np.cumsum(np.bincount(rows[keep], minlength=exp_et_block.shape[0]), out=new_indptr[1:])
 
+    return csr_matrix((data[keep], indices[keep], new_indptr), shape=exp_et_block.shape), exp_et_block.nnz - int(keep.sum())
+
+
+def iter_exp_block(et_matrix, tt_matrix, block_size, topn=0, min_weight=0, name='ice_et', skip_set=()):
+    """ Perform concept expansion one block of entities at a time.
+    Param:
+        param1 [csr_matrix] sparse matrix of the entity-text network.
+        param2 [csr_matrix] sparse matrix of the text-text network.
+        param3 [int] number of entities per block.
+        param4 [int] number of expanded words to keep per entity, 0 for all.
+        param5 [float] min weight of expanded words to keep, 0 for all.
+        param6 [string] prefix of the "_nnz" and "_pruned" metric counts.
+        param7 [set] of first row numbers of blocks not to expand.
+    Yield:
+        yield1 [int] row number of the first entity of the block.
+        yield2 [csr_matrix] rows of the expanded entity-text network with
+            sorted indices, or None for a block in param7.
+    Note:
+        1) Rows of a sparse product only depend on the same rows of param1, so
+            blocks are the same as the rows of the whole product.
+        2) Each block is pruned right after its product, see prune_exp_block(),
+            so only kept entries of the whole product are ever held.
+    """
+    n_total, n_pruned = 0, 0
 
-def save_ice_et_network(exp_et_matrix, row2entity, col2word, et_save_list, weighted):
+    for start in range(0, et_matrix.shape[0], block_size):
+        if start in skip_set:
+            yield start, None
+            continue
+        exp_et_block = et_matrix[start:start+block_size].dot(tt_matrix)
+        exp_et_block.sort_indices()
+        exp_et_block, n_block_pruned = prune_exp_block(exp_et_block, topn, min_weight)
+        n_total += exp_et_block.nnz + n_block_pruned
+        n_pruned += n_block_pruned
+        add_count(name+'_nnz', exp_et_block.nnz)
+        add_count(name+'_pruned', n_block_pruned)
+
+        yield start, exp_et_block
+
+    if topn > 0 or min_weight > 0:
+        print('Pruned {} of {} expanded edges of {}.'.format(n_pruned, n_total, name))
+
+
+def tt_fingerprint(tt_matrix, word_list, topn, min_weight):
+    """ Compute a fingerprint of a TT network and its pruning settings.
+    Param:
+        param1 [csr_matrix] sparse matrix of the text-text network.
+        param2 [list] where index=row number & val=word.
+        param3 [int] number of expanded words to keep per word, 0 for all.
+        param4 [float] min weight of expanded words to keep, 0 for all.
+    Return:
+        return1 [string] hex SHA-1 digest.
+    """
+    sha = hashlib.sha1()
+    sha.update('\n'.join(word_list).encode())
+    sha.update('{} {} {}'.format(tt_matrix.dtype, topn, min_weight).encode())
+    for array in [tt_matrix.indptr.astype(np.int64), tt_matrix.indices.astype(np.int32), tt_matrix.data]:
+        sha.update(np.ascontiguousarray(array).tobytes())
+
+    return sha.hexdigest()
+
+
+def gen_tt_power(tt_matrix, word_list, hops, power_root, block_size, topn=0, min_weight=0):
+    """ Generate the pruned power of a TT network for multi-hop expansion.
+    Param:
+        param1 [csr_matrix] sparse matrix of the text-text network.
+        param2 [list] where index=row number & val=word.
+        param3 [int] number of hops of concept expansion.
+        param4 [string] directory to cache pruned TT powers in.
+        param5 [int] number of words to expand at a time.
+        param6 [int] number of expanded words to keep per word, 0 for all.
+        param7 [float] min weight of expanded words to keep, 0 for all.
+    Return:
+        return1 [csr_matrix] pruned param3-th power of param1, memory-mapped
+            from a binary sparse store when param3 is over 1.
+    Note:
+        1) The h-th power is the (h-1)-th power times param1 with every row
+            pruned as in prune_exp_block(), so each hop is pruned and fill-in
+            stays within param6 words per row.
+        2) Powers are cached in param4/<fingerprint>/hop<h>, see
+            tt_fingerprint(), and a cached lower power is extended rather than
+            recomputed.
+        3) param1 is returned as it is for 1 hop, without a fingerprint.
+    """
+    if hops == 1:
+        return tt_matrix
+    power_dir = os.path.join(power_root, tt_fingerprint(tt_matrix, word_list, topn, min_weight))
+    tt_power = tt_matrix
+
+    for hop in range(2, hops+1):
+        hop_path = os.path.join(power_dir, 'hop{}'.format(hop))
+        if not is_sparse_store(hop_path):
+            print('Computing TT power of hop {}...'.format(hop))
+            hop_store = SparseStoreWriter(hop_path, len(word_list), tt_matrix.dtype)
+            for _, tt_power_block in iter_exp_block(tt_power, tt_matrix, block_size, topn, min_weight, 'tt_hop{}'.format(hop)):
+                hop_store.append(tt_power_block)
+            hop_store.close(word_list, word_list)
+        tt_power, _, _ = load_sparse_store(hop_path)
+
+    return tt_power
+
+
+def save_ice_et_blocks(exp_et_block_iter, row2entity, col2word, et_save_list, weighted, sort_lines=False, et_store_path=None, batch_size=1<<20, checkpoint=None):
+    """ Save the expanded entity-text subnetwork within an ICE network as its
+    blocks are expanded.
+    Param:
+        param1 [iterator] of 2-tuples of the first row number and csr_matrix
+            rows of the expanded entity-text network, see iter_exp_block().
+        param2 [list] where index=row number & val=entity.
+        param3 [list] where index=col number & val=rep word
+        param4 [list] of 2-tuples of path and input mode.
+        param5 [int] indicator of whether to use binary or real weights.
+        param6 [int] indicator of whether to save lines sorted as `sort` does.
+        param7 [string] path to also save the binary "et" store, or None. See
+            save_ice_bin_network().
+        param8 [int] number of matrix entries to format and write at a time.
+        param9 [ShardCheckpoint] object to save blocks to, or None. A block
+            given as None in param1 is replayed from it, with the n-th block
+            as shard n.
+    Note:
+        1) Entries are written in row-major order of the CSR arrays and
+            explicit zeros are skipped, the same as iterating nonzero().
+        2) Only one block is held in memory at a time.
+        3) Each batch is formatted once and saved to every file of param4 on a
+            background thread, overlapping the expansion of the next block.
+        4) Nothing is formatted if param4 is empty, and blocks only go to the
+            binary store.
+    """
+    et_f = open_fanout_writer(et_save_list, sort_lines)
+    n_part = 1 if et_save_list else 0
+    et_store = None
+    row2entity = np.array(row2entity, dtype=object)
+    col2word = np.array(col2word, dtype=object)
+
+    for block_id, (row_start, exp_et_block) in enumerate(tqdm(exp_et_block_iter)):
+        # Step 0: Replay a block completed by an earlier run.
+        if exp_et_block is None:
+            for part in range(n_part):
+                for text in checkpoint.iter_shard_text(block_id, part):
+                    et_f.write(text)
+            if et_store_path != None:
+                array_dict = checkpoint.load_shard_array(block_id)
+                exp_et_block = csr_matrix((array_dict['data'], array_dict['indices'], array_dict['indptr']), shape=(len(array_dict['indptr'])-1, len(col2word)))
+                if et_store == None:
+                    et_store = SparseStoreWriter(et_store_path, len(col2word), exp_et_block.dtype)
+                et_store.append(exp_et_block)
+            continue
+
+        part_f_list = [] if checkpoint == None else checkpoint.open_shard(block_id, n_part)
+        indptr, indices, data = exp_et_block.indptr, exp_et_block.indices, exp_et_block.data
+
+        for start in range(0, exp_et_block.nnz if n_part else 0, batch_size):
+            # Step 1: Locate the nonzero entries of the batch.
+            pos = np.arange(start, min(start+batch_size, exp_et_block.nnz))
+            pos = pos[data[pos] != 0]
+            rows = row_start + np.searchsorted(indptr, pos, side='right') - 1
+
+            # Step 2: Format the batch in bulk.
+            if weighted:
+                weights = data[pos].astype(str).astype(object) # shortest repr of the weight dtype
+            else:
+                weights = '1.0'
+            entries = row2entity[rows] + ' ' + col2word[indices[pos]] + ' ' + weights + '\n'
+            add_count('ice_et_edges_out', len(pos))
+
+            # Step 3: Write the batch to every file in the background.
+            text = ''.join(entries.tolist())
+            et_f.write(text)
+            if part_f_list:
+                part_f_list[0].write(text)
+
+        # Step 4: Append the block to the binary store.
+        array_dict = None
+        if et_store_path != None:
+            if et_store == None:
+                et_store = SparseStoreWriter(et_store_path, len(col2word), exp_et_block.dtype)
+            exp_et_block.eliminate_zeros()
+            if not weighted:
+                exp_et_block.data[:] = 1.0
+            et_store.append(exp_et_block)
+            array_dict = {'indptr':exp_et_block.indptr, 'indices':exp_et_block.indices, 'data':exp_et_block.data}
+
+        if checkpoint != None:
+            checkpoint.close_shard(block_id, part_f_list, array_dict)
+
+    et_f.close()
+    if et_store_path != None:
+        if et_store == None:
+            et_store = SparseStoreWriter(et_store_path, len(col2word), np.float64)
+        et_store.close(row2entity.tolist(), col2word.tolist())
+
+
+def save_ice_et_network(exp_et_matrix, row2entity, col2word, et_save_list, weighted, sort_lines=False, batch_size=1<<20):
     """ Save the expanded entity-text subnetwork within an ICE network.
     Param:
         param1 [csr_matrix] sparse matrix of the expanded entity-text network.
-        param2 [dict] where key=row number & val=entity.
-        param3 [dict] where key=col number & val=rep word
+        param2 [list] where index=row number & val=entity.
+        param3 [list] where index=col number & val=rep word
         param4 [list] of 2-tuples of path and input mode.
         param5 [int] indicator of whether to use binary or real weights.
+        param6 [int] indicator of whether to save lines sorted as `sort` does.
+        param7 [int] number of matrix entries to format and write at a time.
+    Note:
+        1) See save_ice_et_blocks(), with param1 as a single block.
     """
-    et_f_list = [open(et_path, mode) for et_path, mode in et_save_list] 
+    save_ice_et_blocks([(0, exp_et_matrix)], row2entity, col2word, et_save_list, weighted, sort_lines, None, batch_size)
 
-    if weighted:
-        for row, col in tqdm(list(zip(*exp_et_matrix.nonzero()))):
-            entry = row2entity[row] + ' ' + col2word[col] + ' ' + str(exp_et_matrix[row, col]) + '\n'
-        
-            for et_f in et_f_list:
-                et_f.write(entry)
-    else:
-        for row, col in tqdm(list(zip(*exp_et_matrix.nonzero()))):
-            entry = row2entity[row] + ' ' + col2word[col] + ' 1.0\n'
-        
-            for et_f in et_f_list:
-                et_f.write(entry)
 
-
-def save_ice_tt_network(tt_dict, tt_save_list, weighted):
+def save_ice_tt_network(tt_edges, word_list, tt_save_list, weighted, sort_lines=False):
     """ Save the text-text subnetwork within an ICE network.
     Param:
-        param1 [dict] where key=rep word & val=list of 2-tuples of rep word and
-            respective weight.
-        param2 [list] of 2-tuples of path and input mode.
-        param3 [int] indicator of whether to use binary or real weights.
+        param1 [tuple] of from node ids, to node ids and weights of unique
+            edges ordered by unique_edge().
+        param2 [list] where index=node id & val=word.
+        param3 [list] of 2-tuples of path and input mode.
+        param4 [int] indicator of whether to use binary or real weights.
+        param5 [int] indicator of whether to save lines sorted as `sort` does.
+    """
+    save_edge_array(tt_edges, word_list, word_list, tt_save_list, weighted, sort_lines)
+    add_count('ice_tt_edges_out', len(tt_edges[0]))
+
+
+def save_ice_bin_network(bin_path, exp_et_matrix, tt_matrix, entity_list, word_list, weighted, topn=0, min_weight=0, hops=1):
+    """ Save an ICE network as binary sparse stores.
+    Param:
+        param1 [string] path to a directory to save "et" and "tt" stores in.
+        param2 [csr_matrix] sparse matrix of the expanded entity-text network,
+            or None if the "et" store was saved by save_ice_et_blocks().
+        param3 [csr_matrix] sparse matrix of the text-text network.
+        param4 [list] where index=row number & val=entity.
+        param5 [list] where index=row and col number & val=word.
+        param6 [int] indicator of whether to use binary or real weights.
+        param7 [int] number of expanded words kept per entity, 0 for all.
+        param8 [float] min weight of expanded words kept, 0 for all.
+        param9 [int] number of hops of concept expansion.
+    Note:
+        1) Weights are set to 1.0 if param6 is 0, the same as the edge lists.
+            The TT network with real weights is then also saved as "tt_weight"
+            so update_ice.py can expand new entities.
+        2) ice.json records param6 to param9, so update_ice.py expands new
+            entities the same way.
+    """
+    save_list = [('tt', tt_matrix, word_list)]
+    if exp_et_matrix is not None:
+        save_list.append(('et', exp_et_matrix, entity_list))
+    if not weighted:
+        save_list.append(('tt_weight', tt_matrix, word_list))
+
+    for name, matrix, row_items in save_list:
+        matrix = matrix.copy()
+        matrix.eliminate_zeros()
+        if not weighted and name != 'tt_weight':
+            matrix.data[:] = 1.0
+        save_sparse_store(os.path.join(bin_path, name), matrix, row_items, word_list)
+
+    with open(os.path.join(bin_path, ICE_META), 'w') as f:
+        json.dump({'weighted': int(weighted), 'topn': int(topn), 'min_w': float(min_weight), 'hops': int(hops)}, f, indent=2)
+
+
+def make_bin_version(bin_path):
+    """ Make a new version directory to save a binary ICE network in.
+    Param:
+        param1 [string] path the binary ICE network is served at.
+    Return:
+        return1 [string] path to an empty directory next to param1.
+    Note:
+        1) Versions are named "<param1>.v<time in ns>", each with a
+            "<version>.lock" file locked by the run saving it until
+            swap_bin_network(). The lock is released if the run dies.
+        2) Versions left over by dead runs are removed, but not ones still
+            locked by running builds or the one param1 points to.
+    """
+    parent, name = os.path.split(os.path.abspath(bin_path))
+    os.makedirs(parent, exist_ok=True)
+
+    # Step 1: Lock and make a new version.
+    version_path = os.path.join(parent, '{}.v{}'.format(name, time.time_ns()))
+    lock_f = open(version_path + '.lock', 'w')
+    fcntl.flock(lock_f, fcntl.LOCK_EX)
+    version_lock_dict[version_path] = lock_f
+    os.makedirs(version_path)
+
+    # Step 2: Remove versions of dead runs.
+    for entry in os.listdir(parent):
+        path = os.path.join(parent, entry)
+        if not entry.startswith(name + '.v') or not entry[len(name)+2:].isdigit() or path == version_path:
+            continue
+        with open(path + '.lock', 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue # still being saved
+            if path != os.path.realpath(bin_path): # else swapped in before its lock was released
+                shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.remove(path + '.lock')
+            except FileNotFoundError:
+                pass # removed by another run meanwhile
+
+    return version_path
+
+
+def swap_bin_network(version_path, bin_path):
+    """ Point the path of a binary ICE network at a complete new version.
+    Param:
+        param1 [string] path to a version saved by save_ice_bin_network(), see
+            make_bin_version().
+        param2 [string] path the binary ICE network is served at, which
+            becomes a symlink to param1.
+    Note:
+        1) The symlink is replaced with one rename, so readers resolving
+            param2 see either the old or the new network as a whole, see
+            ice_service.py. The old version is then removed, and readers with
+            it memory-mapped keep a consistent copy.
+        2) A directory at param2 saved before versions were used is moved
+            aside first, so param2 is missing for a moment.
     """
-    tt_f_list = [open(tt_path, mode) for tt_path, mode in tt_save_list]
+    bin_path = os.path.abspath(bin_path)
+    link_path = version_path + '.link'
+    old_path = os.path.realpath(bin_path) if os.path.islink(bin_path) else None
+    os.symlink(os.path.basename(version_path), link_path)
 
-    for rep_word, tup_list in tqdm(tt_dict.items()):
-        for exp_word, weight in tup_list:
-            entry = rep_word + ' ' + exp_word + ' ' + str(weight**weighted) + '\n'
+    if os.path.isdir(bin_path) and not os.path.islink(bin_path):
+        old_path = version_path + '.old'
+        os.rename(bin_path, old_path)
+    os.replace(link_path, bin_path)
+    if old_path != None and old_path != version_path:
+        shutil.rmtree(old_path, ignore_errors=True)
 
-            for tt_f in tt_f_list:
-                tt_f.write(entry)
+    lock_f = version_lock_dict.pop(version_path, None)
+    if lock_f != None:
+        os.remove(version_path + '.lock')
+        lock_f.close()
 
 
 def main():
     # Step 0: Get inputs from user.
-    et_path, tt_path, et_save_list, tt_save_list, w = get_user_input()
+    et_path, tt_path, et_save_list, tt_save_list, w, bin_path, sort_lines, dtype, metrics_path, quiet, block_size, topn, min_weight, hops, power_root, dry_run, force, ckpt_path = get_user_input()
+
+    part_dict = {path:'et' for path, _ in et_save_list}
+    part_dict.update({path:'full' if path in part_dict else 'tt' for path, _ in tt_save_list})
+    if bin_path != None:
+        part_dict[bin_path] = 'bin'
+    param_dict = {'w':w, 'sorted':sort_lines, 'dtype':str(dtype), 'topn':topn, 'min_w':min_weight, 'hops':hops}
+    output_dict = {path:dict(param_dict, part=part) for path, part in part_dict.items()}
+    manifest, stale_list = check_stage('gen_ice', [et_path, tt_path], output_dict, dry_run, force)
+    if not stale_list:
+        return
+
+    start_run('gen_ice', metrics_path, quiet)
 
     print('\nStart constructing ICE network!') 
     print('Step 1-1: Construct ET network from ET relations...')
-    et_dict = gen_et_network(et_path)
+    with step('Step 1-1'):
+        et_edges, entity_list, et_word_list = gen_et_network(et_path, dtype)
   
     print('Step 1-2: Construct TT network from TT relations...')
-    tt_dict, word_list = gen_tt_network(tt_path)
+    with step('Step 1-2'):
+        tt_edges, word_list = gen_tt_network(tt_path, dtype)
 
-    entity_list = list(et_dict.keys())
-    entity2index = {entity:index for index, entity in enumerate(entity_list)}
-    word2index = {word:index for index, word in enumerate(word_list)}
     print('Step 2-1: Convert entity-text matrix into a sparse matrix...')
-    et_matrix = dict2sparse_mat(et_dict, entity2index, word2index)
+    with step('Step 2-1'):
+        word2index = {word:index for index, word in enumerate(word_list)}
+        et_matrix = et2sparse_mat(et_edges, et_word_list, word2index, len(entity_list))
 
     print('Step 2-2: Convert text-text matrix into a sparse matrix...')
-    tt_matrix = dict2sparse_mat(tt_dict, word2index, word2index)
-
-    print('Step 3: Perform concept expansion...')
-    exp_et_matrix = et_matrix.dot(tt_matrix)
-
-    print('Step 4-1: Save ET part of the ICE network...')
-    save_ice_et_network(exp_et_matrix, entity_list, word_list, et_save_list, w)
-
-    print('Step 4-2: Save TT part of the ICE network...')
-    save_ice_tt_network(tt_dict, tt_save_list, w)
-
+    with step('Step 2-2'):
+        tt_matrix = edge2sparse_mat(tt_edges, len(word_list), len(word_list))
+
+    print('Step 3 & 4-1: Perform concept expansion and save ET part of the ICE network block by block...')
+    with step('Step 3 & 4-1'), tempfile.TemporaryDirectory() as tmp_root:
+        checkpoint, skip_set = None, set()
+        if ckpt_path != None:
+            checkpoint = ShardCheckpoint(ckpt_path, get_checkpoint_key(manifest, dict(param_dict, block=block_size, bin=bin_path != None, text=bool(et_save_list))))
+            skip_set = {start for start in range(0, len(entity_list), block_size) if checkpoint.is_done(start // block_size)}
+        tt_power = gen_tt_power(tt_matrix, word_list, hops, tmp_root if power_root == None else power_root, block_size, topn, min_weight)
+        version_path = None if bin_path == None else make_bin_version(bin_path)
+        et_store_path = None if bin_path == None else os.path.join(version_path, 'et')
+        save_ice_et_blocks(iter_exp_block(et_matrix, tt_power, block_size, topn, min_weight, skip_set=skip_set), entity_list, word_list, et_save_list, w, sort_lines, et_store_path, checkpoint=checkpoint)
+        del tt_power
+
+    if tt_save_list:
+        print('Step 4-2: Save TT part of the ICE network...')
+        with step('Step 4-2'):
+            save_ice_tt_network(tt_edges, word_list, tt_save_list, w, sort_lines)
+
+    if bin_path != None:
+        print('Step 4-3: Save binary ICE network...')
+        with step('Step 4-3'):
+            save_ice_bin_network(version_path, None, tt_matrix, entity_list, word_list, w, topn, min_weight, hops)
+            swap_bin_network(version_path, bin_path)
+
+    if checkpoint != None:
+        checkpoint.finish()
+    save_stage_manifest(manifest, output_dict)
+    finish_run()
     print('Finished constructing ICE network!\n')
     
 if __name__ == '__main__':
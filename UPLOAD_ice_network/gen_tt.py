@@ -20,13 +20,31 @@
 #       1) IndexedMatrix
 #   Func:
 #       1) gen_indexed_matrix               2) load_rep_word
-#       3) load_word_embd                   4) gen_tt_relation
+#       3) load_word_embd                   4) load_embd_matrix
+#       5) get_tile_size                    6) iter_exp_word
+#       7) share_matrix                     8) attach_matrix
+#       9) init_search_worker              10) search_tile
+#      11) iter_exp_word_parallel          12) iter_search
+#      13) search_exp_word                 14) report_ann_recall
+#      15) format_tt_path                  16) gen_tt_relation
+#      17) gen_multi_tt_relation
 
-from sklearn.metrics import pairwise_distances
 import json
 import numpy as np
 import argparse
+import sys
+from multiprocessing import Pool, shared_memory
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
+from embd_store import is_embd_store, load_embd_store, embd_fingerprint, normalize_rows
+from ann_index import load_ivf_index, iter_ann_exp_word
+from edge_io import open_edge_writer, open_edge_reader
+from neighbor_cache import NeighborCache
+from metrics import start_run, step, add_count, finish_run
+from stage_cache import check_stage, save_stage_manifest
+from checkpoint import ShardCheckpoint, get_checkpoint_key
+
+search_state = {} # per worker process, see init_search_worker()
 
 class IndexedMatrix():
     """ (duplicated)
@@ -38,10 +56,11 @@ class IndexedMatrix():
         Param:
             param1 [self] reference to this object.
             param2 [list] of items.
-            param3 [list] of lists of item-associated repr.
+            param3 [list] of lists of item-associated repr, or a float32
+                np.ndarray which is kept as is (e.g. memory-mapped).
         """
-        self.items = np.array(list(items)) # set will cause error later
-        self.embd_matrix = np.array(embd_matrix).astype(np.float32)
+        self.items = list(items) # set will cause error later
+        self.embd_matrix = np.asarray(embd_matrix, dtype=np.float32)
 
 def gen_indexed_matrix(words, embd_dict):
     """ Construct an IndexedMatrix object.
@@ -58,7 +77,7 @@ def gen_indexed_matrix(words, embd_dict):
 def load_rep_word(et_rel_path):
     """ Load a list of unique representative words from ET relation.
     Param:
-        param1 [string] path to load ET relation.
+        param1 [string] path to load ET relation, which may be compressed.
     Return:
         return1 [set] of unique representative words.
     Note:
@@ -67,7 +86,7 @@ def load_rep_word(et_rel_path):
     """
     rep_word_set = set()
 
-    with open(et_rel_path) as f:
+    with open_edge_reader(et_rel_path) as f:
         for edge in f:
             entry = edge.strip().split()
             rep_word_set.add(entry[1])
@@ -93,59 +112,432 @@ def load_word_embd(word_embd_path):
 
     return word_embd_dict
 
-def gen_tt_relation(tt_path, rep_word_set, word_embd_dict, expk, weighted):
-    """ Generate and save TT relation.
+def load_embd_matrix(word_embd_path, norm=False):
+    """ Load all words and their embeddings as an IndexedMatrix.
     Param:
-        param1 [string] path to save TT relation.
-        param2 [set] of representative words.
-        param3 [dict] where key=word & val=word embeddings.
-        param4 [int] number of expanded words to pick per keyword.
-        param5 [int] indicator of whether to use binary or loaded weights.
-    """
-    tt_relation = set() # remove duplicates
-
-    # Step 1: Find the cosine distance between every pair of word embeddings.
-    rep_mat = gen_indexed_matrix(rep_word_set, word_embd_dict)
-    exp_mat = gen_indexed_matrix(list(word_embd_dict.keys()), word_embd_dict)
-    cos_mat = pairwise_distances(rep_mat.embd_matrix, exp_mat.embd_matrix, "cosine")
-
-    # Step 2: Find expansion words for every representative word.
-    if weighted:
-        for rep_idx in tqdm(range(len(rep_mat.items))):
-            exp_idx_list = cos_mat[rep_idx].argsort()[1:expk+1] # exclude rep word
-            for exp_idx in exp_idx_list:
-                # Convert cos distance to similarity then shift and rescale.
-                #   1) Shift from [-1,1] to [0,2] to ensure positiveness.
-                #   2) Normalize to [0,1] to resemble probability.
-                sim = str(1-cos_mat[rep_idx][exp_idx]/2) # cos sim = 1-cos dist
-                tt_relation.add(rep_mat.items[rep_idx]+" "+exp_mat.items[exp_idx]+" "+sim)
+        param1 [string] path to the word embedding text file or binary store.
+        param2 [bool] whether to scale every embedding to unit L2 norm.
+    Return:
+        return1 [IndexedMatrix] object of every word with an embedding.
+    Note:
+        1) A binary store is memory-mapped rather than read into memory.
+    """
+    if is_embd_store(word_embd_path):
+        return IndexedMatrix(*load_embd_store(word_embd_path, norm))
+
+    word_embd_dict = load_word_embd(word_embd_path)
+    mat = gen_indexed_matrix(list(word_embd_dict.keys()), word_embd_dict)
+    if norm:
+        normalize_rows(mat.embd_matrix, mat.embd_matrix)
+
+    return mat
+
+def get_tile_size(n_words, mem_budget):
+    """ Get the number of representative words to search at a time.
+    Param:
+        param1 [int] number of words with embeddings.
+        param2 [int] memory budget in MB for a tile of cosine distances.
+    Return:
+        return1 [int] number of representative words per tile.
+    Note:
+        1) Every cell of a tile takes 4 bytes of float32 distance plus 8 bytes
+            of int64 index during partial selection.
+    """
+    return max(1, (mem_budget << 20) // (12 * max(1, n_words)))
+
+def iter_exp_word(rep_index, exp_matrix, expk, tile_size):
+    """ Find expansion words of representative words one tile at a time.
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] number of representative words per tile.
+    Yield:
+        yield1 [int] position of the first representative word of the tile.
+        yield2 [np.ndarray] int of shape (tile, expk) row numbers of expanded
+            words ordered ascendingly by cosine distance.
+        yield3 [np.ndarray] float32 of shape (tile, expk) cosine distances.
+    Note:
+        1) Cosine distance is computed as in sklearn pairwise_distances, i.e.
+            1 minus the dot product of normalized rows clipped to [0,2].
+        2) A representative word is never its own expanded word.
+        3) Ties in distance are broken by ascending row number.
+    """
+    k = min(expk, len(exp_matrix)-1)
+
+    for start in range(0, len(rep_index), tile_size):
+        tile_index = rep_index[start:start+tile_size]
+        tile_rows = np.arange(len(tile_index))[:, np.newaxis]
+
+        # Step 1: Find the cosine distance from the tile to every word.
+        cos_tile = np.dot(exp_matrix[tile_index], exp_matrix.T)
+        cos_tile *= -1
+        cos_tile += 1
+        np.clip(cos_tile, 0, 2, out=cos_tile)
+        cos_tile[tile_rows[:, 0], tile_index] = np.inf # exclude rep word
+
+        # Step 2: Select the k nearest words then order only those.
+        if k < cos_tile.shape[1]-1:
+            exp_idx_tile = np.argpartition(cos_tile, k-1, axis=1)[:, :k]
+        else:
+            exp_idx_tile = np.tile(np.arange(cos_tile.shape[1]), (len(tile_index), 1))
+        exp_dist_tile = cos_tile[tile_rows, exp_idx_tile]
+        order = np.lexsort((exp_idx_tile, exp_dist_tile))[:, :k]
+
+        yield start, exp_idx_tile[tile_rows, order], exp_dist_tile[tile_rows, order]
+
+def share_matrix(embd_matrix):
+    """ Make a matrix available to worker processes without pickling it.
+    Param:
+        param1 [np.ndarray] float32 matrix, possibly memory-mapped.
+    Return:
+        return1 [tuple] descriptor of the matrix for attach_matrix().
+        return2 [SharedMemory] block to release after use, or None if the
+            matrix is already backed by a file.
+    """
+    base = embd_matrix
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    if isinstance(base, np.memmap) and base.shape == embd_matrix.shape and base.dtype == np.float32:
+        return ("mmap", base.filename, base.offset, embd_matrix.shape), None
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, embd_matrix.nbytes))
+    np.ndarray(embd_matrix.shape, dtype=np.float32, buffer=shm.buf)[:] = embd_matrix
+
+    return ("shm", shm.name, 0, embd_matrix.shape), shm
+
+def attach_matrix(matrix_desc):
+    """ Attach to a matrix shared by share_matrix().
+    Param:
+        param1 [tuple] descriptor returned by share_matrix().
+    Return:
+        return1 [np.ndarray] float32 matrix backed by the shared file or memory.
+        return2 [SharedMemory] block to keep alive while in use, or None.
+    """
+    kind, name, offset, shape = matrix_desc
+    if kind == "mmap":
+        return np.memmap(name, dtype=np.float32, mode="r", offset=offset, shape=shape), None
+
+    shm = shared_memory.SharedMemory(name=name)
+
+    return np.ndarray(shape, dtype=np.float32, buffer=shm.buf), shm
+
+def init_search_worker(matrix_desc, expk, ivf_index):
+    """ Set up a worker process for search_tile().
+    Param:
+        param1 [tuple] descriptor returned by share_matrix().
+        param2 [int] number of expanded words to pick per keyword.
+        param3 [IVFIndex] object for approximate search, or None for exact.
+    Note:
+        1) BLAS is limited to one thread as parallelism comes from processes.
+    """
+    search_state["exp_matrix"], search_state["shm"] = attach_matrix(matrix_desc)
+    search_state["expk"] = expk
+    search_state["ivf_index"] = ivf_index
+    search_state["limiter"] = threadpool_limits(1)
+
+def search_tile(task):
+    """ Find expansion words of one tile of representative words in a worker.
+    Param:
+        param1 [tuple] of the tile position and row numbers of its words.
+    Return:
+        return1 [tuple] the same as one item of iter_exp_word().
+    """
+    start, tile_index = task
+    if search_state["ivf_index"] is None:
+        exp_word_iter = iter_exp_word(tile_index, search_state["exp_matrix"], search_state["expk"], len(tile_index))
     else:
-        for rep_idx in tqdm(range(len(rep_mat.items))):
-            exp_idx_list = cos_mat[rep_idx].argsort()[1:expk+1] # exclude rep word
-            for exp_idx in exp_idx_list:
-                tt_relation.add(rep_mat.items[rep_idx]+" "+exp_mat.items[exp_idx]+" 1.0")
+        exp_word_iter = iter_ann_exp_word(tile_index, search_state["exp_matrix"], search_state["expk"], len(tile_index), search_state["ivf_index"])
+    _, exp_idx_tile, exp_dist_tile = next(exp_word_iter)
 
-    # Step 3: Save TT relation.
-    with open(tt_path, "w") as f:
-        f.write("\n".join(list(tt_relation)))
+    return start, exp_idx_tile, exp_dist_tile
+
+def iter_exp_word_parallel(rep_index, exp_matrix, expk, tile_size, n_workers, ivf_index=None):
+    """ Find expansion words of representative words with a process pool. A
+    drop-in for iter_exp_word() and ann_index.iter_ann_exp_word().
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] number of representative words per tile.
+        param5 [int] number of worker processes.
+        param6 [IVFIndex] object for approximate search, or None for exact.
+    Yield:
+        The same as iter_exp_word(), in the same order.
+    Note:
+        1) Tiles are the same as in a serial run so results are identical.
+        2) Each worker holds one tile at a time, i.e. param4 is per worker.
+    """
+    matrix_desc, shm = share_matrix(exp_matrix)
+    task_list = [(start, rep_index[start:start+tile_size]) for start in range(0, len(rep_index), tile_size)]
+
+    try:
+        with Pool(n_workers, initializer=init_search_worker, initargs=(matrix_desc, expk, ivf_index)) as pool:
+            for result in pool.imap(search_tile, task_list):
+                yield result
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+def iter_search(rep_index, exp_matrix, expk, tile_size, ivf_index=None, n_workers=1):
+    """ Find expansion words of representative words with the chosen search.
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] number of representative words per tile.
+        param5 [IVFIndex] object for approximate search, or None for exact.
+        param6 [int] number of worker processes to search with.
+    Return:
+        return1 [generator] the same as iter_exp_word().
+    """
+    if n_workers > 1:
+        return iter_exp_word_parallel(rep_index, exp_matrix, expk, tile_size, n_workers, ivf_index)
+    elif ivf_index is None:
+        return iter_exp_word(rep_index, exp_matrix, expk, tile_size)
+
+    return iter_ann_exp_word(rep_index, exp_matrix, expk, tile_size, ivf_index)
+
+def search_exp_word(rep_index, exp_matrix, expk, mem_budget=1024, ivf_index=None, n_workers=1, neighbor_cache=None):
+    """ Find expansion words of representative words, through a neighbor cache
+    if given.
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] memory budget in MB for a tile of cosine distances, per
+            worker process.
+        param5 [IVFIndex] object for approximate search, or None for exact.
+        param6 [int] number of worker processes to search with.
+        param7 [NeighborCache] object of exact expansion words, or None. Only
+            words not cached yet are searched, then the cache is saved.
+    Return:
+        return1 [generator] the same as iter_exp_word().
+    """
+    tile_size = get_tile_size(len(exp_matrix), mem_budget)
+    if neighbor_cache is None:
+        add_count("searched_words", len(rep_index))
+        return iter_search(rep_index, exp_matrix, expk, tile_size, ivf_index, n_workers)
+
+    miss_index = neighbor_cache.get_missing(rep_index, expk)
+    print("Searching", len(miss_index), "of", len(rep_index), "words not in the neighbor cache.")
+    add_count("searched_words", len(miss_index))
+    for start, exp_idx_tile, exp_dist_tile in tqdm(iter_search(miss_index, exp_matrix, expk, tile_size, None, n_workers), total=-(-len(miss_index)//tile_size)):
+        neighbor_cache.add(miss_index[start:start+len(exp_idx_tile)], exp_idx_tile, exp_dist_tile)
+    neighbor_cache.save()
+
+    return neighbor_cache.iter_exp_word(rep_index, expk, tile_size)
+
+def report_ann_recall(rep_index, exp_matrix, expk, ivf_index, n_sample, mem_budget=1024, seed=0):
+    """ Measure recall of approximate against exact expansion words.
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [IVFIndex] object built on param2.
+        param5 [int] number of representative words to sample.
+        param6 [int] memory budget in MB for a tile of cosine distances of
+            exact search.
+        param7 [int] random seed.
+    Return:
+        return1 [float] mean fraction of exact top param3 words found.
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(np.sort(rep_index), size=min(n_sample, len(rep_index)), replace=False) # same sample for any order of param1
+    exact_tile = [exp_idx_list for _, exp_idx_tile, _ in iter_exp_word(sample, exp_matrix, expk, get_tile_size(len(exp_matrix), mem_budget)) for exp_idx_list in exp_idx_tile]
+    ann_tile, _ = ivf_index.search(sample, exp_matrix, expk)
+
+    hit = sum(len(np.intersect1d(exact_list, ann_list)) for exact_list, ann_list in zip(exact_tile, ann_tile))
+    recall = hit / max(1, sum(len(exact_list) for exact_list in exact_tile))
+    print("Recall@"+str(expk), "of approximate search on", len(sample), "words:", round(recall, 4))
+
+    return recall
+
+def format_tt_path(tt_path, expk, weighted):
+    """ Get the path to save the TT relation of one setting.
+    Param:
+        param1 [string] path which may contain "{expk}" and "{w}" placeholders.
+        param2 [int] number of expanded words to pick per keyword.
+        param3 [int] indicator of whether to use binary or loaded weights.
+    Return:
+        return1 [string] path with placeholders filled.
+    """
+    return tt_path.format(expk=expk, w=weighted)
+
+def gen_tt_relation(tt_path, rep_word_set, exp_mat, expk_list, weighted_list, mem_budget=1024, ivf_index=None, n_workers=1, sort_lines=False, neighbor_cache=None, checkpoint=None):
+    """ Generate and save TT relation for every expk and weighting setting.
+    Param:
+        param1 [string] path to save TT relation, see format_tt_path().
+        param2 [set] of representative words.
+        param3 [IndexedMatrix] of every word with its unit-normalized embedding.
+        param4 [list] of numbers of expanded words to pick per keyword.
+        param5 [list] of indicators of whether to use binary or loaded weights.
+        param6 [int] memory budget in MB for a tile of cosine distances.
+        param7 [IVFIndex] object for approximate search, or None for exact.
+        param8 [int] number of worker processes to search with.
+        param9 [bool] whether to save lines sorted as `sort` does.
+        param10 [NeighborCache] object of exact expansion words, or None.
+        param11 [ShardCheckpoint] object to resume from and save tiles to, or
+            None.
+    Note:
+        1) Expansion words are searched once for max(param4) as the top words
+            of a smaller expk are a prefix of those of a larger one.
+    """
+    gen_multi_tt_relation({tt_path:rep_word_set}, exp_mat, expk_list, weighted_list, mem_budget, ivf_index, n_workers, sort_lines, neighbor_cache, checkpoint)
+
+def gen_multi_tt_relation(tt_rep_dict, exp_mat, expk_list, weighted_list, mem_budget=1024, ivf_index=None, n_workers=1, sort_lines=False, neighbor_cache=None, checkpoint=None):
+    """ Generate and save TT relations of several sets of representative words.
+    Param:
+        param1 [dict] where key=path to save TT relation (see format_tt_path())
+            & val=set of representative words.
+        param2 [IndexedMatrix] of every word with its unit-normalized embedding.
+        param3 [list] of numbers of expanded words to pick per keyword.
+        param4 [list] of indicators of whether to use binary or loaded weights.
+        param5 [int] memory budget in MB for a tile of cosine distances, per
+            worker process.
+        param6 [IVFIndex] object for approximate search, or None for exact.
+        param7 [int] number of worker processes to search with.
+        param8 [bool] whether to save lines sorted as `sort` does rather than
+            by representative word then ascending cosine distance.
+        param9 [NeighborCache] object of exact expansion words, or None. Only
+            words not cached yet are searched, then the cache is saved.
+        param10 [ShardCheckpoint] object to resume from and save tiles to, or
+            None. It is removed once every setting is saved.
+    Note:
+        1) Expansion words are searched once per word in the union of param1
+            values, as they do not depend on the other words of a set.
+        2) Tiles completed by an earlier run in param10 are replayed instead of
+            searched, so a resumed run saves the same relations.
+    """
+    word2index = {word:index for index, word in enumerate(exp_mat.items)}
+    rep_items = sorted(set().union(*tt_rep_dict.values())) # deterministic order
+    rep_index = np.array([word2index[word] for word in rep_items], dtype=np.int64)
+    add_count("rep_words", len(rep_items))
+    tile_size = get_tile_size(len(exp_mat.embd_matrix), mem_budget)
+    tile_list = list(range(0, len(rep_items), tile_size))
+    done_set = set() if checkpoint == None else {start for start in tile_list if checkpoint.is_done(start // tile_size)}
+    todo_list = [start for start in tile_list if start not in done_set]
+    exp_word_iter = iter([])
+    if todo_list:
+        # Tiles to search are full except maybe the last, so they keep their bounds.
+        todo_index = rep_index if not done_set else np.concatenate([rep_index[start:start+tile_size] for start in todo_list])
+        exp_word_iter = search_exp_word(todo_index, exp_mat.embd_matrix, max(expk_list), mem_budget, ivf_index, n_workers, neighbor_cache)
+    tt_f_dict = {(tt_path, expk, weighted):open_edge_writer(format_tt_path(tt_path, expk, weighted), "w", sort_lines) for tt_path in tt_rep_dict for expk in expk_list for weighted in weighted_list}
+
+    with tqdm(total=len(rep_items)) as pbar:
+        for start in tile_list:
+            # Step 0: Replay a tile completed by an earlier run.
+            if start in done_set:
+                for part, tt_f in enumerate(tt_f_dict.values()):
+                    for text in checkpoint.iter_shard_text(start // tile_size, part):
+                        tt_f.write(text)
+                pbar.update(len(rep_items[start:start+tile_size]))
+                continue
+
+            # Step 1: Find expansion words for a tile of representative words.
+            _, exp_idx_tile, exp_dist_tile = next(exp_word_iter)
+            tt_edge_dict = {setting:[] for setting in tt_f_dict}
+
+            # Step 2: Format edges of the largest expk once per weighting.
+            for rep_word, exp_idx_list, exp_dist_list in zip(rep_items[start:], exp_idx_tile, exp_dist_tile):
+                tt_path_list = [tt_path for tt_path, rep_word_set in tt_rep_dict.items() if rep_word in rep_word_set]
+
+                for weighted in weighted_list:
+                    if weighted:
+                        # Convert cos distance to similarity then shift and rescale.
+                        #   1) Shift from [-1,1] to [0,2] to ensure positiveness.
+                        #   2) Normalize to [0,1] to resemble probability.
+                        edge_list = [rep_word+" "+exp_mat.items[exp_idx]+" "+str(1-exp_dist/2)+"\n" for exp_idx, exp_dist in zip(exp_idx_list, exp_dist_list)] # cos sim = 1-cos dist
+                    else:
+                        edge_list = [rep_word+" "+exp_mat.items[exp_idx]+" 1.0\n" for exp_idx in exp_idx_list]
+
+                    for tt_path in tt_path_list:
+                        for expk in expk_list:
+                            tt_edge_dict[(tt_path, expk, weighted)].extend(edge_list[:expk])
+
+            # Step 3: Save TT relation of the tile for every setting.
+            part_f_list = [] if checkpoint == None else checkpoint.open_shard(start // tile_size, len(tt_f_dict))
+            for part, (setting, tt_f) in enumerate(tt_f_dict.items()):
+                text = "".join(tt_edge_dict[setting])
+                tt_f.write(text)
+                if part_f_list:
+                    part_f_list[part].write(text)
+                add_count("tt_edges_out", len(tt_edge_dict[setting]))
+            if checkpoint != None:
+                checkpoint.close_shard(start // tile_size, part_f_list)
+            pbar.update(len(exp_idx_tile))
+
+    for tt_f in tt_f_dict.values():
+        tt_f.close()
+    if checkpoint != None:
+        checkpoint.finish()
 
 def main():
     # Step 1: Get arguments from users.
     parser = argparse.ArgumentParser(description="Generate text-text (TT) relation.")
-    parser.add_argument("-embd", help="Path to load word embeddings.")
+    parser.add_argument("-embd", help="Path to load word embeddings text file or binary store.")
     parser.add_argument("-et", help="Path to load entity-text (ET) relation.")
-    parser.add_argument("-expk", type=int, help="Number of expanded words per representative words.")
-    parser.add_argument("-tt", help="Path to save TT relation.")
-    parser.add_argument("-w", type=int, choices=[0,1], default=0, help="(Default) 0:unweighted / 1:weighted.")
+    parser.add_argument("-expk", type=int, nargs="+", help="Number(s) of expanded words per representative words.")
+    parser.add_argument("-tt", help="Path to save TT relation, compressed if it ends with .gz or .zst. Use {expk} and {w} placeholders for several settings.")
+    parser.add_argument("-w", type=int, nargs="+", choices=[0,1], default=[0], help="(Default) 0:unweighted / 1:weighted. Several allowed.")
+    parser.add_argument("-mem", type=int, default=1024, help="(Default 1024) Memory budget in MB for a tile of cosine distances per worker.")
+    parser.add_argument("-workers", type=int, default=1, help="(Default 1) Number of worker processes to search with.")
+    parser.add_argument("-sorted", type=int, choices=[0,1], default=0, help="(Default) 0:representative word order / 1:sorted as `sort` does.")
+    parser.add_argument("-index", help="(Optional) Path to load ANN index for approximate search, see ann_index.py.")
+    parser.add_argument("-nprobe", type=int, default=8, help="(Default 8) Number of inverted lists to search per word.")
+    parser.add_argument("-rerank", type=int, default=100, help="(Default 100) Number of PQ candidates to rescore exactly per word.")
+    parser.add_argument("-recall", type=int, default=1000, help="(Default 1000) Number of words to measure ANN recall on, 0 to skip.")
+    parser.add_argument("-cache", help="(Optional) Directory of neighbor caches of exact search, one per embedding fingerprint.")
+    parser.add_argument("-metrics", help="(Optional) Path to save metrics, .jsonl to append one line per run.")
+    parser.add_argument("-quiet", type=int, choices=[0,1], default=0, help="(Default) 0:show progress bars / 1:no progress bars.")
+    parser.add_argument("-ckpt", help="(Optional) Directory to save completed tiles in, so that a restarted run resumes from them.")
+    parser.add_argument("-dry_run", type=int, choices=[0,1], default=0, help="(Default 0) 1:only list which outputs are fresh or stale, see stage_cache.py.")
+    parser.add_argument("-force", type=int, choices=[0,1], default=0, help="(Default 0) 1:rebuild outputs even if they are up to date.")
     args = parser.parse_args()
 
+    tt_path_set = {format_tt_path(args.tt, expk, w) for expk in args.expk for w in args.w}
+    if len(tt_path_set) < len(set(args.expk))*len(set(args.w)):
+        print('Please use {expk} and {w} placeholders in the TT path for several settings.')
+        sys.exit()
+    elif args.cache != None and args.index != None:
+        print('Please use either -cache for exact search or -index for approximate search.')
+        sys.exit()
+
+    input_list = [args.embd, args.et] if args.index == None else [args.embd, args.et, args.index]
+    ann_param = {} if args.index == None else {"nprobe":args.nprobe, "rerank":args.rerank}
+    output_dict = {format_tt_path(args.tt, expk, w):dict(ann_param, expk=expk, w=w, sorted=args.sorted) for expk in args.expk for w in args.w}
+    manifest, stale_list = check_stage("gen_tt", input_list, output_dict, args.dry_run, args.force)
+    if not stale_list:
+        return
+
     print('Start generating TT relation...')
 
+    start_run("gen_tt", args.metrics, args.quiet)
+
     # Step 2: Construct TT Network:
-    rep_word_set = load_rep_word(args.et)
-    word_embd_dict = load_word_embd(args.embd)
-    gen_tt_relation(args.tt, rep_word_set, word_embd_dict, args.expk, args.w)
+    with step("Step 2-1: Load rep words and embeddings"):
+        rep_word_set = load_rep_word(args.et)
+        exp_mat = load_embd_matrix(args.embd, norm=True)
+        add_count("embd_words", len(exp_mat.items))
+    with step("Step 2-2: Open ANN index, neighbor cache or checkpoint"):
+        ivf_index = None
+        if args.index != None:
+            ivf_index = load_ivf_index(args.index, embd_fingerprint(args.embd), args.nprobe, args.rerank)
+            if args.recall:
+                word2index = {word:index for index, word in enumerate(exp_mat.items)}
+                report_ann_recall(np.array([word2index[word] for word in rep_word_set]), exp_mat.embd_matrix, max(args.expk), ivf_index, args.recall, args.mem)
+        neighbor_cache = None
+        if args.cache != None:
+            neighbor_cache = NeighborCache(args.cache, embd_fingerprint(args.embd), exp_mat.items, exp_mat.embd_matrix)
+        checkpoint = None
+        if args.ckpt != None:
+            checkpoint = ShardCheckpoint(args.ckpt, get_checkpoint_key(manifest, {"outputs":output_dict, "mem":args.mem}))
+    with step("Step 2-3: Search and save TT relation"):
+        gen_tt_relation(args.tt, rep_word_set, exp_mat, sorted(set(args.expk)), sorted(set(args.w)), args.mem, ivf_index, args.workers, args.sorted, neighbor_cache, checkpoint)
 
+    save_stage_manifest(manifest, output_dict)
+    finish_run()
     print('Finished generating TT relation!\n')
     
 if __name__ == "__main__":
@@ -0,0 +1,383 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: ice_service.py
+# Cont:
+#   Class:
+#       1) ICEIndex                         2) ICEService
+#       3) ICERequestHandler                4) UnixHTTPServer
+#       5) UnixHTTPConnection
+#   Func:
+#       1) get_network_version              2) make_server
+
+import argparse
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from update_ice import load_ice_bin_network
+
+def get_network_version(bin_path):
+    """ Get the version of a binary ICE network from the directory its path
+    resolves to and its meta files.
+    Param:
+        param1 [string] path to the binary ICE network directory.
+    Return:
+        return1 [list] of the resolved directory and modification times of the
+            meta files, or None if the network is missing or incomplete.
+    Note:
+        1) gen_ice.py and update_ice.py save every build in a new directory
+            and point param1 at it once complete, see
+            gen_ice.swap_bin_network().
+    """
+    real_path = os.path.realpath(bin_path)
+    version = [real_path]
+
+    for name in ['ice.json', os.path.join('et', 'meta.json'), os.path.join('tt', 'meta.json')]:
+        try:
+            version.append(os.stat(os.path.join(real_path, name)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    return version
+
+class ICEIndex():
+    """ Read-only lookups of expanded concepts and TT neighbors over a memory-
+    mapped binary ICE network, see gen_ice.save_ice_bin_network().
+    Note:
+        1) Every expanded concept of an unweighted network weighs 1.0, so
+            expand() cannot rank them and rejects a top n. TT neighbors are
+            ranked and weighted by the "tt_weight" store of real weights.
+    """
+
+    def __init__(self, bin_path):
+        """ Constructor for ICEIndex.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the binary ICE network directory.
+        """
+        self.bin_path = bin_path
+        self.real_path = os.path.realpath(bin_path) # one version for every store
+        self.version = get_network_version(self.real_path)
+        self.exp_et_matrix, self.tt_matrix, self.entity_list, self.word_list, self.weighted = load_ice_bin_network(self.real_path)
+        self.entity2row = {entity:row for row, entity in enumerate(self.entity_list)}
+        self.word2row = {word:row for row, word in enumerate(self.word_list)}
+
+    def get_row(self, matrix, row, topn=0):
+        """ Get the words of a row with the largest weights.
+        Param:
+            param1 [self] reference to this object.
+            param2 [csr_matrix] memory-mapped network.
+            param3 [int] row number.
+            param4 [int] number of words to return, 0 for all.
+        Return:
+            return1 [list] of [word, weight] by descending weight, ties in word
+                order.
+        """
+        lo, hi = matrix.indptr[row], matrix.indptr[row+1]
+        data = matrix.data[lo:hi]
+        order = np.argsort(-data, kind='stable')
+        if topn > 0:
+            order = order[:topn]
+
+        return [[self.word_list[col], weight] for col, weight in zip(matrix.indices[lo:hi][order].tolist(), data[order].tolist())]
+
+    def expand(self, entity, topn=0):
+        """ Get expanded concepts of an entity.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] entity.
+            param3 [int] number of words to return, 0 for all.
+        Return:
+            return1 [list] of [word, weight] by descending weight, or None for
+                an unknown entity.
+        """
+        if topn > 0 and not self.weighted:
+            raise ValueError('topn needs a weighted ICE network, as every expanded concept of an unweighted one weighs 1.0')
+        row = self.entity2row.get(entity)
+        return None if row == None else self.get_row(self.exp_et_matrix, row, topn)
+
+    def neighbors(self, word, topn=0):
+        """ Get TT neighbors of a word.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] word.
+            param3 [int] number of words to return, 0 for all.
+        Return:
+            return1 [list] of [word, weight] by descending real weight, or None
+                for an unknown word.
+        """
+        row = self.word2row.get(word)
+        return None if row == None else self.get_row(self.tt_matrix, row, topn)
+
+    def expand_batch(self, entity_list, topn=0):
+        """ Get expanded concepts of several entities, see expand().
+        Param:
+            param1 [self] reference to this object.
+            param2 [list] of entities.
+            param3 [int] number of words to return per entity, 0 for all.
+        Return:
+            return1 [list] of results in the order of param2.
+        """
+        return [self.expand(entity, topn) for entity in entity_list]
+
+    def neighbors_batch(self, word_list, topn=0):
+        """ Get TT neighbors of several words, see neighbors().
+        Param:
+            param1 [self] reference to this object.
+            param2 [list] of words.
+            param3 [int] number of words to return per word, 0 for all.
+        Return:
+            return1 [list] of results in the order of param2.
+        """
+        return [self.neighbors(word, topn) for word in word_list]
+
+class ICEService():
+    """ Query service which answers from the current ICEIndex and swaps in a
+    newly built network without stopping.
+    Usage:
+        service = ICEService('networks/ice_bin', watch_interval=5)
+        service.expand('entity', 10)
+        service.neighbors_batch(['word1', 'word2'], 10)
+    """
+
+    def __init__(self, bin_path, watch_interval=0):
+        """ Constructor for ICEService.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the binary ICE network directory.
+            param3 [float] seconds between checks for a rebuilt network, 0 to
+                only reload on reload().
+        """
+        self.index = ICEIndex(bin_path)
+        self.reload_lock = threading.Lock()
+        if watch_interval > 0:
+            threading.Thread(target=self.watch, args=(watch_interval,), daemon=True).start()
+
+    def reload(self, bin_path=None):
+        """ Load a network and swap it in for new queries.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the binary ICE network directory, or None
+                for the current one.
+        Return:
+            return1 [bool] True if swapped, False if the network is unchanged,
+                missing or incomplete, keeping the current index.
+        Note:
+            1) Queries keep running on the old index while the new one loads,
+                and ones already started finish on it. Its memory maps stay
+                valid after its version is removed.
+            2) The new index is loaded from the version param2 resolves to, so
+                a swap while loading gives the old or the new network as a
+                whole. param2 may be missing for a moment while a network saved
+                before versions were used is moved aside, see
+                gen_ice.swap_bin_network().
+        """
+        with self.reload_lock:
+            bin_path = self.index.bin_path if bin_path == None else bin_path
+            version = get_network_version(bin_path)
+            if version == None or (bin_path == self.index.bin_path and version == self.index.version):
+                return False
+            try:
+                index = ICEIndex(bin_path)
+            except FileNotFoundError:
+                return False # moved or removed while loading, retried on the next reload
+            if get_network_version(index.real_path) != index.version:
+                return False # rewritten while loading, retried on the next reload
+            self.index = index
+            print('Swapped in ICE network', bin_path, 'with', len(index.entity_list), 'entities and', len(index.word_list), 'words.')
+
+        return True
+
+    def watch(self, watch_interval):
+        """ Reload the network whenever it is rebuilt.
+        Param:
+            param1 [self] reference to this object.
+            param2 [float] seconds between checks.
+        """
+        while True:
+            time.sleep(watch_interval)
+            try:
+                self.reload()
+            except (OSError, ValueError) as error:
+                print('Failed to reload ICE network:', error)
+
+    def expand(self, entity, topn=0):
+        """ Get expanded concepts of an entity, see ICEIndex.expand(). """
+        return self.index.expand(entity, topn)
+
+    def neighbors(self, word, topn=0):
+        """ Get TT neighbors of a word, see ICEIndex.neighbors(). """
+        return self.index.neighbors(word, topn)
+
+    def expand_batch(self, entity_list, topn=0):
+        """ Get expanded concepts of several entities, see ICEIndex.expand_batch(). """
+        return self.index.expand_batch(entity_list, topn)
+
+    def neighbors_batch(self, word_list, topn=0):
+        """ Get TT neighbors of several words, see ICEIndex.neighbors_batch(). """
+        return self.index.neighbors_batch(word_list, topn)
+
+class ICERequestHandler(http.server.BaseHTTPRequestHandler):
+    """ HTTP endpoints of an ICEService held by the server.
+    Endpoints:
+        GET  /expand?entity=E1&entity=E2&topn=N  expanded concepts per entity.
+        GET  /neighbors?word=W1&word=W2&topn=N   TT neighbors per word.
+        GET  /health                            sizes and path of the network.
+        POST /reload?path=P                     swap in a rebuilt network.
+    Note:
+        1) Results are JSON objects where key=entity or word & val=list of
+            [word, weight] by descending weight, or null if unknown.
+        2) /expand answers 400 to topn over 0 on an unweighted network, see
+            ICEIndex.
+    """
+    protocol_version = 'HTTP/1.1' # keep-alive
+    wbufsize = -1 # headers and body go out in one write on flush
+
+    def send_json(self, status, obj):
+        """ Send a JSON response.
+        Param:
+            param1 [self] reference to this object.
+            param2 [int] HTTP status code.
+            param3 [dict] to send as JSON.
+        """
+        body = json.dumps(obj, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """ Answer lookups and health checks. """
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        index = self.server.service.index # one network for the whole request
+        try:
+            topn = int(query.get('topn', ['0'])[0])
+        except ValueError:
+            return self.send_json(400, {'error':'topn must be an integer'})
+
+        if url.path == '/expand':
+            key_list = query.get('entity', [])
+            try:
+                self.send_json(200, dict(zip(key_list, index.expand_batch(key_list, topn))))
+            except ValueError as error:
+                self.send_json(400, {'error':str(error)})
+        elif url.path == '/neighbors':
+            key_list = query.get('word', [])
+            self.send_json(200, dict(zip(key_list, index.neighbors_batch(key_list, topn))))
+        elif url.path == '/health':
+            self.send_json(200, {'path':index.bin_path, 'entities':len(index.entity_list), 'words':len(index.word_list), 'weighted':index.weighted})
+        else:
+            self.send_json(404, {'error':'unknown path ' + url.path})
+
+    def do_POST(self):
+        """ Swap in a rebuilt network. """
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/reload':
+            return self.send_json(404, {'error':'unknown path ' + url.path})
+
+        bin_path = parse_qs(url.query).get('path', [None])[0]
+        try:
+            swapped = self.server.service.reload(bin_path)
+        except (OSError, ValueError) as error:
+            return self.send_json(500, {'error':str(error)})
+        self.send_json(200, {'swapped':swapped, 'path':self.server.service.index.bin_path})
+
+    def log_message(self, format, *args):
+        pass # per-request logging costs more than a lookup
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Threaded HTTP server on a Unix domain socket. """
+    daemon_threads = True
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP client connection over a Unix domain socket. """
+
+    def __init__(self, socket_path, timeout=None):
+        """ Constructor for UnixHTTPConnection.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the Unix domain socket.
+            param3 [float] socket timeout in seconds, or None.
+        """
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        """ Connect to the Unix domain socket. """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+def make_server(service, host='127.0.0.1', port=0, socket_path=None):
+    """ Make an HTTP server of a query service.
+    Param:
+        param1 [ICEService] object to answer queries with.
+        param2 [string] host to listen on.
+        param3 [int] TCP port to listen on, 0 for any free port.
+        param4 [string] path to a Unix domain socket to listen on instead of
+            TCP, or None.
+    Return:
+        return1 [socketserver.BaseServer] server to call serve_forever() on.
+    """
+    if socket_path != None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ICERequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), ICERequestHandler)
+        server.daemon_threads = True
+    server.service = service
+
+    return server
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Serve expanded concepts and TT neighbors of a binary ICE network.")
+    parser.add_argument("-ice_bin", help="Path to load binary ICE network, see gen_ice.py -ice_bin.")
+    parser.add_argument("-host", default="127.0.0.1", help="(Default 127.0.0.1) Host to listen on.")
+    parser.add_argument("-port", type=int, default=8765, help="(Default 8765) TCP port to listen on.")
+    parser.add_argument("-socket", help="(Optional) Path to a Unix domain socket to listen on instead of TCP.")
+    parser.add_argument("-watch", type=float, default=5, help="(Default 5) Seconds between checks for a rebuilt network, 0 to only reload on POST /reload.")
+    args = parser.parse_args()
+
+    if args.ice_bin == None:
+        print('Please specify a path to load binary ICE network.')
+        sys.exit()
+
+    # Step 2: Load the network and serve queries.
+    print('Loading ICE network...')
+    service = ICEService(args.ice_bin, args.watch)
+    server = make_server(service, args.host, args.port, args.socket)
+    print('Serving ICE network on', args.socket if args.socket != None else 'http://%s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        print('Stopped serving ICE network!\n')
+
+if __name__ == "__main__":
+    main()
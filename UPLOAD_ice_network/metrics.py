@@ -0,0 +1,146 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: metrics.py
+# Cont:
+#   Func:
+#       1) set_quiet                        2) get_peak_rss
+#       3) start_run                        4) step
+#       5) add_count                        6) finish_run
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from functools import partialmethod
+from tqdm import tqdm
+
+metric_state = {"run":None, "step":None} # per process, see start_run()
+
+def set_quiet(quiet):
+    """ Turn every progress bar off.
+    Param:
+        param1 [bool] whether to turn progress bars off.
+    Note:
+        1) tqdm is patched at class level, so bars created later in any module
+            and in forked worker processes are off too.
+    """
+    if quiet:
+        tqdm.__init__ = partialmethod(tqdm.__init__, disable=True)
+
+def get_peak_rss():
+    """ Get the peak resident memory of this process and of its children.
+    Return:
+        return1 [float] peak RSS in MB of this process.
+        return2 [float] peak RSS in MB of the largest waited-for child process.
+    """
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is KB on Linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1<<20)
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / (1<<20)
+
+    return round(self_rss, 1), round(child_rss, 1)
+
+def start_run(script, metrics_path=None, quiet=False):
+    """ Start recording metrics of a script run.
+    Param:
+        param1 [string] name of the script.
+        param2 [string] path to save metrics to, ".jsonl" to append one line
+            per run and otherwise a JSON file per run, or None to record
+            nothing.
+        param3 [bool] whether to turn progress bars off.
+    """
+    set_quiet(quiet)
+    if metrics_path == None:
+        metric_state["run"] = None
+        return
+
+    metric_state["run"] = {
+        "script": script,
+        "argv": sys.argv[1:],
+        "start_time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "path": metrics_path,
+        "begin": time.perf_counter(),
+        "counts": {},
+        "steps": [],
+    }
+
+@contextmanager
+def step(name):
+    """ Record wall time, peak memory and counts of one step.
+    Param:
+        param1 [string] name of the step, e.g. "Step 1-1".
+    Note:
+        1) Counts added by add_count() within the step are kept per step,
+            together with their throughput per second.
+        2) Peak RSS is the peak of the process so far at the end of the step,
+            so an earlier step may have set it.
+    """
+    run = metric_state["run"]
+    if run == None:
+        yield
+        return
+
+    record = {"step":name, "counts":{}}
+    metric_state["step"] = record
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["wall_s"] = round(time.perf_counter() - begin, 4)
+        record["peak_rss_so_far_mb"], record["peak_rss_children_so_far_mb"] = get_peak_rss()
+        record["per_s"] = {count:round(n / max(record["wall_s"], 1e-9), 1) for count, n in record["counts"].items()}
+        run["steps"].append(record)
+        metric_state["step"] = None
+
+def add_count(name, n):
+    """ Add to a count, e.g. of input or output edges, of the current step.
+    Param:
+        param1 [string] name of the count.
+        param2 [int] amount to add.
+    """
+    run = metric_state["run"]
+    if run == None:
+        return
+
+    run["counts"][name] = run["counts"].get(name, 0) + int(n)
+    if metric_state["step"] != None:
+        counts = metric_state["step"]["counts"]
+        counts[name] = counts.get(name, 0) + int(n)
+
+def finish_run():
+    """ Save metrics of the run started by start_run().
+    Return:
+        return1 [dict] of the saved metrics, or None if nothing is recorded.
+    """
+    run = metric_state["run"]
+    if run == None:
+        return None
+
+    metric_path = run.pop("path")
+    run["wall_s"] = round(time.perf_counter() - run.pop("begin"), 4)
+    run["peak_rss_mb"], run["peak_rss_children_mb"] = get_peak_rss()
+
+    if metric_path.endswith(".jsonl"):
+        with open(metric_path, "a") as f:
+            f.write(json.dumps(run) + "\n")
+    else:
+        with open(metric_path, "w") as f:
+            json.dump(run, f, indent=2)
+    metric_state["run"] = None
+
+    return run
@@ -0,0 +1,286 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: neighbor_cache.py
+# Cont:
+#   Class:
+#       1) NeighborCache
+#   Func:
+#       1) content_fingerprint              2) find_parent_cache
+#       3) extend_exp_word
+
+import hashlib
+import json
+import os
+import numpy as np
+from tqdm import tqdm
+
+CACHE_META = "meta.json"
+
+def content_fingerprint(items, embd_matrix, n_rows, block_size=65536):
+    """ Compute a fingerprint of the first rows of a vocabulary and matrix.
+    Param:
+        param1 [list] of words ordered by row number.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of leading rows to cover.
+        param4 [int] number of rows to hash at a time.
+    Return:
+        return1 [string] hex SHA-1 digest.
+    """
+    sha = hashlib.sha1()
+    sha.update("\n".join(items[:n_rows]).encode())
+
+    for start in range(0, n_rows, block_size):
+        sha.update(np.ascontiguousarray(embd_matrix[start:min(start+block_size, n_rows)], dtype=np.float32).tobytes())
+
+    return sha.hexdigest()
+
+def find_parent_cache(cache_root, items, embd_matrix):
+    """ Find a cache built on a prefix of the current embeddings.
+    Param:
+        param1 [string] path to the directory holding one cache per embedding
+            fingerprint.
+        param2 [list] of words ordered by row number.
+        param3 [np.ndarray] float32 unit-normalized embeddings of every word.
+    Return:
+        return1 [string] path to the cache with the most words whose words and
+            vectors are the leading rows of param2 & param3, or None.
+    Note:
+        1) This is the case when words are appended to an embedding file.
+    """
+    candidate_list = []
+    for name in os.listdir(cache_root):
+        meta_path = os.path.join(cache_root, name, CACHE_META)
+        if not os.path.isfile(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["n_words"] < len(items):
+            candidate_list.append((meta["n_words"], meta["content"], os.path.join(cache_root, name)))
+
+    for n_words, content, cache_path in sorted(candidate_list, reverse=True):
+        if content_fingerprint(items, embd_matrix, n_words) == content:
+            return cache_path
+
+    return None
+
+def extend_exp_word(query_index, exp_idx, exp_dist, embd_matrix, n_old, tile_size):
+    """ Update expansion words of cached words with words appended to the
+    embeddings.
+    Param:
+        param1 [np.ndarray] int row numbers of cached words.
+        param2 [np.ndarray] int32 of shape (n_query, k) cached row numbers of
+            expanded words ordered ascendingly by cosine distance.
+        param3 [np.ndarray] float32 of shape (n_query, k) cached cosine
+            distances.
+        param4 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param5 [int] number of words the cache was built on.
+        param6 [int] number of cached words per tile.
+    Return:
+        return1 [np.ndarray] param2 updated in place.
+        return2 [np.ndarray] param3 updated in place.
+        return3 [int] number of cached words whose expansion words changed.
+    Note:
+        1) Only new words are scored, and only the lists a new word displaces
+            are merged. Ties keep ascending row number as in gen_tt.py, so a new
+            word never displaces a cached one of equal distance.
+    """
+    new_rows = np.arange(n_old, len(embd_matrix))
+    k = exp_idx.shape[1]
+    n_changed = 0
+
+    for start in tqdm(range(0, len(query_index), tile_size)):
+        # Step 1: Find the cosine distance from the tile to the new words.
+        tile = slice(start, start+tile_size)
+        cos_tile = np.dot(embd_matrix[query_index[tile]], embd_matrix[n_old:].T)
+        cos_tile *= -1
+        cos_tile += 1
+        np.clip(cos_tile, 0, 2, out=cos_tile)
+
+        # Step 2: Merge lists where a new word beats the last kept word.
+        changed = np.flatnonzero((cos_tile < exp_dist[tile, -1:]).any(axis=1))
+        if len(changed) == 0 or k == 0:
+            continue
+        cand_idx = np.concatenate([exp_idx[tile][changed], np.broadcast_to(new_rows, (len(changed), len(new_rows)))], axis=1)
+        cand_dist = np.concatenate([exp_dist[tile][changed], cos_tile[changed]], axis=1)
+        order = np.lexsort((cand_idx, cand_dist))[:, :k]
+        exp_idx[start+changed] = np.take_along_axis(cand_idx, order, axis=1)
+        exp_dist[start+changed] = np.take_along_axis(cand_dist, order, axis=1)
+        n_changed += len(changed)
+
+    return exp_idx, exp_dist, n_changed
+
+class NeighborCache():
+    """ Persistent expansion words of every word queried so far on one set of
+    word embeddings.
+    """
+
+    def __init__(self, cache_root, fingerprint, items, embd_matrix, tile_size=1024):
+        """ Constructor for NeighborCache. Opens the cache of param3, deriving it
+        from a cache of fewer words if words were appended to the embeddings.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the directory holding one cache per
+                embedding fingerprint.
+            param3 [string] fingerprint of the word embeddings, see
+                embd_store.embd_fingerprint().
+            param4 [list] of words ordered by row number.
+            param5 [np.ndarray] float32 unit-normalized embeddings of every word.
+            param6 [int] number of cached words per tile when deriving.
+        Note:
+            1) A cache holds meta.json, query.npy (row numbers of cached words),
+                exp_idx.npy and exp_dist.npy (expanded words and cosine
+                distances of exact search, see gen_tt.iter_exp_word()).
+        """
+        self.path = os.path.join(cache_root, fingerprint)
+        self.fingerprint = fingerprint
+        self.embd_matrix = embd_matrix
+        self.n_words = len(items)
+        self.content = None
+        self.k = 0
+        self.query_index = np.empty(0, dtype=np.int64)
+        self.exp_idx = np.empty((0, 0), dtype=np.int32)
+        self.exp_dist = np.empty((0, 0), dtype=np.float32)
+        self.tile_list = [] # added tiles, see add()
+        os.makedirs(cache_root, exist_ok=True)
+
+        # Step 1: Open the cache of these embeddings if any.
+        if os.path.isfile(os.path.join(self.path, CACHE_META)):
+            self.load(self.path)
+            print("Loaded", len(self.query_index), "cached words from", self.path)
+            return
+
+        # Step 2: Otherwise derive it from a cache on fewer leading words.
+        self.content = content_fingerprint(items, embd_matrix, self.n_words)
+        parent_path = find_parent_cache(cache_root, items, embd_matrix)
+        if parent_path != None:
+            n_old = self.load(parent_path)
+            self.exp_idx, self.exp_dist, n_changed = extend_exp_word(self.query_index, self.exp_idx, self.exp_dist, embd_matrix, n_old, tile_size)
+            print("Updated", n_changed, "of", len(self.query_index), "cached words with", self.n_words-n_old, "new words from", parent_path)
+
+    def load(self, cache_path):
+        """ Load cached expansion words.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to a cache saved by save().
+        Return:
+            return1 [int] number of words the loaded cache was built on.
+        """
+        with open(os.path.join(cache_path, CACHE_META)) as f:
+            meta = json.load(f)
+        self.k = meta["k"]
+        self.query_index = np.load(os.path.join(cache_path, "query.npy"))
+        self.exp_idx = np.load(os.path.join(cache_path, "exp_idx.npy"))
+        self.exp_dist = np.load(os.path.join(cache_path, "exp_dist.npy"))
+        if cache_path == self.path:
+            self.content = meta["content"]
+
+        return meta["n_words"]
+
+    def save(self):
+        """ Save cached expansion words, meta last to mark completion.
+        Param:
+            param1 [self] reference to this object.
+        """
+        self.merge_tiles()
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, CACHE_META)
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        np.save(os.path.join(self.path, "query.npy"), self.query_index)
+        np.save(os.path.join(self.path, "exp_idx.npy"), self.exp_idx)
+        np.save(os.path.join(self.path, "exp_dist.npy"), self.exp_dist)
+
+        meta = {
+            "fingerprint": self.fingerprint,
+            "content": self.content,
+            "n_words": self.n_words,
+            "k": self.k,
+            "n_query": len(self.query_index),
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def get_missing(self, rep_index, expk):
+        """ Get the representative words whose expansion words are not cached.
+        Param:
+            param1 [self] reference to this object.
+            param2 [np.ndarray] of row numbers of representative words.
+            param3 [int] number of expanded words to pick per keyword.
+        Return:
+            return1 [np.ndarray] row numbers of param2 to search for.
+        Note:
+            1) The cache is emptied if it holds fewer expanded words than
+                param3 asks for.
+        """
+        self.merge_tiles()
+        k = min(expk, self.n_words-1)
+        if k > self.k:
+            if len(self.query_index):
+                print("Cached words hold", self.k, "expanded words but", k, "are required. Rebuilding the cache.")
+            self.k = k
+            self.query_index = np.empty(0, dtype=np.int64)
+            self.exp_idx = np.empty((0, k), dtype=np.int32)
+            self.exp_dist = np.empty((0, k), dtype=np.float32)
+
+        return rep_index[~np.isin(rep_index, self.query_index)]
+
+    def add(self, query_index, exp_idx_tile, exp_dist_tile):
+        """ Cache expansion words of newly searched words.
+        Param:
+            param1 [self] reference to this object.
+            param2 [np.ndarray] of row numbers of the searched words.
+            param3 [np.ndarray] int of shape (n, k) row numbers of expanded words.
+            param4 [np.ndarray] float32 of shape (n, k) cosine distances.
+        Note:
+            1) Tiles are kept aside and merged once by merge_tiles(), so adding
+                many small tiles does not copy the cache again per tile.
+        """
+        self.tile_list.append((np.asarray(query_index, dtype=np.int64), np.asarray(exp_idx_tile, dtype=np.int32), np.asarray(exp_dist_tile, dtype=np.float32)))
+
+    def merge_tiles(self):
+        """ Merge the tiles given to add() into the cached arrays.
+        Param:
+            param1 [self] reference to this object.
+        """
+        if not self.tile_list:
+            return
+        query_list, exp_idx_list, exp_dist_list = zip(*self.tile_list)
+        self.query_index = np.concatenate([self.query_index, *query_list])
+        self.exp_idx = np.concatenate([self.exp_idx, *exp_idx_list])
+        self.exp_dist = np.concatenate([self.exp_dist, *exp_dist_list])
+        self.tile_list = []
+
+    def iter_exp_word(self, rep_index, expk, tile_size):
+        """ Look up expansion words of representative words one tile at a time.
+        A drop-in for gen_tt.iter_exp_word() once get_missing() words are added.
+        Param:
+            param1 [self] reference to this object.
+            param2 [np.ndarray] of row numbers of representative words.
+            param3 [int] number of expanded words to pick per keyword.
+            param4 [int] number of representative words per tile.
+        Yield:
+            The same as gen_tt.iter_exp_word().
+        """
+        self.merge_tiles()
+        order = np.argsort(self.query_index)
+        k = min(expk, self.n_words-1)
+
+        for start in range(0, len(rep_index), tile_size):
+            pos = order[np.searchsorted(self.query_index, rep_index[start:start+tile_size], sorter=order)]
+            yield start, self.exp_idx[pos, :k].astype(np.int64), self.exp_dist[pos, :k]
@@ -0,0 +1,302 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: pipeline.py
+# Cont:
+#   Func:
+#       1) get_user_input                   2) gen_et_array
+#       3) gen_tt_array                     4) gen_ice_network
+#       5) run_pipeline
+
+import argparse
+import numpy as np
+import sys
+from gen_et import iter_et_info, filter_et_info
+from gen_tt import load_embd_matrix, search_exp_word
+from gen_ice import unique_edge, tt2network, edge2sparse_mat, et2sparse_mat, save_ice_et_network, save_ice_tt_network, save_ice_bin_network, make_bin_version, swap_bin_network
+from embd_store import embd_fingerprint
+from ann_index import load_ivf_index
+from neighbor_cache import NeighborCache
+from edge_io import intern_token, save_edge_array
+from metrics import start_run, step, add_count, finish_run
+
+def get_user_input():
+    """ Get inputs from user.
+    Return:
+        return1 [argparse.Namespace] of every argument.
+        return2 [list] of 2-tuples of path and input mode to save the expanded
+            entity-text subnetwork within an ICE network.
+        return3 [list] of 2-tuples of path and input mode to save the text-text
+            subnetwork within an ICE network.
+    """
+    PARSER = argparse.ArgumentParser(description='Construct ICE network from ET information and word embeddings in memory.')
+    PARSER.add_argument('-info', help='Path to load ET information JSON or JSON Lines file.')
+    PARSER.add_argument('-embd', help='Path to load word embeddings text file or binary store.')
+    PARSER.add_argument('-repk', type=int, help='Number of representative words per entity.')
+    PARSER.add_argument('-max_repk', type=int, help='(Default -repk) Max number of representative words per entity amongst all graphs.')
+    PARSER.add_argument('-expk', type=int, help='Number of expanded words per representative words.')
+    PARSER.add_argument('-w', type=int, default=0, choices=[0,1], help='(Default) 0:unweighted / 1:weighted.')
+    PARSER.add_argument('-et', help='(Optional) Path to save ET relation.')
+    PARSER.add_argument('-tt', help='(Optional) Path to save TT relation.')
+    PARSER.add_argument('-ice_full', help='(Optional) Path to save full ICE network.')
+    PARSER.add_argument('-ice_et', help='(Optional) Path to save ET part of ICE network.')
+    PARSER.add_argument('-ice_tt', help='(Optional) Path to save TT part of ICE network.')
+    PARSER.add_argument('-ice_bin', help='(Optional) Path to save ICE network as binary sparse stores.')
+    PARSER.add_argument('-sorted', type=int, default=0, choices=[0,1], help='(Default) 0:entity and word order / 1:sorted as `sort` does.')
+    PARSER.add_argument('-dtype', default='float64', choices=['float64','float32'], help='(Default float64) Precision of weights and of the expansion product.')
+    PARSER.add_argument('-mem', type=int, default=1024, help='(Default 1024) Memory budget in MB for a tile of cosine distances per worker.')
+    PARSER.add_argument('-workers', type=int, default=1, help='(Default 1) Number of worker processes to search with.')
+    PARSER.add_argument('-index', help='(Optional) Path to load ANN index for approximate search, see ann_index.py.')
+    PARSER.add_argument('-nprobe', type=int, default=8, help='(Default 8) Number of inverted lists to search per word.')
+    PARSER.add_argument('-rerank', type=int, default=100, help='(Default 100) Number of PQ candidates to rescore exactly per word.')
+    PARSER.add_argument('-cache', help='(Optional) Directory of neighbor caches of exact search, one per embedding fingerprint.')
+    PARSER.add_argument('-metrics', help='(Optional) Path to save metrics, .jsonl to append one line per run.')
+    PARSER.add_argument('-quiet', type=int, default=0, choices=[0,1], help='(Default) 0:show progress bars / 1:no progress bars.')
+    CONFIG = PARSER.parse_args()
+
+    if CONFIG.info == None or CONFIG.embd == None:
+        print('Please specify paths to load ET information and word embeddings.')
+        sys.exit()
+    elif CONFIG.repk == None or CONFIG.expk == None:
+        print('Please specify numbers of representative and expanded words.')
+        sys.exit()
+    elif CONFIG.et == CONFIG.tt == CONFIG.ice_full == CONFIG.ice_et == CONFIG.ice_tt == CONFIG.ice_bin == None:
+        print('Please specify at least one path to save relations or the ICE network.')
+        sys.exit()
+    elif CONFIG.cache != None and CONFIG.index != None:
+        print('Please use either -cache for exact search or -index for approximate search.')
+        sys.exit()
+
+    et_save_list = []
+    tt_save_list = []
+
+    if CONFIG.ice_full != None:
+        et_save_list.append((CONFIG.ice_full, 'w'))
+        tt_save_list.append((CONFIG.ice_full, 'a'))
+    if CONFIG.ice_et != None:
+        et_save_list.append((CONFIG.ice_et, 'w'))
+    if CONFIG.ice_tt != None:
+        tt_save_list.append((CONFIG.ice_tt, 'w'))
+
+    return CONFIG, et_save_list, tt_save_list
+
+
+def gen_et_array(et_info_iter, repk, weighted):
+    """ Generate entity-text relation as integer-coded edges.
+    Param:
+        param1 [iterator] of 2-tuple of entity and list of 2-tuple of word and
+            its TF-IDF score, see gen_et.filter_et_info().
+        param2 [int] number of representative words to pick per entity.
+        param3 [int] indicator of whether to use binary or loaded weights.
+    Return:
+        return1 [tuple] of entity ids, word ids and weights in the order of
+            gen_et.gen_et_relation().
+        return2 [list] where index=entity id & val=entity.
+        return3 [list] where index=word id & val=rep word.
+    """
+    entity_token_list = []
+    word_token_list = []
+    weight_list = []
+
+    for entity, tup_list in et_info_iter:
+        for rep_word, weight in tup_list[:repk]:
+            entity_token_list.append(entity)
+            word_token_list.append(rep_word)
+            weight_list.append(float(weight) if weighted else 1.0)
+
+    entity2index = {}
+    word2index = {}
+    src = intern_token(entity_token_list, entity2index)
+    dst = intern_token(word_token_list, word2index)
+
+    return (src, dst, np.array(weight_list, dtype=np.float64)), list(entity2index), list(word2index)
+
+
+def gen_tt_array(rep_index, exp_matrix, expk, weighted, mem_budget=1024, ivf_index=None, n_workers=1, neighbor_cache=None):
+    """ Generate text-text relation as integer-coded edges.
+    Param:
+        param1 [np.ndarray] of row numbers of representative words in param2.
+        param2 [np.ndarray] float32 unit-normalized embeddings of every word.
+        param3 [int] number of expanded words to pick per keyword.
+        param4 [int] indicator of whether to use binary or loaded weights.
+        param5 [int] memory budget in MB for a tile of cosine distances, per
+            worker process.
+        param6 [IVFIndex] object for approximate search, or None for exact.
+        param7 [int] number of worker processes to search with.
+        param8 [NeighborCache] object of exact expansion words, or None.
+    Return:
+        return1 [tuple] of row numbers of rep words, row numbers of exp words
+            and weights in the order of gen_tt.gen_tt_relation().
+    Note:
+        1) Weights are rounded through their text form, str() of the float32
+            similarity, so the network is the same as the one read back from a
+            TT relation file.
+    """
+    src_list = []
+    dst_list = []
+    weight_list = []
+
+    for start, exp_idx_tile, exp_dist_tile in search_exp_word(rep_index, exp_matrix, expk, mem_budget, ivf_index, n_workers, neighbor_cache):
+        n_exp_list = [len(exp_idx_list) for exp_idx_list in exp_idx_tile]
+        exp_dist = np.concatenate(list(exp_dist_tile)) if n_exp_list else np.empty(0, dtype=np.float32)
+        src_list.append(np.repeat(rep_index[start:start+len(n_exp_list)], n_exp_list))
+        dst_list.append(np.concatenate(list(exp_idx_tile)).astype(np.int64) if n_exp_list else np.empty(0, dtype=np.int64))
+        if weighted:
+            weight_list.append((1-exp_dist/2).astype(str).astype(np.float64)) # cos sim = 1-cos dist, shifted and rescaled to [0,1]
+        else:
+            weight_list.append(np.ones(len(exp_dist), dtype=np.float64))
+
+    if not src_list:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    return np.concatenate(src_list), np.concatenate(dst_list), np.concatenate(weight_list)
+
+
+def gen_ice_network(et_rel, entity_list, et_word_list, tt_rel, items, dtype=np.float64):
+    """ Construct an ICE network from integer-coded ET and TT relations.
+    Param:
+        param1 [tuple] of entity ids, word ids and weights, see gen_et_array().
+        param2 [list] where index=entity id & val=entity.
+        param3 [list] where index=word id of param1 & val=rep word.
+        param4 [tuple] of word ids, word ids and weights, see gen_tt_array().
+        param5 [list] where index=word id of param4 & val=word.
+        param6 [np.dtype] of weights and of the expansion product.
+    Return:
+        return1 [csr_matrix] sparse matrix of the expanded entity-text network.
+        return2 [csr_matrix] sparse matrix of the text-text network.
+        return3 [tuple] of unique TT edges, see gen_ice.gen_tt_network().
+        return4 [list] where index=row and col number & val=word.
+    Note:
+        1) The same as gen_ice.py on the ET and TT relation files.
+    """
+    src, dst, weight = et_rel
+    et_edges = unique_edge(src, dst, weight.astype(dtype))
+    src, dst, weight = tt_rel
+    tt_edges, word_list = tt2network(src, dst, weight.astype(dtype), items)
+
+    word2index = {word:index for index, word in enumerate(word_list)}
+    et_matrix = et2sparse_mat(et_edges, et_word_list, word2index, len(entity_list))
+    tt_matrix = edge2sparse_mat(tt_edges, len(word_list), len(word_list))
+
+    exp_et_matrix = et_matrix.dot(tt_matrix)
+    exp_et_matrix.sort_indices()
+
+    return exp_et_matrix, tt_matrix, tt_edges, word_list
+
+
+def run_pipeline(et_info_path, word_embd_path, repk, max_repk, expk, weighted, mem_budget=1024, ivf_index=None, n_workers=1, cache_root=None, dtype=np.float64):
+    """ Construct ICE network from ET information and word embeddings without
+    intermediate files.
+    Param:
+        param1 [string] path to load ET information JSON or JSON Lines file.
+        param2 [string] path to load word embeddings text file or binary store.
+        param3 [int] number of representative words to pick per entity.
+        param4 [int] largest number of representative words to pick per entity
+            amongst all considered graphs.
+        param5 [int] number of expanded words to pick per keyword.
+        param6 [int] indicator of whether to use binary or real weights.
+        param7 [int] memory budget in MB for a tile of cosine distances, per
+            worker process.
+        param8 [IVFIndex] object for approximate search, or None for exact.
+        param9 [int] number of worker processes to search with.
+        param10 [string] directory of neighbor caches of exact search, see
+            neighbor_cache.py, or None.
+        param11 [np.dtype] of weights and of the expansion product.
+    Return:
+        return1 [dict] where key="et_rel", "entity_list", "et_word_list",
+            "tt_rel", "items", "exp_et_matrix", "tt_matrix", "tt_edges" and
+            "word_list" & val=the respective return of gen_et_array(),
+            gen_tt_array(), load_embd_matrix() and gen_ice_network().
+    """
+    # Step 1: Generate ET relation.
+    with step('Step 1-1: Generate ET relation'):
+        exp_mat = load_embd_matrix(word_embd_path, norm=True)
+        et_info_iter = filter_et_info(iter_et_info(et_info_path), set(exp_mat.items), max_repk)
+        et_rel, entity_list, et_word_list = gen_et_array(et_info_iter, repk, weighted)
+        add_count('et_edges', len(et_rel[0]))
+
+    # Step 2: Generate TT relation of the rep words.
+    with step('Step 1-2: Generate TT relation'):
+        word2index = {word:index for index, word in enumerate(exp_mat.items)}
+        rep_index = np.array([word2index[word] for word in sorted(et_word_list)], dtype=np.int64)
+        neighbor_cache = None
+        if cache_root != None:
+            neighbor_cache = NeighborCache(cache_root, embd_fingerprint(word_embd_path), exp_mat.items, exp_mat.embd_matrix)
+        tt_rel = gen_tt_array(rep_index, exp_mat.embd_matrix, expk, weighted, mem_budget, ivf_index, n_workers, neighbor_cache)
+        add_count('tt_edges', len(tt_rel[0]))
+
+    # Step 3: Perform concept expansion.
+    with step('Step 1-3: Perform concept expansion'):
+        exp_et_matrix, tt_matrix, tt_edges, word_list = gen_ice_network(et_rel, entity_list, et_word_list, tt_rel, exp_mat.items, dtype)
+        add_count('ice_et_nnz', exp_et_matrix.nnz)
+
+    return {
+        "et_rel": et_rel,
+        "entity_list": entity_list,
+        "et_word_list": et_word_list,
+        "tt_rel": tt_rel,
+        "items": exp_mat.items,
+        "exp_et_matrix": exp_et_matrix,
+        "tt_matrix": tt_matrix,
+        "tt_edges": tt_edges,
+        "word_list": word_list,
+    }
+
+
+def main():
+    # Step 0: Get inputs from user.
+    CONFIG, et_save_list, tt_save_list = get_user_input()
+    max_repk = CONFIG.repk if CONFIG.max_repk == None else CONFIG.max_repk
+    start_run('pipeline', CONFIG.metrics, CONFIG.quiet)
+
+    print('\nStart constructing ICE network!')
+    print('Step 1: Generate relations and perform concept expansion...')
+    ivf_index = None
+    if CONFIG.index != None:
+        ivf_index = load_ivf_index(CONFIG.index, embd_fingerprint(CONFIG.embd), CONFIG.nprobe, CONFIG.rerank)
+    ice = run_pipeline(CONFIG.info, CONFIG.embd, CONFIG.repk, max_repk, CONFIG.expk, CONFIG.w, CONFIG.mem, ivf_index, CONFIG.workers, CONFIG.cache, np.dtype(CONFIG.dtype))
+
+    if CONFIG.et != None:
+        print('Step 2-1: Save ET relation...')
+        with step('Step 2-1'):
+            save_edge_array(ice["et_rel"], ice["entity_list"], ice["et_word_list"], [(CONFIG.et, 'w')], CONFIG.w, CONFIG.sorted)
+    if CONFIG.tt != None:
+        print('Step 2-2: Save TT relation...')
+        with step('Step 2-2'):
+            save_edge_array(ice["tt_rel"], ice["items"], ice["items"], [(CONFIG.tt, 'w')], CONFIG.w, CONFIG.sorted)
+
+    if et_save_list:
+        print('Step 3-1: Save ET part of the ICE network...')
+        with step('Step 3-1'):
+            save_ice_et_network(ice["exp_et_matrix"], ice["entity_list"], ice["word_list"], et_save_list, CONFIG.w, CONFIG.sorted)
+    if tt_save_list:
+        print('Step 3-2: Save TT part of the ICE network...')
+        with step('Step 3-2'):
+            save_ice_tt_network(ice["tt_edges"], ice["word_list"], tt_save_list, CONFIG.w, CONFIG.sorted)
+
+    if CONFIG.ice_bin != None:
+        print('Step 3-3: Save binary ICE network...')
+        with step('Step 3-3'):
+            version_path = make_bin_version(CONFIG.ice_bin)
+            save_ice_bin_network(version_path, ice["exp_et_matrix"], ice["tt_matrix"], ice["entity_list"], ice["word_list"], CONFIG.w)
+            swap_bin_network(version_path, CONFIG.ice_bin)
+
+    finish_run()
+    print('Finished constructing ICE network!\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: sparse_store.py
+# Cont:
+#   Class:
+#       1) SparseStoreWriter
+#   Func:
+#       1) is_sparse_store                  2) save_store_items
+#       3) save_sparse_store                4) load_sparse_store
+#       5) iter_store_edge                  6) convert_edge_list
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from scipy.sparse import csr_matrix
+from tqdm import tqdm
+
+STORE_META = "meta.json"
+STORE_ROWS = "rows.txt"
+STORE_COLS = "cols.txt"
+
+def is_sparse_store(path):
+    """ Check whether a path points to a binary sparse store.
+    Param:
+        param1 [string] path to an edge list file or store.
+    Return:
+        return1 [bool] True if the path is a store made by save_sparse_store().
+    """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, STORE_META))
+
+def save_store_items(store_path, row_items, col_items, shape, nnz, dtype):
+    """ Save row and column items and meta data of a binary sparse store.
+    Param:
+        param1 [string] path to the store directory.
+        param2 [list] where index=row number & val=from node.
+        param3 [list] where index=col number & val=to node.
+        param4 [tuple] shape of the matrix.
+        param5 [int] number of stored entries.
+        param6 [np.dtype] of the stored entries.
+    Note:
+        1) meta.json is written last to mark completion.
+    """
+    with open(os.path.join(store_path, STORE_ROWS), "w") as f:
+        f.write("".join(item + "\n" for item in row_items))
+    with open(os.path.join(store_path, STORE_COLS), "w") as f:
+        f.write("".join(item + "\n" for item in col_items))
+
+    meta = {
+        "shape": list(shape),
+        "nnz": int(nnz),
+        "dtype": str(dtype),
+    }
+    with open(os.path.join(store_path, STORE_META), "w") as f:
+        json.dump(meta, f, indent=2)
+
+def save_sparse_store(store_path, matrix, row_items, col_items):
+    """ Save a sparse matrix and its row and column items as a binary store.
+    Param:
+        param1 [string] path to the store directory to create.
+        param2 [csr_matrix] sparse matrix of a network or relation.
+        param3 [list] where index=row number & val=from node.
+        param4 [list] where index=col number & val=to node.
+    Note:
+        1) The store holds indptr.npy, indices.npy and data.npy of the CSR
+            matrix, rows.txt and cols.txt (one node per line in index order),
+            and meta.json which is written last to mark completion.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    meta_path = os.path.join(store_path, STORE_META)
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+
+    matrix = matrix.tocsr()
+    matrix.sort_indices()
+    np.save(os.path.join(store_path, "indptr.npy"), matrix.indptr)
+    np.save(os.path.join(store_path, "indices.npy"), matrix.indices)
+    np.save(os.path.join(store_path, "data.npy"), matrix.data)
+    save_store_items(store_path, row_items, col_items, matrix.shape, matrix.nnz, matrix.dtype)
+
+class SparseStoreWriter():
+    """ Writer which saves a binary sparse store one block of rows at a time,
+    holding only the row lengths in memory.
+    """
+
+    def __init__(self, store_path, n_cols, dtype, chunk_size=1<<24):
+        """ Constructor for SparseStoreWriter.
+        Param:
+            param1 [self] reference to this object.
+            param2 [string] path to the store directory to create.
+            param3 [int] number of cols.
+            param4 [np.dtype] of the stored entries.
+            param5 [int] number of entries to copy at a time on close().
+        """
+        self.store_path = store_path
+        self.n_cols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.nnz_list = []
+        os.makedirs(store_path, exist_ok=True)
+        if os.path.isfile(os.path.join(store_path, STORE_META)):
+            os.remove(os.path.join(store_path, STORE_META))
+        self.indices_f = open(os.path.join(store_path, "indices.bin"), "wb")
+        self.data_f = open(os.path.join(store_path, "data.bin"), "wb")
+
+    def append(self, block):
+        """ Append rows to the store.
+        Param:
+            param1 [self] reference to this object.
+            param2 [csr_matrix] rows with param3 cols of the constructor and
+                sorted indices.
+        """
+        self.nnz_list.append(np.diff(block.indptr))
+        self.indices_f.write(np.ascontiguousarray(block.indices, dtype=np.int32).tobytes())
+        self.data_f.write(np.ascontiguousarray(block.data, dtype=self.dtype).tobytes())
+
+    def close(self, row_items, col_items):
+        """ Save the appended rows as .npy files with their items and meta.
+        Param:
+            param1 [self] reference to this object.
+            param2 [list] where index=row number & val=from node.
+            param3 [list] where index=col number & val=to node.
+        """
+        self.indices_f.close()
+        self.data_f.close()
+        nnz_array = np.concatenate(self.nnz_list) if self.nnz_list else np.empty(0, dtype=np.int64)
+        indptr = np.zeros(len(nnz_array)+1, dtype=np.int64)
+        np.cumsum(nnz_array, out=indptr[1:])
+        np.save(os.path.join(self.store_path, "indptr.npy"), indptr)
+
+        # Step 1: Copy raw entries into .npy files a chunk at a time.
+        for name, dtype in [("indices", np.int32), ("data", self.dtype)]:
+            raw_path = os.path.join(self.store_path, name + ".bin")
+            array = np.lib.format.open_memmap(os.path.join(self.store_path, name + ".npy"), mode="w+", dtype=dtype, shape=(int(indptr[-1]),))
+            with open(raw_path, "rb") as f:
+                for start in range(0, len(array), self.chunk_size):
+                    chunk = np.fromfile(f, dtype=dtype, count=self.chunk_size)
+                    array[start:start+len(chunk)] = chunk
+            array.flush()
+            del array
+            os.remove(raw_path)
+
+        # Step 2: Save items and meta last.
+        save_store_items(self.store_path, row_items, col_items, (len(nnz_array), self.n_cols), indptr[-1], self.dtype)
+
+def load_sparse_store(store_path):
+    """ Open a binary sparse store with memory-mapped arrays.
+    Param:
+        param1 [string] path to the store directory.
+    Return:
+        return1 [csr_matrix] sparse matrix backed by the store files.
+        return2 [list] where index=row number & val=from node.
+        return3 [list] where index=col number & val=to node.
+    """
+    with open(os.path.join(store_path, STORE_META)) as f:
+        meta = json.load(f)
+    with open(os.path.join(store_path, STORE_ROWS)) as f:
+        row_items = f.read().splitlines()
+    with open(os.path.join(store_path, STORE_COLS)) as f:
+        col_items = f.read().splitlines()
+
+    load = lambda name: np.load(os.path.join(store_path, name), mmap_mode="r")
+    matrix = csr_matrix((load("data.npy"), load("indices.npy"), load("indptr.npy")), shape=tuple(meta["shape"]), copy=False)
+
+    return matrix, row_items, col_items
+
+def iter_store_edge(store_path):
+    """ Iterate over the edges of a binary sparse store.
+    Param:
+        param1 [string] path to the store directory.
+    Yield:
+        yield1 [tuple] of from node, to node and float weight in row-major order.
+    """
+    matrix, row_items, col_items = load_sparse_store(store_path)
+
+    for row, from_node in enumerate(row_items):
+        lo, hi = matrix.indptr[row], matrix.indptr[row+1]
+        for col, weight in zip(matrix.indices[lo:hi].tolist(), matrix.data[lo:hi].tolist()):
+            yield from_node, col_items[col], weight
+
+def convert_edge_list(edge_path, store_path):
+    """ Convert an ET or TT relation edge list into a binary sparse store.
+    Param:
+        param1 [string] path to an edge list file of "from to weight" lines.
+        param2 [string] path to the store directory to create.
+    Note:
+        1) Identical edges are kept once and edges differing only in weight
+            are summed, the same as gen_ice.py reads an edge list.
+    """
+    edge_set = set()
+
+    with open(edge_path) as f:
+        for line in tqdm(f):
+            entry = line.split()
+            edge_set.add((entry[0], entry[1], float(entry[2])))
+
+    row_items = sorted({edge[0] for edge in edge_set})
+    col_items = sorted({edge[1] for edge in edge_set})
+    row2index = {item:index for index, item in enumerate(row_items)}
+    col2index = {item:index for index, item in enumerate(col_items)}
+    row_list = [row2index[edge[0]] for edge in edge_set]
+    col_list = [col2index[edge[1]] for edge in edge_set]
+    weight_list = [edge[2] for edge in edge_set]
+    matrix = csr_matrix((weight_list, (row_list, col_list)), shape=(len(row_items), len(col_items)), dtype=np.float64)
+
+    save_sparse_store(store_path, matrix, row_items, col_items)
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Convert an ET or TT relation edge list into a binary sparse store.")
+    parser.add_argument("-edge", help="Path to load the edge list.")
+    parser.add_argument("-store", help="Path to save the binary sparse store.")
+    args = parser.parse_args()
+
+    if args.edge == None or args.store == None:
+        print('Please specify paths to load the edge list and to save the store.')
+        sys.exit()
+
+    print('Start converting edge list...')
+
+    # Step 2: Convert the edge list.
+    convert_edge_list(args.edge, args.store)
+
+    print('Finished converting edge list!\n')
+
+if __name__ == "__main__":
+    main()
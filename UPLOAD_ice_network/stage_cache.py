@@ -0,0 +1,209 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: stage_cache.py
+# Cont:
+#   Func:
+#       1) get_manifest_path                2) get_path_stat
+#       3) load_manifest                    4) input_fingerprint
+#       5) code_version                     6) stage_manifest
+#       7) is_output_fresh                  8) check_stage
+#       9) save_stage_manifest
+
+import hashlib
+import json
+import os
+import sys
+from embd_store import file_fingerprint
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+def get_manifest_path(output_path):
+    """ Get the path of the manifest of an output.
+    Param:
+        param1 [string] path to an output file or directory.
+    Return:
+        return1 [string] path to the manifest saved next to the output.
+    """
+    return output_path.rstrip(os.sep) + MANIFEST_SUFFIX
+
+def get_path_stat(path):
+    """ Get sizes and modification times of a file or of the files in a
+    directory.
+    Param:
+        param1 [string] path to a file or directory.
+    Return:
+        return1 [list] [size, mtime] of a file, [[name, size, mtime], ...] of
+            the files under a directory in order of their relative paths, or
+            None if missing.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    elif os.path.isdir(path):
+        name_list = [os.path.relpath(os.path.join(root, file_name), path) for root, _, file_list in os.walk(path) for file_name in file_list]
+        return [[name] + get_path_stat(os.path.join(path, name)) for name in sorted(name_list)]
+
+    return None
+
+def load_manifest(output_path):
+    """ Load the manifest of an output.
+    Param:
+        param1 [string] path to an output file or directory.
+    Return:
+        return1 [dict] manifest saved by save_stage_manifest(), or None.
+    """
+    manifest_path = get_manifest_path(output_path)
+    if not os.path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def input_fingerprint(path, known_list=()):
+    """ Get the content fingerprint of a stage input.
+    Param:
+        param1 [string] path to an input file or directory.
+        param2 [list] of dicts with keys "path", "stat" and "sha1" of inputs
+            recorded by earlier manifests.
+    Return:
+        return1 [dict] with keys "path", "stat" and "sha1".
+    Note:
+        1) An input whose path, sizes and modification times match a recorded
+            one reuses its hash, so large inputs are hashed once.
+        2) A directory is hashed over the names and contents of its files.
+    """
+    stat = get_path_stat(path)
+    if stat == None:
+        raise FileNotFoundError("Stage input " + path + " does not exist.")
+    for known in known_list:
+        if known["path"] == path and known["stat"] == stat:
+            return dict(known)
+
+    if os.path.isfile(path):
+        sha1 = file_fingerprint(path)
+    else:
+        sha = hashlib.sha1()
+        for name, _, _ in stat:
+            sha.update((name + " " + file_fingerprint(os.path.join(path, name)) + "\n").encode())
+        sha1 = sha.hexdigest()
+
+    return {"path":path, "stat":stat, "sha1":sha1}
+
+def code_version():
+    """ Get a fingerprint of the code of the running script.
+    Return:
+        return1 [string] hex SHA-1 digest of the source of the main script and
+            of every module it imported from this directory.
+    """
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    path_set = set()
+
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path != None and path.endswith(".py") and os.path.dirname(os.path.abspath(path)) == code_dir:
+            path_set.add(os.path.abspath(path))
+
+    sha = hashlib.sha1()
+    for path in sorted(path_set):
+        sha.update((os.path.basename(path) + " " + file_fingerprint(path) + "\n").encode())
+
+    return sha.hexdigest()
+
+def stage_manifest(stage, input_list, output_list):
+    """ Describe a stage run by its inputs and code.
+    Param:
+        param1 [string] name of the stage, e.g. "gen_ice".
+        param2 [list] of paths to input files or directories.
+        param3 [list] of paths to outputs, whose old manifests provide known
+            input fingerprints.
+    Return:
+        return1 [dict] with keys "stage", "inputs" and "code".
+    """
+    known_list = []
+    for output_path in output_list:
+        manifest = load_manifest(output_path)
+        if manifest != None:
+            known_list.extend(manifest["inputs"])
+
+    return {
+        "stage": stage,
+        "inputs": [input_fingerprint(path, known_list) for path in input_list],
+        "code": code_version(),
+    }
+
+def is_output_fresh(manifest, output_path, param_dict):
+    """ Check whether an output was made by a run matching a manifest.
+    Param:
+        param1 [dict] manifest of the run to do, see stage_manifest().
+        param2 [string] path to an output file or directory.
+        param3 [dict] of parameters which change the output.
+    Return:
+        return1 [bool] True if the output is unchanged since a run with the
+            same input hashes, parameters and code.
+    """
+    old_manifest = load_manifest(output_path)
+    if old_manifest == None or old_manifest.get("output_stat") != get_path_stat(output_path):
+        return False
+
+    same_input = [known["sha1"] for known in old_manifest["inputs"]] == [known["sha1"] for known in manifest["inputs"]]
+    return same_input and old_manifest["stage"] == manifest["stage"] and old_manifest["code"] == manifest["code"] and old_manifest["params"] == param_dict
+
+def check_stage(stage, input_list, output_dict, dry_run=False, force=False):
+    """ Find the outputs of a stage which have to be made again.
+    Param:
+        param1 [string] name of the stage, e.g. "gen_ice".
+        param2 [list] of paths to input files or directories.
+        param3 [dict] where key=output path & val=dict of parameters which
+            change the output.
+        param4 [bool] whether to only list fresh and stale outputs.
+        param5 [bool] whether to treat every output as stale.
+    Return:
+        return1 [dict] manifest to save after the run, see save_stage_manifest().
+        return2 [list] of stale output paths, empty if the run is to be skipped.
+    Note:
+        1) Manifests of param3 are removed when there is something to run, so
+            an interrupted run leaves its outputs stale.
+    """
+    manifest = stage_manifest(stage, input_list, list(output_dict))
+    stale_list = [path for path, param_dict in output_dict.items() if force or not is_output_fresh(manifest, path, param_dict)]
+
+    if dry_run:
+        for output_path in output_dict:
+            print("stale" if output_path in stale_list else "fresh", output_path)
+        return manifest, []
+    if not stale_list:
+        print("Skipped " + stage + ": outputs are up to date.")
+        return manifest, []
+
+    for output_path in output_dict:
+        if os.path.isfile(get_manifest_path(output_path)):
+            os.remove(get_manifest_path(output_path))
+
+    return manifest, stale_list
+
+def save_stage_manifest(manifest, output_dict):
+    """ Save the manifest of a finished run next to each of its outputs.
+    Param:
+        param1 [dict] manifest returned by check_stage().
+        param2 [dict] where key=output path & val=dict of parameters which
+            change the output.
+    """
+    for output_path, param_dict in output_dict.items():
+        output_manifest = dict(manifest, params=param_dict, output_stat=get_path_stat(output_path))
+        with open(get_manifest_path(output_path), "w") as f:
+            json.dump(output_manifest, f, indent=2)
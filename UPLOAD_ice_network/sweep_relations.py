@@ -0,0 +1,184 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: sweep_relations.py
+# Cont:
+#   Func:
+#       1) format_sweep_path                2) get_sweep_output
+#       3) sweep_relations
+
+import argparse
+import sys
+import numpy as np
+from gen_et import iter_et_info, filter_et_info, stream_et_relation
+from embd_store import embd_fingerprint
+from gen_tt import load_embd_matrix, report_ann_recall, gen_multi_tt_relation
+from neighbor_cache import NeighborCache
+from metrics import start_run, step, finish_run
+from stage_cache import check_stage, save_stage_manifest
+from ann_index import load_ivf_index
+
+def format_sweep_path(path, repk):
+    """ Fill the repk placeholder of a path and keep the others.
+    Param:
+        param1 [string] path which may contain "{repk}", "{expk}" and "{w}"
+            placeholders.
+        param2 [int] number of representative words to pick per entity.
+    Return:
+        return1 [string] path with "{repk}" filled.
+    """
+    return path.format(repk=repk, expk="{expk}", w="{w}")
+
+def get_sweep_output(repk_list, max_repk, expk_list, weighted_list, et_path, tt_path, sort_lines, ann_config=None):
+    """ Get the outputs of every setting of a grid with their parameters.
+    Param:
+        param1 [list] of numbers of representative words to pick per entity.
+        param2 [int] largest number of representative words to pick per entity
+            amongst all considered graphs.
+        param3 [list] of numbers of expanded words to pick per keyword.
+        param4 [list] of indicators of whether to use binary or loaded weights.
+        param5 [string] path to save ET relation with "{repk}" and "{w}".
+        param6 [string] path to save TT relation with "{repk}", "{expk}" and
+            "{w}".
+        param7 [bool] whether to save lines sorted as `sort` does.
+        param8 [dict] of approximate search settings, see sweep_relations().
+    Return:
+        return1 [dict] where key=repk & val=dict where key=output path &
+            val=dict of parameters, see stage_cache.py.
+    """
+    ann_param = {} if ann_config == None else {"nprobe":ann_config["nprobe"], "rerank":ann_config["rerank"]}
+    repk_output_dict = {}
+
+    for repk in repk_list:
+        param_dict = {"repk":repk, "max_repk":max_repk, "sorted":sort_lines}
+        output_dict = {format_sweep_path(et_path, repk).format(w=weighted):dict(param_dict, w=weighted) for weighted in weighted_list}
+        tt_param_dict = dict(param_dict, **ann_param)
+        output_dict.update({format_sweep_path(tt_path, repk).format(expk=expk, w=weighted):dict(tt_param_dict, expk=expk, w=weighted) for expk in expk_list for weighted in weighted_list})
+        repk_output_dict[repk] = output_dict
+
+    return repk_output_dict
+
+def sweep_relations(et_info_path, word_embd_path, repk_list, max_repk, expk_list, weighted_list, et_path, tt_path, mem_budget=1024, ann_config=None, n_workers=1, sort_lines=False, cache_root=None):
+    """ Generate and save ET and TT relations of every setting of a grid.
+    Param:
+        param1 [string] path to load ET information JSON or JSON Lines file.
+        param2 [string] path to load word embeddings text file or binary store.
+        param3 [list] of numbers of representative words to pick per entity.
+        param4 [int] largest number of representative words to pick per entity
+            amongst all considered graphs.
+        param5 [list] of numbers of expanded words to pick per keyword.
+        param6 [list] of indicators of whether to use binary or loaded weights.
+        param7 [string] path to save ET relation with "{repk}" and "{w}".
+        param8 [string] path to save TT relation with "{repk}", "{expk}" and
+            "{w}".
+        param9 [int] memory budget in MB for a tile of cosine distances per
+            worker process.
+        param10 [dict] with keys "index", "nprobe", "rerank" and "recall" for
+            approximate search (see gen_tt.py), or None for exact search.
+        param11 [int] number of worker processes to search with.
+        param12 [bool] whether to save lines sorted as `sort` does.
+        param13 [string] directory of neighbor caches of exact search, see
+            neighbor_cache.py, or None.
+    Note:
+        1) ET information is streamed and filtered once for the whole grid,
+            and TT expansion words are searched once per word for max(param5).
+    """
+    # Step 1: Load word embeddings shared by every setting.
+    with step("Step 1: Load embeddings"):
+        exp_mat = load_embd_matrix(word_embd_path, norm=True)
+
+    # Step 2: Save ET relation of every setting in one pass.
+    with step("Step 2: Filter and save ET relations"):
+        et_save_list = [(format_sweep_path(et_path, repk).format(w=weighted), repk, weighted) for repk in repk_list for weighted in weighted_list]
+        print("Generating", format_sweep_path(et_path, "{repk}"))
+        et_info_iter = filter_et_info(iter_et_info(et_info_path), set(exp_mat.items), max_repk)
+        rep_word_dict = stream_et_relation(et_info_iter, et_save_list, sort_lines)
+
+    # Step 3: Save TT relation of every setting.
+    with step("Step 3: Search and save TT relations"):
+        print("Generating", format_sweep_path(tt_path, "{repk}"))
+        tt_rep_dict = {format_sweep_path(tt_path, repk):rep_word_dict[repk] for repk in repk_list}
+        ivf_index = None
+        if ann_config != None:
+            ivf_index = load_ivf_index(ann_config["index"], embd_fingerprint(word_embd_path), ann_config["nprobe"], ann_config["rerank"])
+            if ann_config["recall"]:
+                word2index = {word:index for index, word in enumerate(exp_mat.items)}
+                rep_index = np.array([word2index[word] for word in set().union(*tt_rep_dict.values())])
+                report_ann_recall(rep_index, exp_mat.embd_matrix, max(expk_list), ivf_index, ann_config["recall"], mem_budget)
+        neighbor_cache = None
+        if cache_root != None:
+            neighbor_cache = NeighborCache(cache_root, embd_fingerprint(word_embd_path), exp_mat.items, exp_mat.embd_matrix)
+        gen_multi_tt_relation(tt_rep_dict, exp_mat, expk_list, weighted_list, mem_budget, ivf_index, n_workers, sort_lines, neighbor_cache)
+
+def main():
+    # Step 1: Get arguments from users.
+    parser = argparse.ArgumentParser(description="Generate ET and TT relations for a grid of settings.")
+    parser.add_argument("-info", help="Path to load ET information JSON or JSON Lines file.")
+    parser.add_argument("-embd", help="Path to load word embeddings text file or binary store.")
+    parser.add_argument("-repk", type=int, nargs="+", help="Numbers of representative words per entity.")
+    parser.add_argument("-max_repk", type=int, help="(Default max of -repk) Max number of representative words per entity amongst all graphs.")
+    parser.add_argument("-expk", type=int, nargs="+", help="Numbers of expanded words per representative words.")
+    parser.add_argument("-w", type=int, nargs="+", choices=[0,1], default=[0,1], help="(Default 0 1) 0:unweighted / 1:weighted.")
+    parser.add_argument("-et", help="Path to save ET relation with {repk} and {w} placeholders.")
+    parser.add_argument("-tt", help="Path to save TT relation with {repk}, {expk} and {w} placeholders.")
+    parser.add_argument("-mem", type=int, default=1024, help="(Default 1024) Memory budget in MB for a tile of cosine distances per worker.")
+    parser.add_argument("-workers", type=int, default=1, help="(Default 1) Number of worker processes to search with.")
+    parser.add_argument("-sorted", type=int, choices=[0,1], default=0, help="(Default) 0:entity or word order / 1:sorted as `sort` does.")
+    parser.add_argument("-index", help="(Optional) Path to load ANN index for approximate search, see ann_index.py.")
+    parser.add_argument("-nprobe", type=int, default=8, help="(Default 8) Number of inverted lists to search per word.")
+    parser.add_argument("-rerank", type=int, default=100, help="(Default 100) Number of PQ candidates to rescore exactly per word.")
+    parser.add_argument("-recall", type=int, default=1000, help="(Default 1000) Number of words to measure ANN recall on, 0 to skip.")
+    parser.add_argument("-cache", help="(Optional) Directory of neighbor caches of exact search, one per embedding fingerprint.")
+    parser.add_argument("-metrics", help="(Optional) Path to save metrics, .jsonl to append one line per run.")
+    parser.add_argument("-quiet", type=int, choices=[0,1], default=0, help="(Default) 0:show progress bars / 1:no progress bars.")
+    parser.add_argument("-dry_run", type=int, choices=[0,1], default=0, help="(Default 0) 1:only list which outputs are fresh or stale, see stage_cache.py.")
+    parser.add_argument("-force", type=int, choices=[0,1], default=0, help="(Default 0) 1:rebuild outputs even if they are up to date.")
+    args = parser.parse_args()
+
+    if args.et == None or "{repk}" not in args.et or "{w}" not in args.et:
+        print('Please specify a path to save ET relation with {repk} and {w} placeholders.')
+        sys.exit()
+    elif args.tt == None or "{repk}" not in args.tt or "{expk}" not in args.tt or "{w}" not in args.tt:
+        print('Please specify a path to save TT relation with {repk}, {expk} and {w} placeholders.')
+        sys.exit()
+    elif args.cache != None and args.index != None:
+        print('Please use either -cache for exact search or -index for approximate search.')
+        sys.exit()
+
+    # Step 2: Skip settings whose outputs are up to date.
+    repk_list = sorted(set(args.repk))
+    max_repk = max(repk_list) if args.max_repk == None else args.max_repk
+    ann_config = None if args.index == None else {"index":args.index, "nprobe":args.nprobe, "rerank":args.rerank, "recall":args.recall}
+    repk_output_dict = get_sweep_output(repk_list, max_repk, sorted(set(args.expk)), sorted(set(args.w)), args.et, args.tt, args.sorted, ann_config)
+    output_dict = {path:param_dict for repk in repk_list for path, param_dict in repk_output_dict[repk].items()}
+    input_list = [args.info, args.embd] if args.index == None else [args.info, args.embd, args.index]
+    manifest, stale_list = check_stage("sweep_relations", input_list, output_dict, args.dry_run, args.force)
+    if not stale_list:
+        return
+    repk_list = [repk for repk in repk_list if any(path in stale_list for path in repk_output_dict[repk])]
+
+    print('Start generating ET and TT relations...')
+    start_run("sweep_relations", args.metrics, args.quiet)
+
+    # Step 3: Construct relations of every stale setting.
+    sweep_relations(args.info, args.embd, repk_list, max_repk, sorted(set(args.expk)), sorted(set(args.w)), args.et, args.tt, args.mem, ann_config, args.workers, args.sorted, args.cache)
+
+    save_stage_manifest(manifest, output_dict)
+    finish_run()
+    print('Finished generating ET and TT relations!\n')
+
+if __name__ == "__main__":
+    main()
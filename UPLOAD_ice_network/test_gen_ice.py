@@ -0,0 +1,81 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: test_gen_ice.py
+# Cont:
+#   Class:
+#       1) BinVersionTest
+#   Func:
+#       1) make_tiny_network
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from gen_ice import make_bin_version, swap_bin_network, save_ice_bin_network
+
+def make_tiny_network(bin_path, n_entities, weighted=1):
+    """ Save a tiny binary ICE network.
+    Param:
+        param1 [string] path to the directory to save in.
+        param2 [int] number of entities.
+        param3 [int] indicator of whether to use binary or real weights.
+    """
+    tt_matrix = csr_matrix(np.array([[1.0, 0.5, 0.0], [0.5, 1.0, 0.25], [0.0, 0.25, 1.0]]))
+    exp_et_matrix = csr_matrix(np.tile([[0.75, 0.5, 0.0]], (n_entities, 1)))
+    save_ice_bin_network(bin_path, exp_et_matrix, tt_matrix, ['e{}'.format(i) for i in range(n_entities)], ['a', 'b', 'c'], weighted)
+
+class BinVersionTest(unittest.TestCase):
+    """ Versions of a binary ICE network, see make_bin_version(). """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.tmp.name, 'bin')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_swap_keeps_one_version(self):
+        for n_entities in [2, 3]:
+            version_path = make_bin_version(self.bin_path)
+            make_tiny_network(version_path, n_entities)
+            swap_bin_network(version_path, self.bin_path)
+        self.assertEqual(os.path.realpath(self.bin_path), version_path)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['bin', os.path.basename(version_path)])
+
+    def test_keep_version_of_running_build(self):
+        # A child process makes a version and holds it until told to exit.
+        code = 'import sys; from gen_ice import make_bin_version; print(make_bin_version(sys.argv[1]), flush=True); sys.stdin.read()'
+        child = subprocess.Popen([sys.executable, '-c', code, self.bin_path], cwd=os.path.dirname(os.path.abspath(__file__)), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        running_path = child.stdout.readline().strip()
+
+        version_path = make_bin_version(self.bin_path)
+        self.assertTrue(os.path.isdir(running_path))
+        swap_bin_network(version_path, self.bin_path)
+
+        # Once the child is gone, its version is removed by the next build.
+        child.communicate('')
+        version_path = make_bin_version(self.bin_path)
+        self.assertFalse(os.path.exists(running_path))
+        self.assertFalse(os.path.exists(running_path + '.lock'))
+        self.assertTrue(os.path.isdir(os.path.realpath(self.bin_path)))
+        swap_bin_network(version_path, self.bin_path)
+
+if __name__ == '__main__':
+    unittest.main()
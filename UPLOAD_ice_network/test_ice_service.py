@@ -0,0 +1,101 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: test_ice_service.py
+# Cont:
+#   Class:
+#       1) ICEServiceSwapTest               2) ICEIndexTest
+
+import os
+import tempfile
+import unittest
+from gen_ice import make_bin_version, swap_bin_network
+from ice_service import ICEIndex, ICEService
+from test_gen_ice import make_tiny_network
+
+class ICEServiceSwapTest(unittest.TestCase):
+    """ Hot swap of a served network, see ICEService.reload(). """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.tmp.name, 'bin')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_migrate_directory_to_version(self):
+        # A network saved as a plain directory before versions were used.
+        make_tiny_network(self.bin_path, 2)
+        service = ICEService(self.bin_path)
+        self.assertEqual(service.expand('e1', 1), [['a', 0.75]])
+
+        # The path is missing while the directory is moved aside.
+        os.rename(self.bin_path, self.bin_path + '.moved')
+        self.assertFalse(service.reload())
+        self.assertEqual(len(service.index.entity_list), 2)
+        self.assertEqual(service.expand('e1', 1), [['a', 0.75]])
+        os.rename(self.bin_path + '.moved', self.bin_path)
+
+        # The first swap replaces the directory with a symlink to a version.
+        version_path = make_bin_version(self.bin_path)
+        make_tiny_network(version_path, 3)
+        swap_bin_network(version_path, self.bin_path)
+        self.assertTrue(os.path.islink(self.bin_path))
+        self.assertTrue(service.reload())
+        self.assertEqual(len(service.index.entity_list), 3)
+        self.assertEqual(service.expand('e2', 1), [['a', 0.75]])
+
+    def test_keep_index_if_removed_while_loading(self):
+        version_path = make_bin_version(self.bin_path)
+        make_tiny_network(version_path, 2)
+        swap_bin_network(version_path, self.bin_path)
+        service = ICEService(self.bin_path)
+
+        # A version whose meta files exist but whose stores are gone.
+        version_path = make_bin_version(self.bin_path)
+        make_tiny_network(version_path, 3)
+        swap_bin_network(version_path, self.bin_path)
+        os.remove(os.path.join(version_path, 'et', 'indptr.npy'))
+        self.assertFalse(service.reload())
+        self.assertEqual(len(service.index.entity_list), 2)
+
+class ICEIndexTest(unittest.TestCase):
+    """ Lookups of a served network, see ICEIndex. """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.tmp.name, 'bin')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_weighted_topn(self):
+        make_tiny_network(self.bin_path, 2)
+        index = ICEIndex(self.bin_path)
+        self.assertEqual(index.expand('e0', 1), [['a', 0.75]])
+        self.assertEqual(index.neighbors('b', 2), [['b', 1.0], ['a', 0.5]])
+        self.assertEqual(index.expand('x', 1), None)
+
+    def test_unweighted_topn(self):
+        make_tiny_network(self.bin_path, 2, weighted=0)
+        index = ICEIndex(self.bin_path)
+        self.assertEqual(index.expand('e0'), [['a', 1.0], ['b', 1.0]])
+        with self.assertRaises(ValueError):
+            index.expand('e0', 1)
+        self.assertEqual(index.neighbors('b', 2), [['b', 1.0], ['a', 0.5]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+
+# Proj: Item Concept Embedding (ICE)
+# File: update_ice.py
+# Cont:
+#   Func:
+#       1) get_user_input                   2) load_ice_meta
+#       3) load_ice_bin_network             4) merge_et_rows
+#       5) update_ice_bin_network
+
+import argparse
+import json
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+from scipy.sparse import vstack
+from sparse_store import load_sparse_store, SparseStoreWriter
+from gen_ice import ICE_META, gen_et_network, et2sparse_mat, prune_exp_block, gen_tt_power, save_ice_et_network, make_bin_version, swap_bin_network
+
+def get_user_input():
+    """ Get inputs from user.
+    Return:
+        return1 [string] path to the binary ICE network to update.
+        return2 [string] path to load the entity-text relation edge list of new
+            or changed entities.
+        return3 [list] of string paths to save the expanded entity-text
+            subnetwork within the updated ICE network.
+        return4 [int] indicator of whether to save lines sorted as `sort` does.
+        return5 [int] number of previous entities to copy at a time.
+        return6 [string] directory to cache pruned TT powers in, or None.
+    """
+    PARSER = argparse.ArgumentParser(description='Update binary ICE network with new or changed entities.')
+    PARSER.add_argument('-ice_bin', help='Path to binary ICE network saved by gen_ice.py, swapped for the updated one.')
+    PARSER.add_argument('-et', help='Path to load ET relation edge list or binary store of new or changed entities.')
+    PARSER.add_argument('-ice_et', help='(Optional) Path to save ET part of the updated ICE network.')
+    PARSER.add_argument('-block', type=int, default=65536, help='(Default 65536) Number of previous entities to copy at a time.')
+    PARSER.add_argument('-power_cache', help='(Optional) Directory to cache pruned TT powers in for networks of over 1 hop.')
+    PARSER.add_argument('-sorted', type=int, default=0, choices=[0,1], help='(Default) 0:entity and word order / 1:sorted as `sort` does.')
+    CONFIG = PARSER.parse_args()
+
+    if CONFIG.ice_bin == None or not os.path.isfile(os.path.join(CONFIG.ice_bin, ICE_META)):
+        print('Please specify a binary ICE network saved by gen_ice.py with -ice_bin.')
+        sys.exit()
+    elif CONFIG.et == None:
+        print('Please specify a path to load ET relation edge list of new or changed entities.')
+        sys.exit()
+
+    et_save_list = [] if CONFIG.ice_et == None else [(CONFIG.ice_et, 'w')]
+
+    return CONFIG.ice_bin, CONFIG.et, et_save_list, CONFIG.sorted, CONFIG.block, CONFIG.power_cache
+
+
+def load_ice_meta(bin_path):
+    """ Load the settings a binary ICE network was built with.
+    Param:
+        param1 [string] path to the binary ICE network directory.
+    Return:
+        return1 [dict] where key="weighted", "topn", "min_w" and "hops" &
+            val=the respective setting of gen_ice.save_ice_bin_network().
+    Note:
+        1) Networks saved before these settings were recorded were built
+            without pruning and with 1 hop.
+    """
+    with open(os.path.join(bin_path, ICE_META)) as f:
+        meta = json.load(f)
+
+    return dict({'topn':0, 'min_w':0, 'hops':1}, **meta)
+
+
+def load_ice_bin_network(bin_path):
+    """ Load a binary ICE network saved by gen_ice.save_ice_bin_network().
+    Param:
+        param1 [string] path to the binary ICE network directory.
+    Return:
+        return1 [csr_matrix] memory-mapped expanded entity-text network.
+        return2 [csr_matrix] memory-mapped text-text network with real weights.
+        return3 [list] where index=row number & val=entity.
+        return4 [list] where index=row and col number & val=word.
+        return5 [int] indicator of whether the network uses binary or real
+            weights.
+    Note:
+        1) param1 is resolved once, so every store comes from the same version
+            even if param1 is swapped meanwhile, see gen_ice.swap_bin_network().
+    """
+    bin_path = os.path.realpath(bin_path)
+    weighted = load_ice_meta(bin_path)['weighted']
+
+    exp_et_matrix, entity_list, word_list = load_sparse_store(os.path.join(bin_path, 'et'))
+    tt_matrix, _, _ = load_sparse_store(os.path.join(bin_path, 'tt' if weighted else 'tt_weight'))
+
+    return exp_et_matrix, tt_matrix, entity_list, word_list, weighted
+
+
+def merge_et_rows(prev_matrix, prev_entity_list, delta_matrix, delta_entity_list, store_path, col_items, block_size=65536):
+    """ Save previous rows with rows of changed entities replaced and rows of
+    new entities appended as a binary sparse store.
+    Param:
+        param1 [csr_matrix] memory-mapped expanded entity-text network of the
+            previous build.
+        param2 [list] where index=row number of param1 & val=entity.
+        param3 [csr_matrix] expanded entity-text network of new or changed
+            entities with the same cols as param1.
+        param4 [list] where index=row number of param3 & val=entity.
+        param5 [string] path to the store directory to create.
+        param6 [list] where index=col number & val=word.
+        param7 [int] number of previous rows to copy at a time.
+    Return:
+        return1 [list] where index=row number of the saved store & val=entity.
+        return2 [int] number of replaced rows.
+        return3 [int] number of appended rows.
+    Note:
+        1) Rows of unchanged entities are copied as they are, and new entities
+            follow in their order in param4, the same as a full rebuild from the
+            previous ET relation with changed lines replaced and new lines
+            appended.
+        2) Only one block of param7 previous rows is held in memory at a time.
+    """
+    entity2row = {entity:row for row, entity in enumerate(prev_entity_list)}
+    delta2row = np.array([entity2row.get(entity, -1) for entity in delta_entity_list], dtype=np.int64)
+    replaced = np.flatnonzero(delta2row >= 0)
+    added = np.flatnonzero(delta2row < 0)
+    prev2delta = np.full(len(prev_entity_list), -1, dtype=np.int64)
+    prev2delta[delta2row[replaced]] = replaced
+    et_store = SparseStoreWriter(store_path, len(col_items), prev_matrix.dtype)
+
+    # Step 1: Copy previous rows block by block with changed rows swapped in.
+    for start in range(0, len(prev_entity_list), block_size):
+        block = prev_matrix[start:start+block_size]
+        block2delta = prev2delta[start:start+block_size]
+        changed = np.flatnonzero(block2delta >= 0)
+        if len(changed):
+            row_order = np.arange(block.shape[0])
+            row_order[changed] = block.shape[0] + np.arange(len(changed))
+            block = vstack([block, delta_matrix[block2delta[changed]]], format='csr')[row_order]
+        et_store.append(block)
+
+    # Step 2: Append rows of new entities and extend entity index.
+    et_store.append(delta_matrix[added])
+    entity_list = list(prev_entity_list) + [delta_entity_list[index] for index in added.tolist()]
+    et_store.close(entity_list, col_items)
+
+    return entity_list, len(replaced), len(added)
+
+
+def update_ice_bin_network(bin_path, delta_et_path, block_size=65536, power_root=None):
+    """ Update a binary ICE network with new or changed entities.
+    Param:
+        param1 [string] path to the binary ICE network directory.
+        param2 [string] path to an edge list file or binary sparse store of the
+            ET relation of new or changed entities.
+        param3 [int] number of previous entities to copy at a time.
+        param4 [string] directory to cache pruned TT powers in, or None.
+    Return:
+        return1 [csr_matrix] memory-mapped updated expanded entity-text network.
+        return2 [list] where index=row number & val=entity.
+        return3 [list] where index=col number & val=word.
+        return4 [int] indicator of whether the network uses binary or real
+            weights.
+    Note:
+        1) Only rows of entities in param2 are expanded. The TT network and
+            word index are reused as they are, so every word in param2 must be
+            in the previous TT network.
+        2) A changed entity is given by all of its ET edges, which replace its
+            row as a whole.
+        3) New rows are expanded over the number of hops and pruned with the
+            settings in ice.json, see gen_ice.gen_tt_power() and
+            gen_ice.prune_exp_block().
+        4) The updated network is saved as a new version, with the TT stores
+            hard-linked from the previous one, and swapped in as a whole, see
+            gen_ice.swap_bin_network().
+    """
+    # Step 1: Load the previous build.
+    prev_path = os.path.realpath(bin_path)
+    prev_matrix, tt_matrix, prev_entity_list, word_list, weighted = load_ice_bin_network(prev_path)
+    meta = load_ice_meta(prev_path)
+
+    # Step 2: Expand new or changed entities only.
+    et_edges, delta_entity_list, et_word_list = gen_et_network(delta_et_path, tt_matrix.dtype)
+    word2index = {word:index for index, word in enumerate(word_list)}
+    with tempfile.TemporaryDirectory() as tmp_root:
+        tt_power = gen_tt_power(tt_matrix, word_list, meta['hops'], tmp_root if power_root == None else power_root, block_size, meta['topn'], meta['min_w'])
+        delta_matrix = et2sparse_mat(et_edges, et_word_list, word2index, len(delta_entity_list)).dot(tt_power)
+        del tt_power
+    delta_matrix.sort_indices()
+    delta_matrix, n_pruned = prune_exp_block(delta_matrix, meta['topn'], meta['min_w'])
+    if meta['topn'] > 0 or meta['min_w'] > 0:
+        print('Pruned {} of {} expanded edges of new or changed entities.'.format(n_pruned, delta_matrix.nnz + n_pruned))
+    delta_matrix.eliminate_zeros()
+    if not weighted:
+        delta_matrix.data[:] = 1.0
+
+    # Step 3: Save a new version with merged ET rows and swap it in.
+    version_path = make_bin_version(bin_path)
+    entity_list, n_replaced, n_added = merge_et_rows(prev_matrix, prev_entity_list, delta_matrix, delta_entity_list, os.path.join(version_path, 'et'), word_list, block_size)
+    for name in ['tt', 'tt_weight']:
+        if os.path.isdir(os.path.join(prev_path, name)):
+            shutil.copytree(os.path.join(prev_path, name), os.path.join(version_path, name), copy_function=os.link)
+    shutil.copy2(os.path.join(prev_path, ICE_META), os.path.join(version_path, ICE_META))
+    swap_bin_network(version_path, bin_path)
+    matrix, _, _ = load_sparse_store(os.path.join(version_path, 'et'))
+    print('Replaced', n_replaced, 'entities and added', n_added, 'entities. Leaving', len(entity_list), 'entities.')
+
+    return matrix, entity_list, word_list, weighted
+
+
+def main():
+    # Step 0: Get inputs from user.
+    bin_path, et_path, et_save_list, sort_lines, block_size, power_root = get_user_input()
+
+    print('\nStart updating ICE network!')
+    print('Step 1: Expand new or changed entities and update binary ICE network...')
+    exp_et_matrix, entity_list, word_list, w = update_ice_bin_network(bin_path, et_path, block_size, power_root)
+
+    if et_save_list:
+        print('Step 2: Save ET part of the updated ICE network...')
+        save_ice_et_network(exp_et_matrix, entity_list, word_list, et_save_list, w, sort_lines)
+
+    print('Finished updating ICE network!\n')
+
+if __name__ == '__main__':
+    main()